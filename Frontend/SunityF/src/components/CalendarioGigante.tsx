@@ -1,12 +1,11 @@
 // src/components/CalendarioGigante.tsx
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import FullCalendar from "@fullcalendar/react";
 import dayGridPlugin from "@fullcalendar/daygrid";
 import interactionPlugin from "@fullcalendar/interaction";
-import type { EventClickArg } from "@fullcalendar/core";
+import type { EventClickArg, DatesSetArg } from "@fullcalendar/core";
 import { GoogleMap, Marker, useLoadScript } from '@react-google-maps/api';
 import "./Styles/CalendarioGigante.css";
-import { getProfile } from './funciones';
 
 interface Evento {
   id: string;
@@ -36,7 +35,6 @@ const CalendarioGigante: React.FC = () => {
   const [loading, setLoading] = useState(true);
   const [participantesEvento, setParticipantesEvento] = useState<Participante[]>([]);
   const [showConfirmar, setShowConfirmar] = useState(false);
-  const [usuarioId, setUsuarioId] = useState<string | null>(null);
 
 
   const { isLoaded } = useLoadScript({
@@ -52,42 +50,68 @@ const CalendarioGigante: React.FC = () => {
     6: "🏐",
   };
 
-  useEffect(() => {
-    const fetchEventos = async () => {
-      try {
-        const response = await fetch("http://localhost:8000/mis-eventos", {
-          credentials: "include",
-        });
-        const data = await response.json();
-
-        if (data.ok) {
-          const eventosFormateados: Evento[] = data.eventos.map((e: any) => ({
-            id: e.evento_id.toString(),
-            title: e.nombre,
-            start: e.fecha_hora,
-            description: e.descripcion ?? "Sin descripción",
-            tipo: e.tipo ?? "participante",
-            lugar: e.lugar ?? "Lugar no disponible",
-            latitud: e.latitud ?? 0,
-            longitud: e.longitud ?? 0,
-            precio: e.precio ?? 0,
-            participantes: `${e.inscritos ?? 0} / ${e.max_participantes ?? 0}`,
-            grupo_id: e.grupo_id ?? 0,
-          }));
-          setEventos(eventosFormateados);
-        } else {
-          console.error("Error cargando eventos:", data);
-        }
-      } catch (err) {
-        console.error("Error conectando al backend:", err);
-      } finally {
-        setLoading(false);
+  // Último rango pedido al backend, para no repetir la misma consulta
+  const rangoActual = useRef<string>("");
+
+  // Fecha local en formato YYYY-MM-DD
+  const aFechaISO = (fecha: Date) => {
+    const mes = String(fecha.getMonth() + 1).padStart(2, "0");
+    const dia = String(fecha.getDate()).padStart(2, "0");
+    return `${fecha.getFullYear()}-${mes}-${dia}`;
+  };
+
+  // Solo se piden los eventos del rango visible (desde inclusive, hasta exclusivo)
+  const fetchEventos = async (desde: Date, hasta: Date) => {
+    const clave = `${aFechaISO(desde)}|${aFechaISO(hasta)}`;
+    if (rangoActual.current === clave) return;
+    rangoActual.current = clave;
+
+    try {
+      const response = await fetch(
+        `http://localhost:8000/calendario?desde=${aFechaISO(desde)}&hasta=${aFechaISO(hasta)}`,
+        { credentials: "include" }
+      );
+      const data = await response.json();
+
+      if (data.ok) {
+        const eventosFormateados: Evento[] = data.eventos.map((e: any) => ({
+          id: e.evento_id.toString(),
+          title: e.nombre,
+          start: e.fecha_hora,
+          description: e.descripcion ?? "Sin descripción",
+          tipo: e.tipo ?? "participante",
+          lugar: e.lugar ?? "Lugar no disponible",
+          latitud: e.latitud ?? 0,
+          longitud: e.longitud ?? 0,
+          precio: e.precio ?? 0,
+          participantes: `${e.inscritos ?? 0} / ${e.max_participantes ?? 0}`,
+          grupo_id: e.grupo_id ?? 0,
+        }));
+        setEventos(eventosFormateados);
+      } else {
+        console.error("Error cargando eventos:", data);
       }
-    };
+    } catch (err) {
+      console.error("Error conectando al backend:", err);
+    } finally {
+      setLoading(false);
+    }
+  };
 
-    fetchEventos();
+  // Carga inicial: la grilla del mes actual (6 semanas desde el lunes anterior al día 1)
+  useEffect(() => {
+    const hoy = new Date();
+    const desde = new Date(hoy.getFullYear(), hoy.getMonth(), 1);
+    desde.setDate(desde.getDate() - ((desde.getDay() + 6) % 7));
+    const hasta = new Date(desde);
+    hasta.setDate(hasta.getDate() + 42);
+    fetchEventos(desde, hasta);
   }, []);
 
+  const handleDatesSet = (arg: DatesSetArg) => {
+    fetchEventos(arg.start, arg.end);
+  };
+
   const handleEventClick = (clickInfo: EventClickArg) => {
     const evento = eventos.find((e) => e.id === clickInfo.event.id) ?? null;
     setEventoSeleccionado(evento);
@@ -149,32 +173,11 @@ const CalendarioGigante: React.FC = () => {
     }
   };
 
-// Obtener el ID del usuario activo al montar el componente
-useEffect(() => {
-  const fetchUserId = async () => {
-    try {
-      const perfil = await getProfile();
-      if (perfil?.user?.id) {
-        console.log("✅ Usuario activo:", perfil.user.id);
-        setUsuarioId(perfil.user.id.toString());
-      } else {
-        console.warn("⚠️ No se encontró el ID del usuario en getProfile:", perfil);
-      }
-    } catch (error) {
-      console.error("❌ Error obteniendo perfil del usuario:", error);
-    }
-  };
-  fetchUserId();
-}, []);
-
-
 // Manejo de salida o cancelación de evento
 const manejarSalidaEvento = async (eventoId: string) => {
   try {
-    const evento = eventos.find((e) => e.id === eventoId);
-    const motivo = evento?.tipo === "anfitrion" ? "cancelacion_evento" : "abandono_evento";
-
-    // Primero, salir o cancelar el evento
+    // Salir o cancelar el evento (el backend registra el abandono y, si fue
+    // a última hora, aplica la penalización cuando termina el evento)
     const res = await fetch(`http://localhost:8000/eventos/${eventoId}/salir`, {
       method: "POST",
       credentials: "include",
@@ -185,27 +188,6 @@ const manejarSalidaEvento = async (eventoId: string) => {
 
     alert(data.message);
 
-    // Luego, aplicar calificación automática del sistema
-    if (usuarioId) {
-      try {
-        const calificacionRes = await fetch(
-          `http://localhost:8000/calificaciones/sistema/${usuarioId}?estrellas=1&motivo=${motivo}`,
-          {
-            method: "POST",
-            credentials: "include",
-          }
-        );
-
-        const calificacionData = await calificacionRes.json();
-        if (!calificacionRes.ok)
-          throw new Error(calificacionData.detail || "Error al crear la calificación del sistema");
-
-        console.log("✅ Calificación de sistema creada:", calificacionData);
-      } catch (error: any) {
-        console.error("❌ Error al calificar automáticamente:", error.message);
-      }
-    }
-
     // Quitar evento del calendario
     setEventos((prev) => prev.filter((e) => e.id !== eventoId));
     setEventoSeleccionado(null);
@@ -256,6 +238,7 @@ const manejarSalidaEvento = async (eventoId: string) => {
                 className: obtenerClaseEvento(evento.tipo),
               }))}
               eventClick={handleEventClick}
+              datesSet={handleDatesSet}
               headerToolbar={{
                 left: "prev,next",
                 center: "title",
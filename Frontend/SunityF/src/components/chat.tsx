@@ -2,7 +2,7 @@ import { IonInput, IonButton, IonItem, IonLabel, IonList } from '@ionic/react';
 import { useEffect, useState, useRef } from 'react';
 import { useHistory } from 'react-router-dom';
 import './Styles/Chat.css';
-import { getProfile } from '../components/funciones';
+import { getProfile, getAmigos } from '../components/funciones';
 
 interface Usuario {
   google_id: string;
@@ -39,11 +39,7 @@ const Chat: React.FC = () => {
           foto_perfil: undefined,
         });
 
-        const res = await fetch('http://localhost:8000/amistad/lista', { credentials: 'include' });
-        if (res.ok) {
-          const dataAmigos = await res.json();
-          setAmigos(dataAmigos.amigos);
-        }
+        setAmigos(await getAmigos());
       } catch {
         history.push('/home');
       }
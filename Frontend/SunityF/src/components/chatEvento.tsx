@@ -108,7 +108,17 @@ const ChatEvento: React.FC = () => {
       `ws://localhost:8000/chat/ws-evento/${selectedEvento.evento_id}`
     );
     wsRef.current.onmessage = async (event) => {
-      const msg: Mensaje = JSON.parse(event.data);
+      const data = JSON.parse(event.data);
+
+      // Aviso del servidor: el anfitrión canceló el evento
+      if (data.tipo === "evento_cancelado") {
+        alert(`El evento "${data.nombre}" fue cancelado por el anfitrión`);
+        setEventos((prev) => prev.filter((e) => e.evento_id !== data.evento_id));
+        setSelectedEvento(null);
+        return;
+      }
+
+      const msg: Mensaje = data;
       setMensajes((prev) => [...prev, msg]);
 
       if (!usuariosCache[msg.remitente_id]) {
@@ -81,4 +81,19 @@ export const uploadProfilePhoto = async (formData: FormData) => {
   return await response.json(); // { ok, message, url }
 };
 
-;
+// Lista completa de amigos: /amistad/lista viene paginada, se siguen las páginas
+export const getAmigos = async () => {
+  const amigos: any[] = [];
+  let despues: string | null = null;
+  do {
+    const url = despues
+      ? `http://localhost:8000/amistad/lista?limite=200&despues=${encodeURIComponent(despues)}`
+      : "http://localhost:8000/amistad/lista?limite=200";
+    const res = await fetch(url, { credentials: "include" });
+    if (!res.ok) throw new Error("Error obteniendo amigos");
+    const data = await res.json();
+    amigos.push(...data.amigos);
+    despues = data.siguiente;
+  } while (despues);
+  return amigos;
+};
@@ -5,7 +5,7 @@ import './Styles/Amigos.css';
 import Logo from "../components/Imagenes/logo.png";
 import { useHistory } from 'react-router-dom';
 import { useEffect, useState } from 'react';
-import { getProfile } from '../components/funciones';
+import { getProfile, getAmigos } from '../components/funciones';
 
 interface Usuario {
   google_id: string;
@@ -52,11 +52,7 @@ const Amigos: React.FC = () => {
   const cargarDatos = async () => {
     try {
       // Lista de amigos
-      const resAmigos = await fetch('http://localhost:8000/amistad/lista', {
-        credentials: 'include'
-      });
-      const dataAmigos = await resAmigos.json();
-      if (resAmigos.ok) setListaAmigos(dataAmigos.amigos);
+      setListaAmigos(await getAmigos());
 
       // Solicitudes recibidas
       const resRecibidas = await fetch('http://localhost:8000/amistad/solicitudes', {
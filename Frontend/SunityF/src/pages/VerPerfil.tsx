@@ -37,6 +37,7 @@ const VerPerfil: React.FC = () => {
   const [promedio, setPromedio] = useState<number>(0);
   const [cantidad, setCantidad] = useState<number>(0);
   const [detalles, setDetalles] = useState<any[]>([]);
+  const [siguienteDetalles, setSiguienteDetalles] = useState<number | null>(null);
   const [mostrarDetalles, setMostrarDetalles] = useState<boolean>(false);
 
 
@@ -112,6 +113,7 @@ const VerPerfil: React.FC = () => {
         const resDet = await fetch(`http://localhost:8000/calificaciones/${id}/detalles`);
         const dataDet = await resDet.json();
         setDetalles(dataDet.calificaciones);
+        setSiguienteDetalles(dataDet.siguiente);
       } catch (err) {
         console.error("Error cargando calificaciones:", err);
       }
@@ -120,6 +122,19 @@ const VerPerfil: React.FC = () => {
     fetchCalificaciones();
   }, [id]);
 
+  // Siguiente página de detalles (la lista viene paginada)
+  const cargarMasDetalles = async () => {
+    if (!id || siguienteDetalles === null) return;
+    try {
+      const res = await fetch(`http://localhost:8000/calificaciones/${id}/detalles?antes_de=${siguienteDetalles}`);
+      const data = await res.json();
+      setDetalles((prev) => [...prev, ...data.calificaciones]);
+      setSiguienteDetalles(data.siguiente);
+    } catch (err) {
+      console.error("Error cargando más calificaciones:", err);
+    }
+  };
+
 
   const handleSolicitud = async () => {
     if (!perfilDeOtroUsuario) return;
@@ -369,6 +384,11 @@ const VerPerfil: React.FC = () => {
                       ) : (
                         <p className="no-ratings-verperfil">Aún no tiene calificaciones.</p>
                       )}
+                      {siguienteDetalles !== null && (
+                        <button className="btn-detalles-calificaciones" onClick={cargarMasDetalles}>
+                          Ver más
+                        </button>
+                      )}
                     </div>
                   )}
                 </div>
@@ -0,0 +1,203 @@
+# archivo.py
+# Archivo de eventos pasados.
+#
+# Mueve los eventos más antiguos que ARCHIVO_HORIZONTE_DIAS (con sus
+# inscripciones y mensajes) a las tablas *_historico, particionadas por mes.
+# Así eventos_deportivos, usuarios_eventos y mensajes_eventos solo guardan
+# eventos recientes y próximos, y las consultas del día a día no recorren
+# el historial completo.
+#
+# Se ejecuta solo cada ARCHIVO_INTERVALO_HORAS desde main.py, o a mano:
+#     python archivo.py                        # archivar ahora
+#     python archivo.py --desprender 2024-03   # desprender las particiones de un mes
+from datetime import date, datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from bd import get_connection
+import asyncio
+import logging
+import os
+import sys
+
+log = logging.getLogger(__name__)
+
+ARCHIVO_HORIZONTE_DIAS = int(os.getenv("ARCHIVO_HORIZONTE_DIAS", "180"))
+ARCHIVO_INTERVALO_HORAS = float(os.getenv("ARCHIVO_INTERVALO_HORAS", "6"))
+ARCHIVO_EVENTOS_POR_LOTE = 500
+MESES_ADELANTE = 2  # Particiones creadas por adelantado más allá del horizonte
+
+# Clave del advisory lock: con varios workers, solo uno archiva a la vez
+LOCK_ARCHIVO = 7_302_001
+
+TABLAS_HISTORICAS = (
+    "eventos_deportivos_historico",
+    "usuarios_eventos_historico",
+    "mensajes_eventos_historico",
+)
+
+
+def fecha_limite() -> datetime:
+    """Los eventos anteriores a esta fecha se consideran históricos"""
+    return datetime.now() - timedelta(days=ARCHIVO_HORIZONTE_DIAS)
+
+
+def inicio_de_mes(fecha) -> date:
+    return date(fecha.year, fecha.month, 1)
+
+
+def mes_siguiente(mes: date) -> date:
+    return date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+
+
+def crear_particiones(cur, desde, hasta):
+    """Crea (si faltan) las particiones mensuales entre ambas fechas en las tres tablas"""
+    mes = inicio_de_mes(desde)
+    ultimo = inicio_de_mes(hasta)
+    while mes <= ultimo:
+        fin = mes_siguiente(mes)
+        for tabla in TABLAS_HISTORICAS:
+            cur.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {tabla}_{mes:%Y_%m}
+                PARTITION OF {tabla}
+                FOR VALUES FROM (%s) TO (%s)
+                """,
+                (mes, fin)
+            )
+        mes = fin
+
+
+def mover_lote(cur, limite: datetime) -> int:
+    """
+    Mueve un lote de eventos anteriores a 'limite' a las tablas históricas.
+    Cada tabla se mueve con un DELETE ... RETURNING dentro de un INSERT,
+    así las filas nunca quedan duplicadas ni perdidas.
+    """
+    cur.execute(
+        """
+        SELECT id, fecha_hora FROM eventos_deportivos
+        WHERE fecha_hora < %s AND estado = 'activo'
+        ORDER BY fecha_hora
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+        """,
+        (limite, ARCHIVO_EVENTOS_POR_LOTE)
+    )
+    lote = cur.fetchall()
+    if not lote:
+        return 0
+
+    ids = [e["id"] for e in lote]
+    crear_particiones(cur, lote[0]["fecha_hora"], lote[-1]["fecha_hora"])
+
+    cur.execute(
+        """
+        WITH movidos AS (
+            DELETE FROM mensajes_eventos m
+            USING eventos_deportivos e
+            WHERE m.evento_id = e.id AND e.id = ANY(%s)
+            RETURNING m.id, m.evento_id, m.remitente_id, m.mensaje, m.fecha_envio, e.fecha_hora
+        )
+        INSERT INTO mensajes_eventos_historico
+            (id, evento_id, remitente_id, mensaje, fecha_envio, fecha_evento)
+        SELECT * FROM movidos
+        """,
+        (ids,)
+    )
+    cur.execute(
+        """
+        WITH movidos AS (
+            DELETE FROM usuarios_eventos ue
+            USING eventos_deportivos e
+            WHERE ue.evento_id = e.id AND e.id = ANY(%s)
+            RETURNING ue.id, ue.usuario_id, ue.evento_id, ue.fecha_union, e.fecha_hora
+        )
+        INSERT INTO usuarios_eventos_historico
+            (id, usuario_id, evento_id, fecha_union, fecha_evento)
+        SELECT * FROM movidos
+        """,
+        (ids,)
+    )
+    cur.execute(
+        """
+        WITH movidos AS (
+            DELETE FROM eventos_deportivos
+            WHERE id = ANY(%s)
+            RETURNING id, grupo_id, anfitrion_id, nombre, descripcion, fecha_hora,
+                      lugar, latitud, longitud, max_participantes, precio, estado
+        )
+        INSERT INTO eventos_deportivos_historico
+            (id, grupo_id, anfitrion_id, nombre, descripcion, fecha_hora,
+             lugar, latitud, longitud, max_participantes, precio, estado)
+        SELECT * FROM movidos
+        """,
+        (ids,)
+    )
+    return len(ids)
+
+
+def archivar_eventos_pasados() -> int:
+    """Archiva por lotes (un commit por lote) y devuelve cuántos eventos movió"""
+    limite = fecha_limite()
+    total = 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s) AS tomado", (LOCK_ARCHIVO,))
+        if not cur.fetchone()["tomado"]:
+            return 0
+        try:
+            # Particiones listas por adelantado para los próximos meses en cruzar el horizonte
+            crear_particiones(cur, limite, limite + timedelta(days=31 * MESES_ADELANTE))
+            conn.commit()
+
+            while True:
+                movidos = mover_lote(cur, limite)
+                conn.commit()
+                total += movidos
+                if movidos < ARCHIVO_EVENTOS_POR_LOTE:
+                    break
+        finally:
+            conn.rollback()
+            cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ARCHIVO,))
+            conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return total
+
+
+def desprender_particiones(mes: date):
+    """
+    Desprende las particiones de un mes: quedan como tablas sueltas
+    listas para pg_dump o DROP, sin bloquear las tablas históricas.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        for tabla in TABLAS_HISTORICAS:
+            cur.execute(f"ALTER TABLE {tabla} DETACH PARTITION {tabla}_{mes:%Y_%m}")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+async def ciclo_archivo():
+    """Tarea de fondo: archiva cada ARCHIVO_INTERVALO_HORAS"""
+    while True:
+        try:
+            movidos = await run_in_threadpool(archivar_eventos_pasados)
+            if movidos:
+                log.info("Eventos movidos al histórico", extra={"movidos": movidos})
+        except Exception:
+            log.exception("Error archivando eventos pasados")
+        await asyncio.sleep(ARCHIVO_INTERVALO_HORAS * 3600)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--desprender":
+        mes = datetime.strptime(sys.argv[2], "%Y-%m").date()
+        desprender_particiones(mes)
+        print(f"Particiones de {mes:%Y-%m} desprendidas")
+    else:
+        print(f"Eventos archivados: {archivar_eventos_pasados()}")
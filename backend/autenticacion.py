@@ -0,0 +1,35 @@
+# autenticacion.py
+# Verificación del JWT de sesión (cookie access_token), compartida por main
+# y todos los routers.
+#
+# Solo se aceptan tokens de sesión: los de otros usos (ej. el feed .ics de
+# calendario.py) van firmados con otra clave y llevan "aud", así que aunque
+# se filtren no sirven como cookie.
+from fastapi import HTTPException
+from jose import jwt
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+JWT_SECRET = os.getenv("JWT_SECRET")
+JWT_ALG = "HS256"
+
+
+def decodificar_sesion(access_token: str) -> dict:
+    """Decodifica el JWT de sesión y devuelve su payload (sub, email, name)"""
+    if not access_token:
+        raise HTTPException(status_code=401, detail="No autorizado")
+    try:
+        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
+    except Exception:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    # Tokens con propósito propio (y los de feed antiguos, firmados con esta clave)
+    if "scope" in payload or "aud" in payload or not payload.get("sub"):
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return payload
+
+
+def verify_token(access_token: str) -> str:
+    """Decodifica el JWT y devuelve el google_id del usuario"""
+    return decodificar_sesion(access_token)["sub"].strip()
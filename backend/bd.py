@@ -1,9 +1,15 @@
 # bd.py
+import logging
 import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 import os
+import sys
+import time
 from dotenv import load_dotenv
 
+log = logging.getLogger(__name__)
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -13,14 +19,114 @@ DB_NAME = os.getenv("DB_NAME", "sunity_db")
 DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASS = os.getenv("DB_PASS", "")
 
+# =========================
+# Instrumentación
+# =========================
+# Todas las consultas pasan por los cursores de abajo, que las miden y avisan
+# a los observadores registrados (métricas, log de consultas lentas).
+# Cada consulta se nombra con el módulo y la función que la ejecutó,
+# ej: "main.get_eventos_por_grupo".
+_observadores_consultas = []  # función(nombre, sql, parametros, segundos)
+_observadores_conexion = []   # función(segundos)
+_modulos_observadores = set()
+
+
+def registrar_observador_consultas(funcion):
+    _observadores_consultas.append(funcion)
+    _modulos_observadores.add(funcion.__module__)
+
+
+def registrar_observador_conexion(funcion):
+    _observadores_conexion.append(funcion)
+
+
+def _frame_llamador(saltar=()):
+    # El primer frame fuera de bd y psycopg2 (execute_values llama a execute por dentro)
+    frame = sys._getframe(1)
+    while frame is not None:
+        modulo = frame.f_globals.get("__name__", "")
+        if modulo != __name__ and not modulo.startswith("psycopg2") and modulo not in saltar:
+            break
+        frame = frame.f_back
+    return frame
+
+
+def _nombre_consulta() -> str:
+    frame = _frame_llamador()
+    if frame is None:
+        return "desconocida"
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+def ubicacion_consulta() -> str:
+    """Archivo y línea de la consulta en curso (para llamar desde un observador)"""
+    frame = _frame_llamador(saltar=_modulos_observadores)
+    if frame is None:
+        return "desconocida"
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno}"
+
+
+def _avisar(nombre: str, sql, parametros, segundos: float):
+    for observador in _observadores_consultas:
+        try:
+            observador(nombre, sql, parametros, segundos)
+        except Exception:
+            log.exception("Error en observador de consultas")
+
+
+class _Medido:
+    def execute(self, query, vars=None):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _avisar(_nombre_consulta(), query, vars, time.perf_counter() - inicio)
+
+    def executemany(self, query, vars_list):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _avisar(_nombre_consulta(), query, None, time.perf_counter() - inicio)
+
+
+class CursorMedido(_Medido, psycopg2.extensions.cursor):
+    pass
+
+
+class RealDictCursorMedido(_Medido, RealDictCursor):
+    pass
+
+
+_CURSORES_MEDIDOS = {
+    None: RealDictCursorMedido,  # el cursor por defecto de get_connection
+    RealDictCursor: RealDictCursorMedido,
+    psycopg2.extensions.cursor: CursorMedido,
+}
+
+
+class ConexionMedida(psycopg2.extensions.connection):
+    """Cambia los cursores pedidos por su versión medida"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory")
+        kwargs["cursor_factory"] = _CURSORES_MEDIDOS.get(factory, factory)
+        return super().cursor(*args, **kwargs)
+
+
 # Función para conectarse a la base de datos
 def get_connection():
+    inicio = time.perf_counter()
     conn = psycopg2.connect(
         host=DB_HOST,
         port=DB_PORT,
         database=DB_NAME,
         user=DB_USER,
         password=DB_PASS,
+        connection_factory=ConexionMedida,
         cursor_factory=RealDictCursor  # para devolver diccionarios en vez de tuplas
     )
+    segundos = time.perf_counter() - inicio
+    for observador in _observadores_conexion:
+        observador(segundos)
     return conn
@@ -0,0 +1,446 @@
+# bench/carga.py
+# Pruebas de carga contra un Postgres local.
+#
+# Recrea la BD BENCH_DB_NAME desde basededatos.sql, carga datos de prueba,
+# levanta la app en un subproceso (bench.servidor, que acepta tokens de
+# Google falsos) y corre los escenarios:
+#   login     ráfaga de inicios de sesión (POST /auth/google)
+#   perfil    página de perfil: usuario, resumen y detalle de calificaciones
+#   eventos   listado de eventos de un grupo
+#   union     carrera por unirse a un evento popular con pocos cupos
+#   chat      cientos de websockets de chat abiertos a la vez
+# Reporta throughput y latencias p50/p95/p99 por escenario y los compara con
+# bench/linea_base.json: si alguno empeora más que la tolerancia, termina con
+# código 1 (sirve como chequeo en CI).
+#
+# Uso (desde backend/, con las mismas variables DB_* de la app):
+#   python -m bench.carga                       # corre y compara
+#   python -m bench.carga --guardar-linea-base  # corre y guarda la línea base
+#   python -m bench.carga --escenarios perfil,eventos --concurrencia 100
+from datetime import datetime, timedelta
+from psycopg2.extras import execute_values
+from websockets.asyncio.client import connect as conectar_ws
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import psycopg2
+import random
+import subprocess
+import sys
+import time
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(DIRECTORIO)
+ESQUEMA = os.path.join(BACKEND, "..", "basededatos.sql")
+LINEA_BASE = os.path.join(DIRECTORIO, "linea_base.json")
+
+BENCH_DB_NAME = os.getenv("BENCH_DB_NAME", "sunity_bench")
+DB_CONEXION = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": os.getenv("DB_PORT", "5432"),
+    "user": os.getenv("DB_USER", "postgres"),
+    "password": os.getenv("DB_PASS", ""),
+}
+
+ESCENARIOS = ["login", "perfil", "eventos", "union", "chat"]
+GRUPOS = ["Fútbol", "Básquetbol", "Running", "Vóleibol", "Tenis"]
+UNIVERSIDADES = ["UdeC", "UCSC", "UBB", "UNAB", "USS"]
+CUPOS_EVENTO_POPULAR = 10
+
+
+# =========================
+# Base de datos de pruebas
+# =========================
+def conectar(base: str):
+    return psycopg2.connect(database=base, **DB_CONEXION)
+
+
+def recrear_bd(esquema: str):
+    if BENCH_DB_NAME == os.getenv("DB_NAME", "sunity_db"):
+        sys.exit("BENCH_DB_NAME no puede ser la misma BD de la app")
+    conn = conectar("postgres")
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'DROP DATABASE IF EXISTS "{BENCH_DB_NAME}"')
+    cur.execute(f"CREATE DATABASE \"{BENCH_DB_NAME}\" ENCODING 'UTF8' TEMPLATE template0")
+    conn.close()
+
+    conn = conectar(BENCH_DB_NAME)
+    with open(esquema, encoding="utf-8") as archivo:
+        conn.cursor().execute(archivo.read())
+    conn.commit()
+    conn.close()
+
+
+def cargar_datos(usuarios: int, semilla: int) -> dict:
+    """Datos mínimos y deterministas para los escenarios; devuelve los ids que usan"""
+    azar = random.Random(semilla)
+    ids = [f"bench-{i:05d}" for i in range(usuarios)]
+    ahora = datetime.now().replace(microsecond=0)
+
+    conn = conectar(BENCH_DB_NAME)
+    cur = conn.cursor()
+    execute_values(
+        cur,
+        "INSERT INTO usuarios (google_id, email, nombre, universidad_o_instituto, carrera, comuna, deporte_favorito) VALUES %s",
+        [
+            (gid, f"{gid}@bench.cl", f"Usuario {gid}", azar.choice(UNIVERSIDADES), "Ingeniería",
+             "Concepción", azar.choice(GRUPOS))
+            for gid in ids
+        ]
+    )
+    filas = execute_values(cur, "INSERT INTO grupos_deportivos (nombre) VALUES %s RETURNING id",
+                           [(g,) for g in GRUPOS], fetch=True)
+    grupo_ids = [fila[0] for fila in filas]
+
+    # 60 eventos por grupo, con 3 participantes además del anfitrión
+    eventos = []
+    for grupo_id in grupo_ids:
+        for i in range(60):
+            eventos.append((
+                grupo_id, azar.choice(ids), f"Evento {grupo_id}-{i}", "Partido de prueba",
+                ahora + timedelta(days=azar.randint(1, 60), hours=azar.randint(8, 20)),
+                "Cancha", -36.8 + azar.uniform(-0.1, 0.1), -73.0 + azar.uniform(-0.1, 0.1),
+                azar.randint(6, 20), azar.choice([0, 1000, 2000])
+            ))
+    filas = execute_values(
+        cur,
+        """
+        INSERT INTO eventos_deportivos
+            (grupo_id, anfitrion_id, nombre, descripcion, fecha_hora, lugar, latitud, longitud, max_participantes, precio)
+        VALUES %s RETURNING id, anfitrion_id
+        """,
+        eventos,
+        fetch=True
+    )
+    inscripciones = []
+    for evento_id, anfitrion_id in filas:
+        inscripciones.append((anfitrion_id, evento_id))
+        inscripciones += [(gid, evento_id) for gid in azar.sample(ids, 3) if gid != anfitrion_id]
+    execute_values(cur, "INSERT INTO usuarios_eventos (usuario_id, evento_id) VALUES %s", inscripciones)
+
+    # El evento popular: pocos cupos, todos intentan unirse a la vez
+    cur.execute(
+        """
+        INSERT INTO eventos_deportivos
+            (grupo_id, anfitrion_id, nombre, fecha_hora, lugar, max_participantes, precio)
+        VALUES (%s, %s, 'Final del campeonato', %s, 'Estadio', %s, 0) RETURNING id
+        """,
+        (grupo_ids[0], ids[0], ahora + timedelta(days=7), CUPOS_EVENTO_POPULAR)
+    )
+    evento_popular = cur.fetchone()[0]
+    cur.execute("INSERT INTO usuarios_eventos (usuario_id, evento_id) VALUES (%s, %s)", (ids[0], evento_popular))
+
+    # 10 calificaciones recibidas por usuario
+    calificaciones = []
+    for gid in ids:
+        evaluadores = [e for e in azar.sample(ids, 11) if e != gid][:10]
+        calificaciones += [
+            (evaluador, gid, azar.randint(1, 5), ahora - timedelta(days=azar.randint(0, 365)))
+            for evaluador in evaluadores
+        ]
+    execute_values(
+        cur,
+        "INSERT INTO calificaciones_usuarios (evaluador_id, evaluado_id, estrellas, fecha_calificacion) VALUES %s",
+        calificaciones
+    )
+    conn.commit()
+    conn.close()
+
+    # Los resúmenes se arman con el mismo código de la app
+    subprocess.run([sys.executable, "calificaciones.py", "--reconstruir"], cwd=BACKEND, env=_entorno_app(), check=True,
+                   stdout=subprocess.DEVNULL)
+    return {"usuarios": ids, "grupos": grupo_ids, "evento_popular": evento_popular}
+
+
+def inscritos(evento_id: int) -> int:
+    conn = conectar(BENCH_DB_NAME)
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM usuarios_eventos WHERE evento_id = %s", (evento_id,))
+    cantidad = cur.fetchone()[0]
+    conn.close()
+    return cantidad
+
+
+# =========================
+# Servidor
+# =========================
+def _entorno_app() -> dict:
+    entorno = dict(os.environ, DB_NAME=BENCH_DB_NAME)
+    entorno.setdefault("JWT_SECRET", "bench")
+    return entorno
+
+
+def levantar_servidor(puerto: int, workers: int) -> subprocess.Popen:
+    proceso = subprocess.Popen(
+        [sys.executable, "-m", "bench.servidor", "--puerto", str(puerto), "--workers", str(workers)],
+        cwd=BACKEND, env=_entorno_app(), stdout=subprocess.DEVNULL
+    )
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            sys.exit("El servidor terminó al iniciar")
+        try:
+            if httpx.get(f"http://127.0.0.1:{puerto}/grupos", timeout=1).status_code == 200:
+                return proceso
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proceso.terminate()
+    sys.exit("El servidor no respondió en 30 segundos")
+
+
+# =========================
+# Medición
+# =========================
+def percentil(ordenadas, q: float) -> float:
+    if not ordenadas:
+        return 0.0
+    return ordenadas[min(len(ordenadas) - 1, int(round(q * (len(ordenadas) - 1))))]
+
+
+def resumir(latencias_ms, errores: int, segundos: float) -> dict:
+    ordenadas = sorted(latencias_ms)
+    return {
+        "peticiones": len(ordenadas),
+        "errores": errores,
+        "rps": round(len(ordenadas) / segundos, 1) if segundos else 0.0,
+        "p50_ms": round(percentil(ordenadas, 0.50), 2),
+        "p95_ms": round(percentil(ordenadas, 0.95), 2),
+        "p99_ms": round(percentil(ordenadas, 0.99), 2),
+    }
+
+
+async def correr(peticiones, concurrencia: int) -> dict:
+    """
+    Ejecuta las peticiones (funciones async que devuelven True si salió bien)
+    con a lo más `concurrencia` en vuelo y mide cada una.
+    """
+    pendientes = iter(peticiones)
+    latencias, errores = [], 0
+
+    async def trabajador():
+        nonlocal errores
+        for peticion in pendientes:
+            inicio = time.perf_counter()
+            try:
+                ok = await peticion()
+            except Exception:
+                ok = False
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            if not ok:
+                errores += 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(trabajador() for _ in range(concurrencia)))
+    return resumir(latencias, errores, time.perf_counter() - inicio)
+
+
+def cookie(token: str) -> dict:
+    return {"Cookie": f"access_token={token}"}
+
+
+# =========================
+# Escenarios
+# =========================
+async def escenario_login(cliente, datos, args, tokens):
+    async def login(gid):
+        respuesta = await cliente.post("/auth/google", json={"id_token": f"bench:{gid}"})
+        if respuesta.status_code != 200:
+            return False
+        tokens[gid] = respuesta.json()["token"]
+        return True
+
+    return await correr([lambda gid=gid: login(gid) for gid in datos["usuarios"]], args.concurrencia)
+
+
+async def escenario_perfil(cliente, datos, args, tokens):
+    azar = random.Random(args.semilla)
+
+    async def perfil(gid, visitante):
+        encabezados = cookie(tokens[visitante])
+        respuestas = await asyncio.gather(
+            cliente.get(f"/usuarios/{gid}", headers=encabezados),
+            cliente.get(f"/calificaciones/{gid}", headers=encabezados),
+            cliente.get(f"/calificaciones/{gid}/detalles", headers=encabezados),
+        )
+        return all(r.status_code == 200 for r in respuestas)
+
+    visitantes = list(tokens)
+    peticiones = [
+        lambda gid=azar.choice(datos["usuarios"]), v=azar.choice(visitantes): perfil(gid, v)
+        for _ in range(args.peticiones)
+    ]
+    return await correr(peticiones, args.concurrencia)
+
+
+async def escenario_eventos(cliente, datos, args, tokens):
+    azar = random.Random(args.semilla)
+
+    async def listar(grupo_id):
+        return (await cliente.get(f"/grupos/{grupo_id}/eventos")).status_code == 200
+
+    return await correr(
+        [lambda g=azar.choice(datos["grupos"]): listar(g) for _ in range(args.peticiones)],
+        args.concurrencia
+    )
+
+
+async def escenario_union(cliente, datos, args, tokens):
+    evento_id = datos["evento_popular"]
+
+    async def unirse(gid):
+        respuesta = await cliente.post(f"/eventos/{evento_id}/unirse", headers=cookie(tokens[gid]))
+        # Quedarse sin cupo es el resultado esperado para la mayoría
+        return respuesta.status_code == 200 or (
+            respuesta.status_code == 400 and "máximo" in respuesta.json().get("detail", "")
+        )
+
+    candidatos = [gid for gid in datos["usuarios"][1:] if gid in tokens]
+    resultado = await correr([lambda gid=gid: unirse(gid) for gid in candidatos], args.concurrencia)
+    # Más inscritos que cupos es una falla aunque todas las respuestas hayan sido válidas
+    resultado["sobrecupo"] = max(inscritos(evento_id) - CUPOS_EVENTO_POPULAR, 0)
+    resultado["errores"] += resultado["sobrecupo"]
+    return resultado
+
+
+async def escenario_chat(cliente, datos, args, tokens):
+    """Abre args.websockets chats en parejas y mide ida y vuelta de cada mensaje"""
+    usuarios = [gid for gid in datos["usuarios"] if gid in tokens][: args.websockets // 2 * 2]
+    url = str(cliente.base_url).replace("http", "ws", 1)
+    latencias, errores = [], 0
+    listos = asyncio.Barrier(len(usuarios))
+    # Nadie cierra hasta que todos terminen: el servidor reenvía al otro de la pareja
+    terminados = asyncio.Barrier(len(usuarios))
+
+    async def conversar(yo, otro):
+        nonlocal errores
+        try:
+            async with conectar_ws(f"{url}/chat/ws/{otro}", additional_headers=cookie(tokens[yo])) as ws:
+                await listos.wait()
+                for n in range(args.mensajes):
+                    texto = f"{yo} #{n}"
+                    inicio = time.perf_counter()
+                    await ws.send(json.dumps({"mensaje": texto}))
+                    # Llegan también los mensajes del otro: se espera el eco propio
+                    while True:
+                        mensaje = json.loads(await asyncio.wait_for(ws.recv(), timeout=30))
+                        if mensaje.get("remitente_id") == yo and mensaje.get("mensaje") == texto:
+                            break
+                    latencias.append((time.perf_counter() - inicio) * 1000)
+                await terminados.wait()
+        except Exception:
+            errores += 1
+            await listos.abort()
+            await terminados.abort()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(
+        conversar(usuarios[i], usuarios[i ^ 1]) for i in range(len(usuarios))
+    ))
+    resultado = resumir(latencias, errores, time.perf_counter() - inicio)
+    resultado["websockets"] = len(usuarios)
+    return resultado
+
+
+FUNCIONES = {
+    "login": escenario_login,
+    "perfil": escenario_perfil,
+    "eventos": escenario_eventos,
+    "union": escenario_union,
+    "chat": escenario_chat,
+}
+
+
+# =========================
+# Línea base
+# =========================
+def comparar(resultados: dict, base: dict, tolerancia: float) -> list:
+    """Devuelve la lista de regresiones respecto de la línea base"""
+    regresiones = []
+    for nombre, actual in resultados.items():
+        if actual["errores"]:
+            regresiones.append(f"{nombre}: {actual['errores']} errores")
+        anterior = base.get(nombre)
+        if not anterior:
+            continue
+        if actual["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p95 {actual['p95_ms']} ms (base {anterior['p95_ms']} ms)")
+        if actual["rps"] < anterior["rps"] * (1 - tolerancia):
+            regresiones.append(f"{nombre}: {actual['rps']} req/s (base {anterior['rps']} req/s)")
+    return regresiones
+
+
+def imprimir(resultados: dict, base: dict):
+    print(f"{'escenario':<10} {'peticiones':>10} {'errores':>8} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  base p95")
+    for nombre, r in resultados.items():
+        anterior = base.get(nombre, {}).get("p95_ms", "-")
+        print(f"{nombre:<10} {r['peticiones']:>10} {r['errores']:>8} {r['rps']:>9} "
+              f"{r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}  {anterior}")
+
+
+async def ejecutar(args, datos) -> dict:
+    tokens = {}
+    resultados = {}
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.puerto}", limits=limites, timeout=60) as cliente:
+        for nombre in args.escenarios:
+            # Todos los escenarios necesitan sesión: el login corre igual, aunque no se reporte
+            if nombre != "login" and not tokens:
+                await escenario_login(cliente, datos, args, tokens)
+            print(f"Corriendo {nombre}...", flush=True)
+            resultados[nombre] = await FUNCIONES[nombre](cliente, datos, args, tokens)
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pruebas de carga de Sunity")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--usuarios", type=int, default=500)
+    parser.add_argument("--peticiones", type=int, default=2000, help="por escenario (perfil, eventos)")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--websockets", type=int, default=200)
+    parser.add_argument("--mensajes", type=int, default=5, help="por websocket")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--esquema", default=ESQUEMA)
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="empeoramiento aceptado vs la línea base")
+    parser.add_argument("--guardar-linea-base", action="store_true")
+    args = parser.parse_args()
+    args.escenarios = [e for e in args.escenarios.split(",") if e]
+    desconocidos = set(args.escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        sys.exit(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+    print(f"Preparando {BENCH_DB_NAME} con {args.usuarios} usuarios...", flush=True)
+    recrear_bd(args.esquema)
+    datos = cargar_datos(args.usuarios, args.semilla)
+
+    servidor = levantar_servidor(args.puerto, args.workers)
+    try:
+        resultados = asyncio.run(ejecutar(args, datos))
+    finally:
+        servidor.terminate()
+        servidor.wait()
+
+    base = {}
+    if os.path.exists(LINEA_BASE) and not args.guardar_linea_base:
+        with open(LINEA_BASE, encoding="utf-8") as archivo:
+            base = json.load(archivo)
+    imprimir(resultados, base)
+
+    if args.guardar_linea_base:
+        with open(LINEA_BASE, "w", encoding="utf-8") as archivo:
+            json.dump(resultados, archivo, indent=2, ensure_ascii=False)
+        print(f"Línea base guardada en {LINEA_BASE}")
+        sys.exit(0)
+
+    regresiones = comparar(resultados, base, args.tolerancia)
+    if not base:
+        print("Sin línea base: se corre con --guardar-linea-base para crearla")
+    for regresion in regresiones:
+        print("REGRESIÓN", regresion)
+    sys.exit(1 if regresiones else 0)
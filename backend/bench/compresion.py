@@ -0,0 +1,46 @@
+# bench/compresion.py
+# Tamaño y costo de CPU de comprimir una respuesta de listado de eventos con
+# cada nivel de gzip y de brotli (si está instalado). De acá salen los
+# niveles por defecto de compresion.py. Usa las filas sintéticas de
+# bench/serializacion.py, no necesita BD.
+#
+# Uso (desde backend/):
+#   python -m bench.compresion [--filas 200] [--repeticiones 50]
+from bench.serializacion import filas_con_forma
+from serializacion import RespuestaJSON
+import argparse
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def medir(comprimir, cuerpo: bytes, repeticiones: int):
+    inicio = time.process_time()
+    for _ in range(repeticiones):
+        salida = comprimir(cuerpo)
+    return len(salida), (time.process_time() - inicio) / repeticiones * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara niveles de gzip y brotli sobre un listado de eventos")
+    parser.add_argument("--filas", type=int, default=200)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+
+    cuerpo = RespuestaJSON({"ok": True, "eventos": filas_con_forma(args.filas)}).body
+    print(f"Respuesta de {args.filas} eventos: {len(cuerpo):,} bytes")
+    print(f"{'codificación':<12} {'nivel':>5} {'bytes':>9} {'razón':>7} {'ms CPU':>8}")
+
+    for nivel in range(1, 10):
+        tamano, ms = medir(lambda c: zlib.compress(c, nivel, 16 + zlib.MAX_WBITS), cuerpo, args.repeticiones)
+        print(f"{'gzip':<12} {nivel:>5} {tamano:>9,} {tamano / len(cuerpo):>7.3f} {ms:>8.2f}")
+    if brotli is None:
+        print("brotli no está instalado (pip install brotli)")
+    else:
+        for nivel in range(0, 12):
+            tamano, ms = medir(lambda c: brotli.compress(c, quality=nivel), cuerpo, max(1, args.repeticiones // (10 if nivel > 9 else 1)))
+            print(f"{'br':<12} {nivel:>5} {tamano:>9,} {tamano / len(cuerpo):>7.3f} {ms:>8.2f}")
@@ -0,0 +1,379 @@
+# bench/generar_datos.py
+# Generador de datos sintéticos a escala de producción.
+#
+# Llena la BD configurada en DB_* (la misma de la app) con usuarios, grupos,
+# eventos repartidos por las regiones de Chile, inscripciones, amistades,
+# solicitudes pendientes, mensajes de amigos y de eventos, y calificaciones.
+# Todo es consistente entre sí: los participantes de un evento son en su
+# mayoría de la misma región, los mensajes de un evento son de sus
+# participantes y anteriores a la fecha, solo se califican eventos pasados
+# entre compañeros, y así.
+#
+# Las filas se arman en Python a medida que Postgres las pide por COPY, en
+# una sola transacción. Con la misma semilla y fecha base los datos son
+# idénticos. Los volúmenes por defecto son ~5 millones de filas; --escala
+# los multiplica todos.
+#
+# Uso (desde backend/):
+#   DB_NAME=sunity_bench python -m bench.generar_datos --vaciar
+#   DB_NAME=sunity_bench python -m bench.generar_datos --vaciar --escala 0.1 --semilla 7
+from datetime import date, datetime, time as hora, timedelta
+from bd import get_connection
+import argparse
+import random
+import time
+
+# Región -> [(comuna, latitud, longitud)], instituciones y peso en la población
+REGIONES = {
+    "Arica y Parinacota": ([("Arica", -18.4783, -70.3126)], ["UTA"], 1.3),
+    "Tarapacá": ([("Iquique", -20.2307, -70.1357), ("Alto Hospicio", -20.2690, -70.1010)], ["UNAP", "INACAP"], 2.0),
+    "Antofagasta": ([("Antofagasta", -23.6509, -70.3975), ("Calama", -22.4544, -68.9294)], ["UA", "UCN"], 3.6),
+    "Atacama": ([("Copiapó", -27.3668, -70.3314), ("Vallenar", -28.5708, -70.7581)], ["UDA"], 1.6),
+    "Coquimbo": ([("La Serena", -29.9027, -71.2519), ("Coquimbo", -29.9533, -71.3436)], ["ULS", "UCN"], 4.3),
+    "Valparaíso": ([("Valparaíso", -33.0472, -71.6127), ("Viña del Mar", -33.0245, -71.5518), ("Quilpué", -33.0470, -71.4425)],
+                   ["PUCV", "UV", "USM", "UNAB"], 10.3),
+    "Metropolitana": ([("Santiago", -33.4489, -70.6693), ("Providencia", -33.4314, -70.6093), ("Ñuñoa", -33.4569, -70.5979),
+                       ("Maipú", -33.5107, -70.7580), ("Puente Alto", -33.6117, -70.5758), ("Las Condes", -33.4080, -70.5670)],
+                      ["UCH", "PUC", "USACH", "UDP", "UNAB", "UAI", "INACAP", "DUOC"], 40.5),
+    "O'Higgins": ([("Rancagua", -34.1708, -70.7444), ("San Fernando", -34.5855, -70.9890)], ["UOH"], 5.3),
+    "Maule": ([("Talca", -35.4264, -71.6554), ("Curicó", -34.9828, -71.2394)], ["UTALCA", "UCM"], 6.0),
+    "Ñuble": ([("Chillán", -36.6066, -72.1034)], ["UBB"], 2.6),
+    "Biobío": ([("Concepción", -36.8201, -73.0444), ("Talcahuano", -36.7249, -73.1168), ("Los Ángeles", -37.4697, -72.3537)],
+               ["UdeC", "UCSC", "UBB", "USS"], 8.8),
+    "Araucanía": ([("Temuco", -38.7359, -72.5904), ("Villarrica", -39.2856, -72.2279)], ["UFRO", "UCT"], 5.4),
+    "Los Ríos": ([("Valdivia", -39.8142, -73.2459)], ["UACh"], 2.1),
+    "Los Lagos": ([("Puerto Montt", -41.4689, -72.9411), ("Osorno", -40.5740, -73.1336)], ["ULAGOS", "USS"], 4.7),
+    "Aysén": ([("Coyhaique", -45.5712, -72.0685)], ["UAYSEN"], 0.6),
+    "Magallanes": ([("Punta Arenas", -53.1638, -70.9171)], ["UMAG"], 0.9),
+}
+GRUPOS = [
+    ("Fútbol", "Pichangas y partidos de fútbol 7 y 11"),
+    ("Básquetbol", "Partidos 3x3 y 5x5"),
+    ("Running", "Salidas a trotar y entrenamientos"),
+    ("Vóleibol", "Vóley de cancha y playa"),
+    ("Tenis", "Singles y dobles"),
+    ("Ciclismo", "Ruteros y mountain bike"),
+    ("Natación", "Entrenamiento en piscina"),
+    ("Trekking", "Caminatas y cerros"),
+    ("Pádel", "Partidos de dobles"),
+    ("Handball", "Partidos y entrenamientos"),
+]
+CARRERAS = ["Ingeniería Civil", "Medicina", "Derecho", "Psicología", "Arquitectura", "Enfermería", "Pedagogía",
+            "Kinesiología", "Ingeniería Comercial", "Periodismo", "Agronomía", "Odontología", "Diseño"]
+NOMBRES = ["Sofía", "Martina", "Florencia", "Valentina", "Isidora", "Catalina", "Josefa", "Antonia", "Fernanda", "Javiera",
+           "Agustín", "Benjamín", "Vicente", "Matías", "Martín", "Joaquín", "Tomás", "Maximiliano", "Cristóbal", "Diego"]
+APELLIDOS = ["González", "Muñoz", "Rojas", "Díaz", "Pérez", "Soto", "Contreras", "Silva", "Martínez", "Sepúlveda",
+             "Morales", "Rodríguez", "López", "Fuentes", "Hernández", "Torres", "Araya", "Flores", "Espinoza", "Valenzuela"]
+LUGARES = ["Cancha municipal", "Polideportivo", "Estadio", "Gimnasio universitario", "Parque", "Club deportivo"]
+FRASES_CHAT = ["hola!", "¿vamos hoy?", "llego en 10", "dale", "¿quién lleva la pelota?", "buena la de ayer",
+               "no puedo, sorry", "nos vemos allá", "¿a qué hora era?", "jajaja", "voy en camino", "listo"]
+
+VOLUMENES = {
+    "usuarios": 100_000,
+    "eventos": 200_000,
+    "inscritos_por_evento": 6,         # promedio, además del anfitrión
+    "amigos_por_usuario": 10,          # promedio (cada amistad cuenta para los dos)
+    "solicitudes_por_usuario": 1,
+    "mensajes_por_amistad": 5,         # solo en la fracción de amistades que conversa
+    "fraccion_amistades_con_chat": 0.3,
+    "mensajes_por_evento": 4,
+    "calificaciones_por_participante": 2,
+}
+FRACCION_MISMA_REGION = 0.9
+TABLAS_A_VACIAR = [
+    "usuarios", "grupos_deportivos", "eventos_deportivos_historico",
+    "usuarios_eventos_historico", "mensajes_eventos_historico", "abandonos_eventos",
+]
+TRIGGERS_POR_FILA = [("amigos", "amigos_notificar_cambio"), ("solicitudes_amistad", "solicitudes_notificar_cambio")]
+
+
+# =========================
+# COPY
+# =========================
+def _campo(valor) -> str:
+    if valor is None:
+        return "\\N"
+    if isinstance(valor, str):
+        if "\\" in valor or "\t" in valor or "\n" in valor or "\r" in valor:
+            valor = valor.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+        return valor
+    if isinstance(valor, datetime):
+        return valor.isoformat(" ")
+    return str(valor)
+
+
+class FlujoCopy:
+    """Archivo de solo lectura que arma las líneas de COPY a medida que Postgres las pide"""
+
+    def __init__(self, filas):
+        self._filas = iter(filas)
+        self._pendiente = ""
+        self.cantidad = 0
+
+    def read(self, tamano: int = -1) -> bytes:
+        partes, largo = [self._pendiente], len(self._pendiente)
+        while tamano < 0 or largo < tamano:
+            fila = next(self._filas, None)
+            if fila is None:
+                break
+            linea = "\t".join(map(_campo, fila)) + "\n"
+            partes.append(linea)
+            largo += len(linea)
+            self.cantidad += 1
+        texto = "".join(partes)
+        if tamano >= 0:
+            texto, self._pendiente = texto[:tamano], texto[tamano:]
+        else:
+            self._pendiente = ""
+        # Se entregan bytes: psycopg2 codificaría el texto en ASCII
+        return texto.encode("utf-8")
+
+    readline = read
+
+
+def copiar(cur, tabla: str, columnas, filas) -> int:
+    inicio = time.perf_counter()
+    flujo = FlujoCopy(filas)
+    cur.copy_expert(f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN", flujo, size=1 << 16)
+    print(f"  {tabla:<24} {flujo.cantidad:>12,} filas  {time.perf_counter() - inicio:7.1f} s", flush=True)
+    return flujo.cantidad
+
+
+# =========================
+# Generación
+# =========================
+class Generador:
+    """
+    Guarda lo mínimo para que las tablas siguientes sean consistentes con
+    las anteriores (índices de usuarios por región, participantes por evento).
+    Los usuarios se referencian por índice y se convierten a google_id al escribir.
+    """
+
+    def __init__(self, semilla: int, fecha_base: date, volumenes: dict):
+        self.azar = random.Random(semilla)
+        self.base = datetime.combine(fecha_base, hora())
+        self.v = volumenes
+        self.ids = [str(100000000000000000000 + i) for i in range(volumenes["usuarios"])]
+        self.region_de = []      # índice de usuario -> región
+        self.por_region = {}     # región -> [índices de usuario]
+        self.universidad_de = []
+        self.eventos = []        # (fecha_hora, [índices de participantes, anfitrión primero])
+
+    def _persona(self, region: str) -> int:
+        """Un usuario, casi siempre de la región pedida (si tiene usuarios)"""
+        de_la_region = self.por_region.get(region)
+        if de_la_region and self.azar.random() < FRACCION_MISMA_REGION:
+            return self.azar.choice(de_la_region)
+        return self.azar.randrange(len(self.ids))
+
+    def usuarios(self):
+        azar = self.azar
+        regiones = list(REGIONES)
+        pesos = [REGIONES[r][2] for r in regiones]
+        for i, google_id in enumerate(self.ids):
+            region = azar.choices(regiones, pesos)[0]
+            comunas, universidades, _ = REGIONES[region]
+            universidad = azar.choice(universidades)
+            self.region_de.append(region)
+            self.por_region.setdefault(region, []).append(i)
+            self.universidad_de.append(universidad)
+            nombre = f"{azar.choice(NOMBRES)} {azar.choice(APELLIDOS)} {azar.choice(APELLIDOS)}"
+            yield (
+                google_id, f"usuario{i}@{universidad.lower()}.cl", nombre, None,
+                f"9{azar.randrange(10**8):08d}", region, azar.choice(comunas)[0],
+                azar.choice(GRUPOS)[0], azar.randint(18, 30), None, universidad, azar.choice(CARRERAS),
+                self.base - timedelta(days=azar.randint(0, 3 * 365), seconds=azar.randrange(86400)),
+            )
+
+    def grupos(self):
+        for i, (nombre, descripcion) in enumerate(GRUPOS, start=1):
+            yield (i, nombre, descripcion)
+
+    def eventos_deportivos(self):
+        azar = self.azar
+        regiones = list(REGIONES)
+        pesos = [REGIONES[r][2] for r in regiones]
+        for evento_id in range(1, self.v["eventos"] + 1):
+            region = azar.choices(regiones, pesos)[0]
+            comuna, latitud, longitud = azar.choice(REGIONES[region][0])
+            grupo_id = azar.randint(1, len(GRUPOS))
+            anfitrion = self._persona(region)
+            fecha = self.base + timedelta(days=azar.randint(-180, 60), hours=azar.randint(8, 21),
+                                          minutes=azar.choice([0, 15, 30, 45]))
+            maximo = azar.randint(4, 22)
+            inscritos = min(maximo - 1, len(self.ids) - 1,
+                            max(0, int(azar.expovariate(1 / self.v["inscritos_por_evento"]))))
+            participantes = [anfitrion]
+            vistos = {anfitrion}
+            while len(participantes) < inscritos + 1:
+                persona = self._persona(region)
+                if persona not in vistos:
+                    vistos.add(persona)
+                    participantes.append(persona)
+            self.eventos.append((fecha, participantes))
+            yield (
+                evento_id, grupo_id, self.ids[anfitrion], f"{GRUPOS[grupo_id - 1][0]} en {comuna}",
+                None, fecha, f"{azar.choice(LUGARES)} {comuna}",
+                round(latitud + azar.uniform(-0.03, 0.03), 6), round(longitud + azar.uniform(-0.03, 0.03), 6),
+                maximo, azar.choice([0, 0, 0, 1000, 2000, 3000, 5000]), "activo",
+            )
+
+    def usuarios_eventos(self):
+        azar = self.azar
+        for evento_id, (fecha, participantes) in enumerate(self.eventos, start=1):
+            for persona in participantes:
+                yield (self.ids[persona], evento_id, fecha - timedelta(hours=azar.randint(1, 24 * 14)))
+
+    def _pares_posibles(self) -> int:
+        return len(self.ids) * (len(self.ids) - 1) // 2
+
+    def _amistades(self):
+        """Pares (menor, mayor) sin repetir, casi siempre de la misma región"""
+        azar = self.azar
+        # Con escalas chicas no hay tantos pares distintos
+        total = min(len(self.ids) * self.v["amigos_por_usuario"] // 2, self._pares_posibles())
+        pares = set()
+        while len(pares) < total:
+            a = azar.randrange(len(self.ids))
+            b = self._persona(self.region_de[a])
+            if a != b:
+                pares.add((min(a, b), max(a, b)))
+        self.amistades = sorted(pares)
+
+    def amigos(self):
+        self._amistades()
+        azar = self.azar
+        for a, b in self.amistades:
+            yield (self.ids[a], self.ids[b], self.base - timedelta(days=azar.randint(0, 700), seconds=azar.randrange(86400)))
+
+    def solicitudes_amistad(self):
+        azar = self.azar
+        amistades = set(self.amistades)
+        vistos = set()
+        total = min(len(self.ids) * self.v["solicitudes_por_usuario"], self._pares_posibles() - len(amistades))
+        while len(vistos) < total:
+            a = azar.randrange(len(self.ids))
+            b = self._persona(self.region_de[a])
+            par = (min(a, b), max(a, b))
+            if a == b or par in amistades or par in vistos:
+                continue
+            vistos.add(par)
+            yield (self.ids[a], self.ids[b], "pendiente", self.base - timedelta(days=azar.randint(0, 60)))
+
+    def mensajes_amigos(self):
+        azar = self.azar
+        for a, b in self.amistades:
+            if azar.random() >= self.v["fraccion_amistades_con_chat"]:
+                continue
+            momento = self.base - timedelta(days=azar.randint(1, 90), seconds=azar.randrange(86400))
+            for _ in range(max(1, int(azar.expovariate(1 / self.v["mensajes_por_amistad"])))):
+                remitente, destinatario = (a, b) if azar.random() < 0.5 else (b, a)
+                momento += timedelta(seconds=azar.randint(5, 3600))
+                yield (self.ids[remitente], self.ids[destinatario], azar.choice(FRASES_CHAT), momento)
+
+    def mensajes_eventos(self):
+        azar = self.azar
+        promedio = self.v["mensajes_por_evento"]
+        for evento_id, (fecha, participantes) in enumerate(self.eventos, start=1):
+            if len(participantes) < 2:
+                continue
+            cantidad = int(azar.expovariate(1 / promedio)) if promedio else 0
+            momento = fecha - timedelta(hours=azar.randint(2, 72))
+            for _ in range(cantidad):
+                momento += timedelta(seconds=azar.randint(10, 1800))
+                yield (evento_id, self.ids[azar.choice(participantes)], azar.choice(FRASES_CHAT), min(momento, fecha))
+
+    def calificaciones_usuarios(self):
+        """Solo eventos pasados, entre compañeros, una vez por evaluador, evaluado y evento"""
+        azar = self.azar
+        por_participante = self.v["calificaciones_por_participante"]
+        for evento_id, (fecha, participantes) in enumerate(self.eventos, start=1):
+            if fecha >= self.base or len(participantes) < 2:
+                continue
+            for evaluador in participantes:
+                companeros = [p for p in participantes if p != evaluador]
+                for evaluado in azar.sample(companeros, min(len(companeros), por_participante)):
+                    estrellas = min(5, max(1, round(azar.gauss(4.1, 0.9))))
+                    yield (self.ids[evaluador], self.ids[evaluado], estrellas, "usuario", evento_id,
+                           fecha + timedelta(hours=azar.randint(2, 72)))
+
+
+# =========================
+# Carga
+# =========================
+def generar(semilla: int, fecha_base: date, escala: float, vaciar: bool):
+    volumenes = dict(VOLUMENES)
+    for clave in ("usuarios", "eventos"):
+        volumenes[clave] = max(2, int(volumenes[clave] * escala))
+    generador = Generador(semilla, fecha_base, volumenes)
+
+    conn = get_connection()
+    try:
+        conn.set_client_encoding("UTF8")
+        cur = conn.cursor()
+        cur.execute("SELECT EXISTS (SELECT 1 FROM usuarios) OR EXISTS (SELECT 1 FROM grupos_deportivos) AS hay")
+        if cur.fetchone()["hay"]:
+            if not vaciar:
+                raise SystemExit("La BD ya tiene datos: usa --vaciar para reemplazarlos")
+            cur.execute(f"TRUNCATE {', '.join(TABLAS_A_VACIAR)} RESTART IDENTITY CASCADE")
+
+        # Los NOTIFY fila a fila de amistades inundarían la cola; los workers recargan al reiniciar
+        for tabla, trigger in TRIGGERS_POR_FILA:
+            cur.execute(f"ALTER TABLE {tabla} DISABLE TRIGGER {trigger}")
+
+        inicio = time.perf_counter()
+        print(f"Generando con semilla {semilla} y fecha base {fecha_base}:", flush=True)
+        total = 0
+        total += copiar(cur, "usuarios", ["google_id", "email", "nombre", "foto_perfil", "telefono", "region", "comuna",
+                                          "deporte_favorito", "edad", "descripcion", "universidad_o_instituto",
+                                          "carrera", "fecha_registro"], generador.usuarios())
+        total += copiar(cur, "grupos_deportivos", ["id", "nombre", "descripcion"], generador.grupos())
+        total += copiar(cur, "eventos_deportivos", ["id", "grupo_id", "anfitrion_id", "nombre", "descripcion",
+                                                    "fecha_hora", "lugar", "latitud", "longitud",
+                                                    "max_participantes", "precio", "estado"],
+                        generador.eventos_deportivos())
+        total += copiar(cur, "usuarios_eventos", ["usuario_id", "evento_id", "fecha_union"], generador.usuarios_eventos())
+        total += copiar(cur, "amigos", ["usuario_id", "amigo_id", "fecha_amistad"], generador.amigos())
+        total += copiar(cur, "solicitudes_amistad", ["solicitante_id", "destinatario_id", "estado", "fecha_solicitud"],
+                        generador.solicitudes_amistad())
+        total += copiar(cur, "mensajes_amigos", ["remitente_id", "destinatario_id", "mensaje", "fecha_envio"],
+                        generador.mensajes_amigos())
+        total += copiar(cur, "mensajes_eventos", ["evento_id", "remitente_id", "mensaje", "fecha_envio"],
+                        generador.mensajes_eventos())
+        total += copiar(cur, "calificaciones_usuarios", ["evaluador_id", "evaluado_id", "estrellas", "tipo",
+                                                         "evento_id", "fecha_calificacion"],
+                        generador.calificaciones_usuarios())
+
+        for tabla, trigger in TRIGGERS_POR_FILA:
+            cur.execute(f"ALTER TABLE {tabla} ENABLE TRIGGER {trigger}")
+        for tabla in ("grupos_deportivos", "eventos_deportivos"):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{tabla}', 'id'), (SELECT MAX(id) FROM {tabla}))")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+    # Tablas derivadas, con el mismo código que usa la app
+    from calificaciones import reconstruir_resumenes
+    from reputacion import calcular_reputaciones
+    print(f"  resúmenes de calificaciones: {reconstruir_resumenes():,}", flush=True)
+    print(f"  reputaciones: {calcular_reputaciones():,}", flush=True)
+
+    conn = get_connection()
+    try:
+        conn.autocommit = True
+        conn.cursor().execute("ANALYZE")
+    finally:
+        conn.close()
+    print(f"Listo: {total:,} filas en {time.perf_counter() - inicio:.1f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga datos sintéticos en la BD configurada en DB_*")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--fecha-base", type=date.fromisoformat, default=date.today(),
+                        help="'hoy' para los datos (AAAA-MM-DD): hay eventos 180 días antes y 60 después")
+    parser.add_argument("--escala", type=float, default=1.0, help="multiplica usuarios y eventos")
+    parser.add_argument("--vaciar", action="store_true", help="borra los datos existentes antes de cargar")
+    args = parser.parse_args()
+    generar(args.semilla, args.fecha_base, args.escala, args.vaciar)
@@ -0,0 +1,125 @@
+# bench/serializacion.py
+# Mide cuánto cuesta serializar la respuesta de /grupos/{grupo_id}/eventos.
+#
+# Compara la forma anterior (recorrer las filas armando dicts y dejar que
+# FastAPI pase todo por jsonable_encoder + json.dumps) con la actual (filas
+# con la forma de la respuesta, validadas por el response_model y escritas
+# con orjson). Usa filas sintéticas, no necesita BD.
+#
+# Uso (desde backend/):
+#   python -m bench.serializacion [--filas 200] [--repeticiones 300]
+from datetime import datetime, timedelta
+from decimal import Decimal
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from main import EventosDeGrupoRespuesta
+from serializacion import RespuestaJSON
+import argparse
+import random
+import time
+
+
+def filas_crudas(cantidad: int):
+    """Filas como las devolvía la consulta antes del cambio"""
+    azar = random.Random(42)
+    inicio = datetime(2025, 3, 1, 18, 0)
+    return [
+        {
+            "evento_id": i,
+            "nombre": f"Partido {i}",
+            "descripcion": "Pichanga después de clases, traer agua" * azar.randint(0, 3),
+            "lugar": "Parque O'Higgins",
+            "fecha_hora": inicio + timedelta(hours=i),
+            "precio": azar.choice([0, 1000, 2500]),
+            "max_participantes": 10,
+            "latitud": Decimal("-33.464000") + Decimal(i) / 100000,
+            "longitud": Decimal("-70.660000"),
+            "anfitrion_id": f"{100000000000000000000 + i}",
+            "anfitrion_reputacion": 3.5 + azar.random(),
+            "inscritos": azar.randint(1, 10),
+        }
+        for i in range(cantidad)
+    ]
+
+
+def filas_con_forma(cantidad: int):
+    """Filas como las devuelve ahora la consulta (participantes y floats desde SQL)"""
+    return [
+        {
+            "evento_id": f["evento_id"],
+            "nombre": f["nombre"],
+            "descripcion": f["descripcion"],
+            "lugar": f["lugar"],
+            "fecha_hora": f["fecha_hora"],
+            "precio": f["precio"],
+            "participantes": f"{f['inscritos']} / {f['max_participantes']}",
+            "latitud": float(f["latitud"]),
+            "longitud": float(f["longitud"]),
+            "anfitrion_id": f["anfitrion_id"],
+            "anfitrion_reputacion": round(f["anfitrion_reputacion"], 2),
+        }
+        for f in filas_crudas(cantidad)
+    ]
+
+
+def antes(filas) -> bytes:
+    eventos_list = []
+    for e in filas:
+        eventos_list.append({
+            "evento_id": e["evento_id"],
+            "nombre": e["nombre"],
+            "descripcion": e["descripcion"],
+            "lugar": e["lugar"],
+            "fecha_hora": e["fecha_hora"],
+            "precio": e["precio"],
+            "participantes": f"{e['inscritos']} / {e['max_participantes']}",
+            "latitud": e["latitud"],
+            "longitud": e["longitud"],
+            "anfitrion_id": e["anfitrion_id"],
+            "anfitrion_reputacion": round(e["anfitrion_reputacion"], 2)
+        })
+    contenido = {"ok": True, "grupo_id": 1, "grupo_nombre": "Fútbol", "eventos": eventos_list}
+    return JSONResponse(jsonable_encoder(contenido)).body
+
+
+_adaptador = TypeAdapter(EventosDeGrupoRespuesta)
+
+
+def despues(filas) -> bytes:
+    # Lo mismo que hace FastAPI con response_model: validar y volcar en modo JSON
+    contenido = {"ok": True, "grupo_id": 1, "grupo_nombre": "Fútbol", "eventos": filas}
+    validado = _adaptador.validate_python(contenido)
+    return RespuestaJSON(_adaptador.dump_python(validado, mode="json")).body
+
+
+def sin_modelo(filas) -> bytes:
+    # Cota inferior: orjson directo sobre las filas, sin validar
+    return RespuestaJSON({"ok": True, "grupo_id": 1, "grupo_nombre": "Fútbol", "eventos": filas}).body
+
+
+def medir(funcion, filas, repeticiones: int):
+    funcion(filas)  # calentamiento
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        cuerpo = funcion(filas)
+    return (time.perf_counter() - inicio) / repeticiones * 1e6, len(cuerpo)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Costo de serializar /grupos/{id}/eventos")
+    parser.add_argument("--filas", type=int, default=200)
+    parser.add_argument("--repeticiones", type=int, default=300)
+    args = parser.parse_args()
+
+    casos = [
+        ("antes: bucle + jsonable_encoder + json", antes, filas_crudas(args.filas)),
+        ("ahora: response_model + orjson", despues, filas_con_forma(args.filas)),
+        ("referencia: orjson sin validar", sin_modelo, filas_con_forma(args.filas)),
+    ]
+    base = None
+    print(f"{args.filas} eventos por respuesta, {args.repeticiones} repeticiones")
+    for nombre, funcion, filas in casos:
+        micros, largo = medir(funcion, filas, args.repeticiones)
+        base = base or micros
+        print(f"  {nombre:<40} {micros:10.1f} µs/respuesta  {largo:8d} bytes  x{base / micros:.1f}")
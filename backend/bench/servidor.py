@@ -0,0 +1,41 @@
+# bench/servidor.py
+# La app tal cual, pero aceptando tokens de Google falsos para las pruebas de
+# carga: "bench:<google_id>" inicia sesión como ese usuario sin consultar a
+# Google. Solo lo levanta bench/carga.py contra la BD de pruebas.
+#
+# Uso (desde backend/):
+#   python -m bench.servidor [--puerto 8765] [--workers 1]
+from google.oauth2 import id_token as google_id_token  # type: ignore
+import argparse
+import uvicorn
+
+PREFIJO_TOKEN = "bench:"
+
+
+def verificar_token_falso(token, _request=None, _audience=None, **_):
+    if not token.startswith(PREFIJO_TOKEN):
+        raise ValueError("Token de prueba inválido")
+    google_id = token[len(PREFIJO_TOKEN):]
+    return {
+        "iss": "accounts.google.com",
+        "sub": google_id,
+        "email": f"{google_id}@bench.cl",
+        "name": f"Usuario {google_id}",
+    }
+
+
+google_id_token.verify_oauth2_token = verificar_token_falso
+
+from main import app  # noqa: E402  (después del parche, por si main lo importara por nombre)
+
+# uvicorn carga "bench.servidor:app" por nombre
+__all__ = ["app"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="App para pruebas de carga")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    uvicorn.run("bench.servidor:app", host="127.0.0.1", port=args.puerto, workers=args.workers, log_level="warning",
+                ws_per_message_deflate=True)
@@ -0,0 +1,272 @@
+# cache.py
+from collections import OrderedDict
+from starlette.routing import Match
+import os
+import threading
+import time
+
+# =========================
+# Caché de participantes por evento
+# =========================
+# Cada worker de uvicorn tiene su propia copia. Las escrituras de este
+# worker invalidan al instante; el TTL acota lo que puede quedar
+# desactualizado por escrituras hechas en otros workers.
+ROSTER_TTL_SEGUNDOS = 60
+ROSTER_MAX_EVENTOS = 5000
+
+
+class CacheRosters:
+    """Caché LRU con TTL: evento_id -> roster (anfitrión + participantes)"""
+
+    def __init__(self, ttl_segundos: int = ROSTER_TTL_SEGUNDOS, max_eventos: int = ROSTER_MAX_EVENTOS):
+        self.ttl_segundos = ttl_segundos
+        self.max_eventos = max_eventos
+        self._datos = OrderedDict()  # evento_id -> (expira_en, roster)
+        self._lock = threading.Lock()
+
+    def obtener_varios(self, evento_ids):
+        """Devuelve {evento_id: roster} solo para los eventos vigentes en caché"""
+        ahora = time.monotonic()
+        encontrados = {}
+        with self._lock:
+            for evento_id in evento_ids:
+                entrada = self._datos.get(evento_id)
+                if entrada is None:
+                    continue
+                expira_en, roster = entrada
+                if expira_en < ahora:
+                    del self._datos[evento_id]
+                    continue
+                self._datos.move_to_end(evento_id)
+                encontrados[evento_id] = roster
+        return encontrados
+
+    def guardar(self, evento_id: int, roster: dict):
+        with self._lock:
+            self._datos[evento_id] = (time.monotonic() + self.ttl_segundos, roster)
+            self._datos.move_to_end(evento_id)
+            while len(self._datos) > self.max_eventos:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, evento_id: int):
+        with self._lock:
+            self._datos.pop(evento_id, None)
+
+
+rosters = CacheRosters()
+
+
+
+# =========================
+# Caché de respuestas HTTP
+# =========================
+# Guarda respuestas GET completas de las rutas configuradas con
+# CacheRespuestas.configurar. Cada entrada lleva etiquetas ("group:3",
+# "user:abc") y los endpoints que escriben las invalidan con invalidar().
+# Igual que los rosters, es por worker: el TTL acota lo desactualizado por
+# escrituras hechas en otros workers.
+# Cada etiqueta tiene una generación que sube al invalidarla: una respuesta
+# que se estaba calculando durante la invalidación ya puede traer datos
+# viejos, y no se guarda.
+CACHE_RESPUESTAS_MAX_BYTES = int(os.getenv("CACHE_RESPUESTAS_MAX_BYTES", str(32 * 1024 * 1024)))
+CACHE_RESPUESTA_MAX_BYTES = 256 * 1024  # Respuestas más grandes no se guardan
+
+
+class ReglaCache:
+    def __init__(self, ruta: str, ttl_segundos: int, por_usuario: bool, etiquetas):
+        self.ruta = ruta
+        self.ttl_segundos = ttl_segundos
+        self.por_usuario = por_usuario
+        self.etiquetas = etiquetas  # plantillas con los parámetros de la ruta, ej: "group:{grupo_id}"
+        self.aciertos = 0
+        self.fallos = 0
+
+
+class CacheRespuestas:
+    """Caché LRU acotada por bytes: clave -> (expira_en, status, headers, body, etiquetas)"""
+
+    def __init__(self, max_bytes: int = CACHE_RESPUESTAS_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.reglas = {}             # plantilla de ruta -> ReglaCache
+        self._datos = OrderedDict()
+        self._por_etiqueta = {}      # etiqueta -> claves
+        self._generaciones = {}      # etiqueta -> veces que se invalidó
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.expulsadas = 0
+        self.invalidadas = 0
+        self.descartadas = 0         # Respuestas no guardadas por una invalidación en curso
+
+    def configurar(self, ruta: str, ttl_segundos: int, por_usuario: bool = False, etiquetas=()):
+        """Activa la caché para una ruta GET (la plantilla tal como se declaró en FastAPI)"""
+        self.reglas[ruta] = ReglaCache(ruta, ttl_segundos, por_usuario, tuple(etiquetas))
+
+    def buscar_regla(self, scope):
+        """La ruta que atendería la petición, si tiene caché configurada"""
+        for ruta in scope["app"].router.routes:
+            coincidencia, hijo = ruta.matches(scope)
+            if coincidencia == Match.FULL:
+                regla = self.reglas.get(getattr(ruta, "path", None))
+                return regla, hijo.get("path_params", {})
+        return None, None
+
+    # -------- Entradas --------
+    @staticmethod
+    def etiquetas_de(regla: ReglaCache, parametros: dict) -> list:
+        return [plantilla.format(**parametros) for plantilla in regla.etiquetas]
+
+    def generaciones(self, etiquetas) -> tuple:
+        """Para comparar al guardar: si cambió, hubo una invalidación entremedio"""
+        with self._lock:
+            return tuple(self._generaciones.get(etiqueta, 0) for etiqueta in etiquetas)
+
+    def obtener(self, clave):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            if entrada[0] < ahora:
+                self._quitar(clave)
+                return None
+            self._datos.move_to_end(clave)
+            return entrada
+
+    def guardar(self, clave, regla: ReglaCache, etiquetas: list, generaciones: tuple, status: int, headers, body: bytes):
+        """Guarda la respuesta salvo que sus etiquetas se hayan invalidado desde que empezó a calcularse"""
+        with self._lock:
+            if tuple(self._generaciones.get(etiqueta, 0) for etiqueta in etiquetas) != generaciones:
+                self.descartadas += 1
+                return
+            self._quitar(clave)
+            self._datos[clave] = (time.monotonic() + regla.ttl_segundos, status, headers, body, etiquetas)
+            self._bytes += self._tamano(clave, headers, body)
+            for etiqueta in etiquetas:
+                self._por_etiqueta.setdefault(etiqueta, set()).add(clave)
+            while self._bytes > self.max_bytes and self._datos:
+                self._quitar(next(iter(self._datos)))
+                self.expulsadas += 1
+
+    def invalidar(self, *etiquetas):
+        """Borra todas las respuestas marcadas con alguna de estas etiquetas"""
+        with self._lock:
+            for etiqueta in etiquetas:
+                self._generaciones[etiqueta] = self._generaciones.get(etiqueta, 0) + 1
+                for clave in self._por_etiqueta.pop(etiqueta, ()):
+                    if clave in self._datos:
+                        self._quitar(clave)
+                        self.invalidadas += 1
+
+    @staticmethod
+    def _tamano(clave, headers, body) -> int:
+        return len(body) + sum(len(k) + len(v) for k, v in headers) + sum(len(str(p)) for p in clave)
+
+    def _quitar(self, clave):
+        entrada = self._datos.pop(clave, None)
+        if entrada is None:
+            return
+        _, _, headers, body, etiquetas = entrada
+        self._bytes -= self._tamano(clave, headers, body)
+        for etiqueta in etiquetas:
+            claves = self._por_etiqueta.get(etiqueta)
+            if claves is not None:
+                claves.discard(clave)
+                if not claves:
+                    del self._por_etiqueta[etiqueta]
+
+    # -------- Estadísticas --------
+    def estadisticas(self) -> dict:
+        def proporcion(aciertos, fallos):
+            return round(aciertos / (aciertos + fallos), 4) if aciertos + fallos else 0.0
+
+        aciertos = sum(r.aciertos for r in self.reglas.values())
+        fallos = sum(r.fallos for r in self.reglas.values())
+        return {
+            "entradas": len(self._datos),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "aciertos": aciertos,
+            "fallos": fallos,
+            "proporcion_aciertos": proporcion(aciertos, fallos),
+            "expulsadas": self.expulsadas,
+            "invalidadas": self.invalidadas,
+            "descartadas": self.descartadas,
+            "rutas": {
+                r.ruta: {"aciertos": r.aciertos, "fallos": r.fallos, "proporcion_aciertos": proporcion(r.aciertos, r.fallos)}
+                for r in self.reglas.values()
+            },
+        }
+
+
+class MiddlewareCacheRespuestas:
+    """
+    Middleware ASGI: responde desde la caché las rutas configuradas y guarda
+    las respuestas 200 que no fijan cookies. Marca cada respuesta con X-Cache.
+    """
+
+    def __init__(self, app, cache: CacheRespuestas):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not self.cache.reglas:
+            await self.app(scope, receive, send)
+            return
+
+        regla, parametros = self.cache.buscar_regla(scope)
+        if regla is None:
+            await self.app(scope, receive, send)
+            return
+
+        clave = (regla.ruta, scope["path"], scope["query_string"])
+        if regla.por_usuario:
+            clave += (_cookie(scope, "access_token"),)
+
+        entrada = self.cache.obtener(clave)
+        if entrada is not None:
+            regla.aciertos += 1
+            _, status, headers, body, _ = entrada
+            await send({"type": "http.response.start", "status": status, "headers": headers + [(b"x-cache", b"HIT")]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        regla.fallos += 1
+        etiquetas = self.cache.etiquetas_de(regla, parametros)
+        generaciones = self.cache.generaciones(etiquetas)
+        inicio = {}
+        partes = []
+        guardable = True
+
+        async def enviar(mensaje):
+            nonlocal guardable
+            if mensaje["type"] == "http.response.start":
+                inicio.update(mensaje)
+                headers = list(mensaje.get("headers", []))
+                if mensaje["status"] != 200 or any(k.lower() == b"set-cookie" for k, _ in headers):
+                    guardable = False
+                mensaje = {**mensaje, "headers": headers + [(b"x-cache", b"MISS")]}
+            elif mensaje["type"] == "http.response.body" and guardable:
+                partes.append(mensaje.get("body", b""))
+                if sum(len(p) for p in partes) > CACHE_RESPUESTA_MAX_BYTES:
+                    guardable = False
+                    partes.clear()
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
+
+        if guardable and inicio:
+            self.cache.guardar(clave, regla, etiquetas, generaciones, inicio["status"],
+                               list(inicio.get("headers", [])), b"".join(partes))
+
+
+def _cookie(scope, nombre: str):
+    for clave, valor in scope["headers"]:
+        if clave == b"cookie":
+            for parte in valor.decode("latin-1").split(";"):
+                k, _, v = parte.strip().partition("=")
+                if k == nombre:
+                    return v
+    return None
+
+
+respuestas = CacheRespuestas()
@@ -0,0 +1,387 @@
+from typing import List, Optional
+from datetime import date, datetime, timedelta
+from fastapi import APIRouter, HTTPException, Cookie, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from jose import jwt
+from autenticacion import verify_token, JWT_SECRET, JWT_ALG
+from bd import get_connection
+from archivo import fecha_limite
+import logging
+import hashlib
+import hmac
+import psycopg2.extras
+import os
+
+log = logging.getLogger(__name__)
+
+# =========================
+# Token del feed .ics
+# =========================
+# Clave propia (derivada de la de sesión si no se define ICS_SECRET) y audiencia:
+# un token de feed nunca pasa como cookie de sesión ni al revés
+ICS_SECRET = os.getenv("ICS_SECRET") or hmac.new(
+    (JWT_SECRET or "").encode(), b"sunity-ics", hashlib.sha256
+).hexdigest()
+ICS_AUDIENCIA = "sunity-ics"
+
+# =========================
+# Configuración del calendario
+# =========================
+MAX_DIAS_RANGO = 100          # Una vista mensual de FullCalendar abarca 42 días
+ICS_DIAS_PASADOS = 90         # El feed incluye eventos de los últimos 90 días en adelante
+ICS_DURACION_EVENTO = "PT2H"  # Los eventos no tienen hora de término, se asumen 2 horas
+ICS_FILAS_POR_LOTE = 200      # Filas que trae el cursor del servidor en cada viaje
+
+# =========================
+# Router para calendario
+# =========================
+calendario_router = APIRouter(prefix="/calendario", tags=["Calendario"])
+
+
+def crear_token_feed(user_id: str, version: int) -> str:
+    """
+    Token sin expiración para el feed .ics.
+    Las apps de calendario no envían cookies, así que el token va en la URL
+    y solo sirve para leer el feed. Se revoca subiendo usuarios.ics_version.
+    """
+    return jwt.encode({"sub": user_id, "aud": ICS_AUDIENCIA, "ver": version}, ICS_SECRET, algorithm=JWT_ALG)
+
+
+def version_feed(user_id: str, revocar: bool = False) -> int:
+    """Versión vigente del feed del usuario; con revocar=True la sube (invalida las URLs anteriores)"""
+    conn = get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        if revocar:
+            cur.execute(
+                "UPDATE usuarios SET ics_version = ics_version + 1 WHERE google_id = %s RETURNING ics_version",
+                (user_id,)
+            )
+        else:
+            cur.execute("SELECT ics_version FROM usuarios WHERE google_id = %s", (user_id,))
+        fila = cur.fetchone()
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    if fila is None:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return fila["ics_version"]
+
+
+def verificar_token_feed(feed_token: str) -> str:
+    try:
+        payload = jwt.decode(feed_token, ICS_SECRET, algorithms=[JWT_ALG], audience=ICS_AUDIENCIA)
+        user_id = payload["sub"].strip()
+    except Exception:
+        raise HTTPException(status_code=404, detail="Calendario no encontrado")
+    if payload.get("ver") != version_feed(user_id):
+        raise HTTPException(status_code=404, detail="Calendario no encontrado")
+    return user_id
+
+
+# Eventos donde el usuario es anfitrión o participante
+EVENTOS_DEL_USUARIO = """
+    SELECT evento_id FROM usuarios_eventos WHERE usuario_id = %(user_id)s
+    UNION
+    SELECT id FROM eventos_deportivos WHERE anfitrion_id = %(user_id)s
+"""
+
+# Lo mismo sobre el histórico; el filtro por fecha deja solo las particiones del rango
+EVENTOS_HISTORICOS_DEL_USUARIO = """
+    SELECT
+        e.id AS evento_id,
+        e.nombre,
+        e.descripcion,
+        e.lugar,
+        e.fecha_hora,
+        e.precio,
+        e.max_participantes,
+        e.latitud,
+        e.longitud,
+        e.grupo_id,
+        CASE
+            WHEN e.anfitrion_id = %(user_id)s THEN 'anfitrion'
+            ELSE 'participante'
+        END AS tipo,
+        (
+            SELECT COUNT(*) FROM usuarios_eventos_historico c
+            WHERE c.evento_id = e.id AND c.fecha_evento = e.fecha_hora
+        ) AS inscritos
+    FROM eventos_deportivos_historico e
+    WHERE e.fecha_hora >= %(desde)s
+      AND e.fecha_hora < %(hasta)s
+      AND e.estado = 'activo'
+      AND (
+          e.anfitrion_id = %(user_id)s
+          OR e.id IN (
+              SELECT evento_id FROM usuarios_eventos_historico
+              WHERE usuario_id = %(user_id)s
+                AND fecha_evento >= %(desde)s
+                AND fecha_evento < %(hasta)s
+          )
+      )
+"""
+
+
+# =========================
+# Eventos por rango de fechas
+# =========================
+class EventoCalendario(BaseModel):
+    evento_id: int
+    nombre: str
+    descripcion: Optional[str] = None
+    lugar: Optional[str] = None
+    fecha_hora: datetime
+    precio: int
+    max_participantes: int
+    latitud: Optional[float] = None
+    longitud: Optional[float] = None
+    grupo_id: Optional[int] = None
+    tipo: str  # 'anfitrion' o 'participante'
+    inscritos: int
+
+
+class CalendarioRespuesta(BaseModel):
+    ok: bool
+    desde: date
+    hasta: date
+    eventos: List[EventoCalendario]
+
+
+@calendario_router.get("", response_model=CalendarioRespuesta)
+def get_eventos_calendario(
+    desde: date = Query(..., description="Primer día del rango (inclusive)"),
+    hasta: date = Query(..., description="Último día del rango (exclusivo)"),
+    access_token: str = Cookie(None)
+):
+    """
+    Devuelve los eventos del usuario dentro de [desde, hasta) con la cantidad
+    de inscritos ya calculada, para pintar solo el mes visible del calendario.
+    Si el rango llega a fechas ya archivadas, también consulta el histórico.
+    """
+    user_id = verify_token(access_token)
+
+    if hasta <= desde:
+        raise HTTPException(status_code=400, detail="'hasta' debe ser posterior a 'desde'")
+    if (hasta - desde).days > MAX_DIAS_RANGO:
+        raise HTTPException(status_code=400, detail=f"El rango no puede superar {MAX_DIAS_RANGO} días")
+
+    try:
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(
+            f"""
+            SELECT
+                e.id AS evento_id,
+                e.nombre,
+                e.descripcion,
+                e.lugar,
+                e.fecha_hora,
+                e.precio,
+                e.max_participantes,
+                e.latitud,
+                e.longitud,
+                e.grupo_id,
+                CASE
+                    WHEN e.anfitrion_id = %(user_id)s THEN 'anfitrion'
+                    ELSE 'participante'
+                END AS tipo,
+                (SELECT COUNT(*) FROM usuarios_eventos c WHERE c.evento_id = e.id) AS inscritos
+            FROM eventos_deportivos e
+            WHERE e.id IN ({EVENTOS_DEL_USUARIO})
+              AND e.estado = 'activo'
+              AND e.fecha_hora >= %(desde)s
+              AND e.fecha_hora < %(hasta)s
+            ORDER BY e.fecha_hora ASC
+            """,
+            {"user_id": user_id, "desde": desde, "hasta": hasta}
+        )
+        eventos = cur.fetchall()
+
+        if desde < fecha_limite().date():
+            cur.execute(EVENTOS_HISTORICOS_DEL_USUARIO, {"user_id": user_id, "desde": desde, "hasta": hasta})
+            eventos = cur.fetchall() + eventos
+            eventos.sort(key=lambda e: e["fecha_hora"])
+        cur.close()
+        conn.close()
+    except Exception:
+        log.exception("Error obteniendo eventos del calendario")
+        raise HTTPException(status_code=500, detail="Error interno obteniendo eventos del calendario")
+
+    return {"ok": True, "desde": desde, "hasta": hasta, "eventos": eventos}
+
+
+# =========================
+# Feed iCalendar (.ics)
+# =========================
+class FeedRespuesta(BaseModel):
+    ok: bool
+    url: str
+
+
+@calendario_router.get("/feed", response_model=FeedRespuesta)
+def get_url_feed(request: Request, access_token: str = Cookie(None)):
+    """Devuelve la URL privada del feed .ics para suscribirse desde el teléfono"""
+    user_id = verify_token(access_token)
+    feed_token = crear_token_feed(user_id, version_feed(user_id))
+    return {"ok": True, "url": str(request.url_for("get_feed_ics", feed_token=feed_token))}
+
+
+@calendario_router.post("/feed/revocar", response_model=FeedRespuesta)
+def revocar_url_feed(request: Request, access_token: str = Cookie(None)):
+    """Invalida las URLs del feed entregadas hasta ahora y devuelve una nueva"""
+    user_id = verify_token(access_token)
+    feed_token = crear_token_feed(user_id, version_feed(user_id, revocar=True))
+    return {"ok": True, "url": str(request.url_for("get_feed_ics", feed_token=feed_token))}
+
+
+def escapar_texto_ics(texto) -> str:
+    """Escapa un valor TEXT según RFC 5545 (\\, ;, , y saltos de línea)"""
+    if texto is None:
+        return ""
+    return (
+        str(texto)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def plegar_linea_ics(linea: str) -> str:
+    """Corta las líneas a 75 octetos como exige RFC 5545"""
+    datos = linea.encode("utf-8")
+    if len(datos) <= 75:
+        return linea + "\r\n"
+
+    partes = []
+    inicio = 0
+    limite = 75
+    while inicio < len(datos):
+        fin = min(inicio + limite, len(datos))
+        # No cortar un carácter UTF-8 por la mitad
+        while fin < len(datos) and (datos[fin] & 0xC0) == 0x80:
+            fin -= 1
+        partes.append(datos[inicio:fin].decode("utf-8"))
+        inicio = fin
+        limite = 74  # Las líneas de continuación empiezan con un espacio
+    return "\r\n ".join(partes) + "\r\n"
+
+
+def evento_a_ics(e, dtstamp: str) -> str:
+    # fecha_hora se guarda sin zona horaria: se publica como hora "flotante"
+    lineas = [
+        "BEGIN:VEVENT",
+        f"UID:evento-{e['id']}@sunity",
+        f"DTSTAMP:{dtstamp}",
+        f"DTSTART:{e['fecha_hora'].strftime('%Y%m%dT%H%M%S')}",
+        f"DURATION:{ICS_DURACION_EVENTO}",
+        f"SUMMARY:{escapar_texto_ics(e['nombre'])}",
+    ]
+    if e["descripcion"]:
+        lineas.append(f"DESCRIPTION:{escapar_texto_ics(e['descripcion'])}")
+    if e["lugar"]:
+        lineas.append(f"LOCATION:{escapar_texto_ics(e['lugar'])}")
+    if e["latitud"] is not None and e["longitud"] is not None:
+        lineas.append(f"GEO:{e['latitud']};{e['longitud']}")
+    lineas.append("END:VEVENT")
+    return "".join(plegar_linea_ics(linea) for linea in lineas)
+
+
+def huella_feed(user_id: str, desde: datetime) -> str:
+    """
+    Calcula el ETag del feed dentro de Postgres: solo viaja un hash,
+    no las filas, así un 304 no cuesta transferir el calendario completo.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(
+            f"""
+            SELECT MD5(COALESCE(STRING_AGG(
+                e.id || '|' || e.fecha_hora || '|' || e.nombre || '|' ||
+                COALESCE(e.descripcion, '') || '|' || COALESCE(e.lugar, '') || '|' ||
+                COALESCE(e.latitud::TEXT, '') || '|' || COALESCE(e.longitud::TEXT, ''),
+                ',' ORDER BY e.id
+            ), '')) AS huella
+            FROM eventos_deportivos e
+            WHERE e.id IN ({EVENTOS_DEL_USUARIO})
+              AND e.estado = 'activo'
+              AND e.fecha_hora >= %(desde)s
+            """,
+            {"user_id": user_id, "desde": desde}
+        )
+        huella = cur.fetchone()["huella"]
+        cur.close()
+        return f'"{huella}"'
+    finally:
+        conn.close()
+
+
+def generar_feed_ics(user_id: str, desde: datetime):
+    """
+    Genera el .ics fila por fila desde un cursor del servidor (named cursor),
+    así la memoria no crece con la cantidad de eventos del usuario.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor(name="feed_ics", cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.itersize = ICS_FILAS_POR_LOTE
+        cur.execute(
+            f"""
+            SELECT e.id, e.nombre, e.descripcion, e.lugar, e.fecha_hora, e.latitud, e.longitud
+            FROM eventos_deportivos e
+            WHERE e.id IN ({EVENTOS_DEL_USUARIO})
+              AND e.estado = 'activo'
+              AND e.fecha_hora >= %(desde)s
+            ORDER BY e.fecha_hora ASC
+            """,
+            {"user_id": user_id, "desde": desde}
+        )
+
+        yield (
+            "BEGIN:VCALENDAR\r\n"
+            "VERSION:2.0\r\n"
+            "PRODID:-//Sunity//Eventos//ES\r\n"
+            "CALSCALE:GREGORIAN\r\n"
+            "METHOD:PUBLISH\r\n"
+            "X-WR-CALNAME:Sunity\r\n"
+        )
+        dtstamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        for e in cur:
+            yield evento_a_ics(e, dtstamp)
+        yield "END:VCALENDAR\r\n"
+
+        cur.close()
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+@calendario_router.get("/ics/{feed_token}.ics", name="get_feed_ics")
+def get_feed_ics(feed_token: str, request: Request):
+    """
+    Feed iCalendar del usuario para suscribirse desde Google Calendar,
+    Apple Calendar, etc. Responde 304 si el ETag no cambió.
+    """
+    user_id = verificar_token_feed(feed_token)
+    desde = datetime.now() - timedelta(days=ICS_DIAS_PASADOS)
+
+    try:
+        etag = huella_feed(user_id, desde)
+    except Exception:
+        log.exception("Error calculando huella del calendario")
+        raise HTTPException(status_code=500, detail="Error interno generando calendario")
+
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=300"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    return StreamingResponse(
+        generar_feed_ics(user_id, desde),
+        media_type="text/calendar; charset=utf-8",
+        headers={**headers, "Content-Disposition": 'inline; filename="sunity.ics"'}
+    )
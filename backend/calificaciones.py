@@ -1,30 +1,23 @@
-from fastapi import APIRouter, HTTPException, Query
+from typing import Dict, List, Optional
+from fastapi import APIRouter, HTTPException, Query, Header, Cookie
+from pydantic import BaseModel, Field
 from bd import get_connection
+from cache import respuestas as respuestas_cache
+import logging
 import psycopg2.extras
-from jose import jwt
+from autenticacion import verify_token
+from datetime import datetime
+import hmac
 import os
+import sys
 
-# =========================
-# Configuración JWT
-# =========================
-JWT_SECRET = os.getenv("JWT_SECRET")
-JWT_ALG = "HS256"
+log = logging.getLogger(__name__)
+
+# Clave para calificaciones del sistema hechas a mano (soporte, scripts).
+# Sin ella el endpoint queda deshabilitado; las penalizaciones por abandono
+# las crea penalizaciones.py directamente en la BD.
+CLAVE_SISTEMA = os.getenv("CLAVE_SISTEMA")
 
-# =========================
-# Verificación de Token
-# =========================
-def verify_token(access_token: str) -> str:
-    """Decodifica el JWT y devuelve el google_id del usuario"""
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
-    try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-        google_id = payload.get("sub")
-        if not google_id:
-            raise HTTPException(status_code=401, detail="Token inválido")
-        return google_id.strip()
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido")
 
 
 # =========================
@@ -33,30 +26,106 @@ def verify_token(access_token: str) -> str:
 router = APIRouter()
 
 
+# =========================
+# Resumen por usuario
+# =========================
+def sumar_a_resumenes(cur, calificaciones):
+    """
+    Suma calificaciones nuevas [(evaluado_id, estrellas), ...] a
+    calificaciones_resumen. Se llama con el mismo cursor del INSERT, antes
+    del commit, para que el resumen nunca quede desfasado.
+    """
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO calificaciones_resumen AS r
+            (evaluado_id, cantidad, suma, estrellas_1, estrellas_2, estrellas_3, estrellas_4, estrellas_5)
+        SELECT
+            evaluado_id,
+            COUNT(*),
+            SUM(estrellas),
+            COUNT(*) FILTER (WHERE estrellas = 1),
+            COUNT(*) FILTER (WHERE estrellas = 2),
+            COUNT(*) FILTER (WHERE estrellas = 3),
+            COUNT(*) FILTER (WHERE estrellas = 4),
+            COUNT(*) FILTER (WHERE estrellas = 5)
+        FROM (VALUES %s) AS nuevas(evaluado_id, estrellas)
+        GROUP BY evaluado_id
+        ON CONFLICT (evaluado_id) DO UPDATE SET
+            cantidad = r.cantidad + EXCLUDED.cantidad,
+            suma = r.suma + EXCLUDED.suma,
+            estrellas_1 = r.estrellas_1 + EXCLUDED.estrellas_1,
+            estrellas_2 = r.estrellas_2 + EXCLUDED.estrellas_2,
+            estrellas_3 = r.estrellas_3 + EXCLUDED.estrellas_3,
+            estrellas_4 = r.estrellas_4 + EXCLUDED.estrellas_4,
+            estrellas_5 = r.estrellas_5 + EXCLUDED.estrellas_5
+    """, calificaciones)
+
+
+def reconstruir_resumenes() -> int:
+    """
+    Recalcula calificaciones_resumen desde calificaciones_usuarios (backfill
+    o corrección). Bloquea las escrituras de calificaciones mientras corre.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("LOCK TABLE calificaciones_usuarios IN SHARE MODE")
+        cur.execute("DELETE FROM calificaciones_resumen")
+        cur.execute("""
+            INSERT INTO calificaciones_resumen
+                (evaluado_id, cantidad, suma, estrellas_1, estrellas_2, estrellas_3, estrellas_4, estrellas_5)
+            SELECT
+                evaluado_id,
+                COUNT(*),
+                SUM(estrellas),
+                COUNT(*) FILTER (WHERE estrellas = 1),
+                COUNT(*) FILTER (WHERE estrellas = 2),
+                COUNT(*) FILTER (WHERE estrellas = 3),
+                COUNT(*) FILTER (WHERE estrellas = 4),
+                COUNT(*) FILTER (WHERE estrellas = 5)
+            FROM calificaciones_usuarios
+            GROUP BY evaluado_id
+        """)
+        total = cur.rowcount
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return total
+
+
 # =========================
 # GET promedio y cantidad
 # =========================
-@router.get("/calificaciones/{evaluado_id}")
+class ResumenCalificaciones(BaseModel):
+    evaluado_id: str
+    cantidad_calificaciones: int
+    promedio_estrellas: float
+    distribucion: Dict[int, int]  # estrellas -> cantidad
+
+
+@router.get("/calificaciones/{evaluado_id}", response_model=ResumenCalificaciones)
 def obtener_calificaciones_usuario(evaluado_id: str):
-    """Devuelve la cantidad total y el promedio de estrellas de un usuario"""
+    """Devuelve la cantidad total, el promedio y la distribución de estrellas de un usuario"""
     try:
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         cur.execute("""
-            SELECT 
-                COUNT(*) AS cantidad,
-                COALESCE(AVG(estrellas), 0)::NUMERIC(3,2) AS promedio
-            FROM calificaciones_usuarios
+            SELECT cantidad, suma, estrellas_1, estrellas_2, estrellas_3, estrellas_4, estrellas_5
+            FROM calificaciones_resumen
             WHERE evaluado_id = %s
         """, (evaluado_id,))
         data = cur.fetchone()
         cur.close()
         conn.close()
 
+        if not data:
+            data = {"cantidad": 0, "suma": 0, **{f"estrellas_{n}": 0 for n in range(1, 6)}}
+
         return {
             "evaluado_id": evaluado_id,
             "cantidad_calificaciones": data["cantidad"],
-            "promedio_estrellas": float(data["promedio"])
+            "promedio_estrellas": round(data["suma"] / data["cantidad"], 2) if data["cantidad"] else 0.0,
+            "distribucion": {n: data[f"estrellas_{n}"] for n in range(1, 6)}
         }
 
     except Exception as e:
@@ -66,9 +135,39 @@ def obtener_calificaciones_usuario(evaluado_id: str):
 # =========================
 # GET detalles
 # =========================
-@router.get("/calificaciones/{evaluado_id}/detalles")
-def obtener_detalles_calificaciones(evaluado_id: str):
-    """Devuelve todas las calificaciones que ha recibido un usuario"""
+MAX_CALIFICACIONES_POR_PAGINA = 100
+
+
+class DetalleCalificacion(BaseModel):
+    id: int
+    estrellas: int
+    tipo: str
+    motivo: Optional[str] = None
+    fecha_calificacion: datetime
+    evaluador_nombre: str
+    evaluador_foto: str
+
+
+class DetallesCalificacionesRespuesta(BaseModel):
+    evaluado_id: str
+    calificaciones: List[DetalleCalificacion]
+    siguiente: Optional[int] = None
+
+
+@router.get("/calificaciones/{evaluado_id}/detalles", response_model=DetallesCalificacionesRespuesta)
+def obtener_detalles_calificaciones(
+    evaluado_id: str,
+    limite: int = Query(20, ge=1, le=MAX_CALIFICACIONES_POR_PAGINA),
+    antes_de: Optional[int] = Query(None, description="id de la última calificación de la página anterior"),
+    tipo: Optional[str] = Query(None, pattern="^(usuario|sistema)$"),
+    min_estrellas: int = Query(1, ge=1, le=5),
+    max_estrellas: int = Query(5, ge=1, le=5)
+):
+    """
+    Devuelve las calificaciones que ha recibido un usuario, de la más nueva
+    a la más antigua, paginadas por keyset: la página siguiente se pide con
+    antes_de=<siguiente> de la respuesta anterior.
+    """
     try:
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -83,14 +182,32 @@ def obtener_detalles_calificaciones(evaluado_id: str):
                 COALESCE(u.foto_perfil, '/default-system.png') AS evaluador_foto
             FROM calificaciones_usuarios cu
             LEFT JOIN usuarios u ON cu.evaluador_id = u.google_id
-            WHERE cu.evaluado_id = %s
-            ORDER BY cu.fecha_calificacion DESC
-        """, (evaluado_id,))
+            WHERE cu.evaluado_id = %(evaluado)s
+              AND cu.estrellas BETWEEN %(min)s AND %(max)s
+              AND (%(tipo)s::VARCHAR IS NULL OR cu.tipo = %(tipo)s)
+              AND (%(antes_de)s::INT IS NULL
+                   OR (cu.fecha_calificacion, cu.id) <
+                      (SELECT fecha_calificacion, id FROM calificaciones_usuarios WHERE id = %(antes_de)s))
+            ORDER BY cu.fecha_calificacion DESC, cu.id DESC
+            LIMIT %(limite)s
+        """, {
+            "evaluado": evaluado_id,
+            "min": min_estrellas,
+            "max": max_estrellas,
+            "tipo": tipo,
+            "antes_de": antes_de,
+            "limite": limite + 1
+        })
         data = cur.fetchall()
         cur.close()
         conn.close()
 
-        return {"evaluado_id": evaluado_id, "calificaciones": data}
+        siguiente = None
+        if len(data) > limite:
+            data = data[:limite]
+            siguiente = data[-1]["id"]
+
+        return {"evaluado_id": evaluado_id, "calificaciones": data, "siguiente": siguiente}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -120,9 +237,11 @@ def crear_calificacion(
         """, (evaluador_id, evaluado_id, estrellas, motivo))
 
         result = cur.fetchone()
+        sumar_a_resumenes(cur, [(evaluado_id, estrellas)])
         conn.commit()
         cur.close()
         conn.close()
+        respuestas_cache.invalidar(f"user:{evaluado_id}")
 
         if not result or "id" not in result:
             raise HTTPException(status_code=500, detail="No se pudo obtener el ID de la calificación")
@@ -139,37 +258,156 @@ def crear_calificacion(
     except HTTPException:
         raise
     except Exception as e:
-        print("❌ ERROR AL CREAR CALIFICACIÓN:", str(e))
+        log.exception("Error al crear calificación")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# =========================
+# POST calificaciones de un evento (en lote)
+# =========================
+MAX_CALIFICACIONES_POR_LOTE = 100
+
+
+class CalificacionCompanero(BaseModel):
+    evaluado_id: str
+    estrellas: int = Field(..., ge=1, le=5)
+    motivo: Optional[str] = Field(None, max_length=100)
+
+
+class CalificacionesEvento(BaseModel):
+    calificaciones: List[CalificacionCompanero] = Field(..., min_length=1, max_length=MAX_CALIFICACIONES_POR_LOTE)
+
+
+@router.post("/calificaciones/evento/{evento_id}")
+def calificar_companeros_evento(
+    evento_id: int,
+    datos: CalificacionesEvento,
+    access_token: str = Cookie(None)
+):
+    """
+    Califica de una vez a varios compañeros de un evento ya jugado.
+    Todos (evaluador y evaluados) deben haber participado en el evento;
+    las calificaciones repetidas para el mismo evento se omiten.
+    """
+    evaluador_id = verify_token(access_token)
+    evaluados = [c.evaluado_id for c in datos.calificaciones]
+    if evaluador_id in evaluados:
+        raise HTTPException(status_code=400, detail="No puedes calificarte a ti mismo")
+    if len(set(evaluados)) != len(evaluados):
+        raise HTTPException(status_code=400, detail="Hay usuarios repetidos en la lista")
+
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        # Una sola consulta: fecha del evento y cuáles de los involucrados participaron
+        # (el evento puede estar ya en el histórico)
+        cur.execute("""
+            WITH evento AS (
+                SELECT fecha_hora FROM eventos_deportivos
+                WHERE id = %(evento)s AND estado = 'activo'
+                UNION ALL
+                SELECT fecha_hora FROM eventos_deportivos_historico
+                WHERE id = %(evento)s
+            )
+            SELECT
+                (SELECT fecha_hora FROM evento LIMIT 1) AS fecha_hora,
+                ARRAY(
+                    SELECT usuario_id FROM usuarios_eventos
+                    WHERE evento_id = %(evento)s AND usuario_id = ANY(%(ids)s)
+                    UNION
+                    SELECT usuario_id FROM usuarios_eventos_historico
+                    WHERE evento_id = %(evento)s AND usuario_id = ANY(%(ids)s)
+                      AND fecha_evento = (SELECT fecha_hora FROM evento LIMIT 1)
+                ) AS participantes
+        """, {"evento": evento_id, "ids": evaluados + [evaluador_id]})
+        validacion = cur.fetchone()
+
+        if validacion["fecha_hora"] is None:
+            raise HTTPException(status_code=404, detail="Evento no encontrado")
+        if validacion["fecha_hora"] > datetime.now():
+            raise HTTPException(status_code=400, detail="El evento aún no se ha jugado")
+        participantes = set(validacion["participantes"])
+        if evaluador_id not in participantes:
+            raise HTTPException(status_code=403, detail="No participaste en este evento")
+        ajenos = [u for u in evaluados if u not in participantes]
+        if ajenos:
+            raise HTTPException(status_code=400, detail=f"No participaron en el evento: {', '.join(ajenos)}")
+
+        insertadas = psycopg2.extras.execute_values(cur, """
+            INSERT INTO calificaciones_usuarios (evaluador_id, evaluado_id, estrellas, motivo, tipo, evento_id)
+            VALUES %s
+            ON CONFLICT (evaluador_id, evaluado_id, evento_id) WHERE tipo = 'usuario' AND evento_id IS NOT NULL
+            DO NOTHING
+            RETURNING evaluado_id, estrellas
+        """, [
+            (evaluador_id, c.evaluado_id, c.estrellas, c.motivo, "usuario", evento_id)
+            for c in datos.calificaciones
+        ], page_size=MAX_CALIFICACIONES_POR_LOTE, fetch=True)
+
+        if insertadas:
+            sumar_a_resumenes(cur, [(c["evaluado_id"], c["estrellas"]) for c in insertadas])
+        conn.commit()
+        cur.close()
+        respuestas_cache.invalidar(*(f"user:{c['evaluado_id']}" for c in insertadas))
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Error al calificar evento")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if conn is not None:
+            conn.close()
+
+    return {
+        "mensaje": "Calificaciones registradas",
+        "evento_id": evento_id,
+        "creadas": len(insertadas),
+        "omitidas": len(datos.calificaciones) - len(insertadas)
+    }
+
+
 @router.post("/calificaciones/sistema/{evaluado_id}")
 def calificacion_sistema(
     evaluado_id: str,
     estrellas: int = Query(..., ge=1, le=5, description="Número de estrellas (1-5)"),
-    motivo: str = Query(..., max_length=100, description="Motivo del castigo, ej: 'abandono_evento'")
+    motivo: str = Query(..., max_length=100, description="Motivo del castigo, ej: 'abandono_evento'"),
+    evento_id: int = Query(None, description="Evento asociado (evita repetir la penalización)"),
+    x_clave_sistema: str = Header(None)
 ):
     """
-    Crea una calificación automática por parte del sistema para un usuario.
+    Crea una calificación manual por parte del sistema para un usuario.
+    Requiere el header X-Clave-Sistema.
     """
+    if not CLAVE_SISTEMA or not x_clave_sistema or not hmac.compare_digest(x_clave_sistema, CLAVE_SISTEMA):
+        raise HTTPException(status_code=403, detail="No autorizado")
+
     try:
         # No es necesario evaluador_id, es el sistema
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
         cur.execute("""
-            INSERT INTO calificaciones_usuarios (evaluador_id, evaluado_id, estrellas, motivo, tipo)
-            VALUES (NULL, %s, %s, %s, 'sistema')
+            INSERT INTO calificaciones_usuarios (evaluador_id, evaluado_id, estrellas, motivo, tipo, evento_id)
+            VALUES (NULL, %s, %s, %s, 'sistema', %s)
+            ON CONFLICT (evaluado_id, evento_id, motivo) WHERE tipo = 'sistema' DO NOTHING
             RETURNING id;
-        """, (evaluado_id, estrellas, motivo))
+        """, (evaluado_id, estrellas, motivo, evento_id))
 
         result = cur.fetchone()
+        if not result:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            raise HTTPException(status_code=409, detail="Ya existe esa calificación del sistema para el evento")
+
+        sumar_a_resumenes(cur, [(evaluado_id, estrellas)])
         conn.commit()
         cur.close()
         conn.close()
-
-        if not result or "id" not in result:
-            raise HTTPException(status_code=500, detail="No se pudo crear la calificación del sistema")
+        respuestas_cache.invalidar(f"user:{evaluado_id}")
 
         return {
             "mensaje": "Calificación de sistema creada exitosamente",
@@ -177,9 +415,19 @@ def calificacion_sistema(
             "evaluado_id": evaluado_id,
             "estrellas": estrellas,
             "motivo": motivo,
+            "evento_id": evento_id,
             "tipo": "sistema"
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print("❌ ERROR AL CREAR CALIFICACIÓN DE SISTEMA:", str(e))
+        log.exception("Error al crear calificación de sistema")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "--reconstruir":
+        print(f"Resúmenes de calificaciones reconstruidos: {reconstruir_resumenes()}")
+    else:
+        print("Uso: python calificaciones.py --reconstruir")
@@ -0,0 +1,216 @@
+from fastapi.concurrency import run_in_threadpool
+from bd import get_connection
+from chat import active_event_connections
+from notificaciones import notificar_usuarios
+from cache import rosters as rosters_cache
+import asyncio
+import escucha_bd
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+# =========================
+# Cancelación de eventos en segundo plano
+# =========================
+# El endpoint solo marca el evento como 'cancelado'; el aviso a los
+# participantes y la limpieza de filas se hacen aquí, fuera de la request.
+# Los websockets de cada participante pueden estar en cualquier worker: el
+# aviso se publica con NOTIFY y cada worker lo entrega a los suyos.
+FILAS_POR_LOTE = 1000
+CANAL_CANCELACIONES = "sunity_cancelaciones"
+PARTICIPANTES_POR_AVISO = 200   # El payload de NOTIFY tiene un máximo de 8000 bytes
+
+# Clave del advisory lock (junto al id del evento): con varios workers, o al
+# reanudar tras un reinicio, cada cancelación la procesa uno solo
+LOCK_CANCELACION = 7_302_003
+
+_loop = None   # Loop del worker, donde se entregan los avisos que llegan por NOTIFY
+
+
+def obtener_evento_cancelado(evento_id: int):
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, nombre FROM eventos_deportivos WHERE id = %s AND estado = 'cancelado'",
+            (evento_id,)
+        )
+        evento = cur.fetchone()
+        if not evento:
+            return None, []
+        cur.execute(
+            "SELECT usuario_id FROM usuarios_eventos WHERE evento_id = %s",
+            (evento_id,)
+        )
+        participantes = [fila["usuario_id"] for fila in cur.fetchall()]
+        cur.close()
+    finally:
+        conn.close()
+    return evento, participantes
+
+
+def tomar_lock_cancelacion(evento_id: int):
+    """Devuelve la conexión que tiene el lock (cerrarla lo suelta), o None si otro lo tiene"""
+    conn = get_connection()
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_lock(%s, %s) AS tomado", (LOCK_CANCELACION, evento_id))
+        tomado = cur.fetchone()["tomado"]
+        cur.close()
+    except Exception:
+        conn.close()
+        raise
+    if not tomado:
+        conn.close()
+        return None
+    return conn
+
+
+def publicar_aviso(evento: dict, participantes: list):
+    """NOTIFY a todos los workers, en trozos que caben en el payload"""
+    lotes = [participantes[i:i + PARTICIPANTES_POR_AVISO] for i in range(0, len(participantes), PARTICIPANTES_POR_AVISO)]
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        for i, lote in enumerate(lotes or [[]]):
+            aviso = {
+                "evento_id": evento["id"],
+                "nombre": evento["nombre"],
+                "participantes": lote,
+                "chat": i == 0,   # El chat del evento se avisa una sola vez
+            }
+            cur.execute("SELECT pg_notify(%s, %s)", (CANAL_CANCELACIONES, json.dumps(aviso)))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+async def avisar_en_este_worker(aviso: dict):
+    """Entrega un aviso de cancelación a los websockets abiertos en este worker"""
+    evento_id = aviso["evento_id"]
+    payload = {"tipo": "evento_cancelado", "evento_id": evento_id, "nombre": aviso["nombre"]}
+    await notificar_usuarios(aviso["participantes"], payload)
+    if not aviso["chat"]:
+        return
+
+    # Quienes tienen abierto el chat del evento también se enteran ahí
+    for (e_id, u_id), ws in list(active_event_connections.items()):
+        if e_id == evento_id:
+            try:
+                await ws.send_json(payload)
+            except Exception:
+                log.exception("Error avisando la cancelación en el chat del evento",
+                              extra={"evento_id": evento_id, "usuario_id": u_id})
+
+
+def recibir_aviso(aviso: dict):
+    """Llega por NOTIFY en el hilo de escucha_bd: la entrega se hace en el loop"""
+    if _loop is None:
+        return
+    asyncio.run_coroutine_threadsafe(avisar_en_este_worker(aviso), _loop)
+
+
+escucha_bd.registrar_canal(CANAL_CANCELACIONES, recibir_aviso)
+
+
+def borrar_en_lotes(tabla: str, evento_id: int) -> int:
+    """
+    Borra las filas del evento en lotes de FILAS_POR_LOTE, con un commit por
+    lote, para no mantener bloqueos largos en eventos con mucho historial.
+    """
+    total = 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        while True:
+            cur.execute(
+                f"""
+                DELETE FROM {tabla}
+                WHERE id IN (
+                    SELECT id FROM {tabla} WHERE evento_id = %s LIMIT %s
+                )
+                """,
+                (evento_id, FILAS_POR_LOTE)
+            )
+            borradas = cur.rowcount
+            conn.commit()
+            total += borradas
+            if borradas < FILAS_POR_LOTE:
+                break
+        cur.close()
+    finally:
+        conn.close()
+    return total
+
+
+def eliminar_evento(evento_id: int):
+    # Los mensajes y las inscripciones ya se borraron en lotes: el CASCADE no tiene trabajo
+    borrar_en_lotes("mensajes_eventos", evento_id)
+    borrar_en_lotes("usuarios_eventos", evento_id)
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "DELETE FROM eventos_deportivos WHERE id = %s AND estado = 'cancelado'",
+            (evento_id,)
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+async def procesar_cancelacion(evento_id: int):
+    """
+    Tarea de fondo tras cancelar un evento:
+    1. Avisa a cada participante por sus websockets abiertos (en todos los workers)
+    2. Borra los mensajes del chat del evento en lotes
+    3. Libera las inscripciones y elimina el evento
+    """
+    lock = None
+    try:
+        lock = await run_in_threadpool(tomar_lock_cancelacion, evento_id)
+        if lock is None:
+            return   # La está procesando otro worker
+
+        evento, participantes = await run_in_threadpool(obtener_evento_cancelado, evento_id)
+        if not evento:
+            return
+
+        await run_in_threadpool(publicar_aviso, evento, participantes)
+        await run_in_threadpool(eliminar_evento, evento_id)
+        rosters_cache.invalidar(evento_id)
+        log.info("Evento cancelado", extra={"evento_id": evento_id, "avisados": len(participantes)})
+    except Exception:
+        log.exception("Error procesando cancelación", extra={"evento_id": evento_id})
+    finally:
+        if lock is not None:
+            lock.close()
+
+
+def obtener_cancelaciones_pendientes():
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT id FROM eventos_deportivos WHERE estado = 'cancelado'")
+        pendientes = [fila["id"] for fila in cur.fetchall()]
+        cur.close()
+    finally:
+        conn.close()
+    return pendientes
+
+
+async def reanudar_cancelaciones():
+    """Al iniciar, retoma las cancelaciones que quedaron a medias por un reinicio"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+    try:
+        pendientes = await run_in_threadpool(obtener_cancelaciones_pendientes)
+    except Exception:
+        log.exception("Error buscando cancelaciones pendientes")
+        return
+    for evento_id in pendientes:
+        await procesar_cancelacion(evento_id)
@@ -0,0 +1,69 @@
+# catalogo_grupos.py
+# Catálogo de grupos deportivos en memoria.
+#
+# grupos_deportivos casi no cambia, así que cada worker guarda una instantánea
+# inmutable (tupla + mappingproxy) que se reemplaza entera al recargar: los
+# lectores nunca ven un catálogo a medias y no necesitan lock. La versión es
+# un hash del contenido, igual en todos los workers, y sirve de ETag.
+# Se carga al conectar escucha_bd y se recarga con el NOTIFY del trigger
+# de grupos_deportivos.
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+from bd import get_connection
+import escucha_bd
+import hashlib
+import json
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+CANAL_GRUPOS = "sunity_grupos"
+
+
+class InstantaneaGrupos(NamedTuple):
+    version: str
+    grupos: tuple           # ordenados por nombre, como los lista /grupos
+    por_id: MappingProxyType
+
+
+class CatalogoGrupos:
+
+    def __init__(self):
+        self._instantanea: Optional[InstantaneaGrupos] = None
+        self._lock = threading.Lock()  # Solo serializa las recargas
+
+    def instantanea(self) -> InstantaneaGrupos:
+        if self._instantanea is None:
+            self.cargar()
+        return self._instantanea
+
+    def grupo(self, grupo_id: int):
+        return self.instantanea().por_id.get(grupo_id)
+
+    def cargar(self, _cambio=None):
+        with self._lock:
+            conn = get_connection()
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT id, nombre, descripcion FROM grupos_deportivos ORDER BY nombre ASC")
+                filas = cur.fetchall()
+                cur.close()
+            finally:
+                conn.close()
+
+            grupos = tuple(
+                MappingProxyType({"id": g["id"], "nombre": g["nombre"], "descripcion": g["descripcion"]})
+                for g in filas
+            )
+            contenido = json.dumps([dict(g) for g in grupos], ensure_ascii=False, sort_keys=True)
+            self._instantanea = InstantaneaGrupos(
+                version=hashlib.md5(contenido.encode("utf-8")).hexdigest(),
+                grupos=grupos,
+                por_id=MappingProxyType({g["id"]: g for g in grupos}),
+            )
+        log.info("Catálogo de grupos cargado", extra={"grupos": len(grupos)})
+
+
+catalogo = CatalogoGrupos()
+escucha_bd.registrar_canal(CANAL_GRUPOS, catalogo.cargar, al_conectar=catalogo.cargar)
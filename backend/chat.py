@@ -1,16 +1,16 @@
-from typing import Dict
+from typing import Dict, List, Optional
 from fastapi import APIRouter, HTTPException, Cookie, Body, WebSocket, WebSocketDisconnect
-from jose import jwt
+from fastapi.concurrency import run_in_threadpool
+from autenticacion import verify_token
 from datetime import datetime
+from pydantic import BaseModel
 from bd import get_connection
+from metricas import mensajes_chat
+from registro import LOG_MUESTREO_WEBSOCKETS
+import logging
 import psycopg2.extras
-import os
 
-# =========================
-# Configuración JWT
-# =========================
-JWT_SECRET = os.getenv("JWT_SECRET")
-JWT_ALG = "HS256"
+log = logging.getLogger(__name__)
 
 # =========================
 # Router para chat
@@ -26,21 +26,46 @@ active_connections: Dict[str, WebSocket] = {}
 # Chat de eventos: (evento_id, usuario_id) -> WebSocket
 active_event_connections: Dict[tuple, WebSocket] = {}
 
+
 # =========================
-# Verificación de Token
+# Persistencia
 # =========================
-def verify_token(access_token: str) -> str:
-    """Decodifica el JWT y devuelve el google_id del usuario"""
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
+# Cada mensaje abre y cierra su conexión: un websocket puede quedar abierto
+# horas y no debe retener una conexión a Postgres mientras espera
+# ("with conn" de psycopg2 solo termina la transacción, no cierra).
+def guardar_mensaje_amigo(remitente_id: str, destinatario_id: str, mensaje: str):
+    conn = get_connection()
     try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-        google_id = payload.get("sub")
-        if not google_id:
-            raise HTTPException(status_code=401, detail="Token inválido")
-        return google_id.strip()
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido")
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO mensajes_amigos (remitente_id, destinatario_id, mensaje)
+                VALUES (%s, %s, %s)
+                """,
+                (remitente_id, destinatario_id, mensaje)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    mensajes_chat.labels("amigos").inc()
+
+
+def guardar_mensaje_evento(evento_id: int, remitente_id: str, mensaje: str):
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO mensajes_eventos (evento_id, remitente_id, mensaje)
+                VALUES (%s, %s, %s)
+                """,
+                (evento_id, remitente_id, mensaje)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    mensajes_chat.labels("evento").inc()
+
 
 # =========================
 # Chat entre amigos
@@ -63,46 +88,61 @@ def enviar_mensaje(
         raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío")
 
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO mensajes_amigos (remitente_id, destinatario_id, mensaje)
-                    VALUES (%s, %s, %s)
-                    """,
-                    (remitente_id, destinatario_id, mensaje)
-                )
-                conn.commit()
-    except Exception as e:
-        print("Error enviando mensaje:", e)
+        guardar_mensaje_amigo(remitente_id, destinatario_id, mensaje)
+    except Exception:
+        log.exception("Error enviando mensaje")
         raise HTTPException(status_code=500, detail="Error interno enviando mensaje")
 
     return {"ok": True, "message": "Mensaje enviado exitosamente"}
 
-@chat_router.get("/historial/{otro_id}")
+# =========================
+# Modelos de respuesta
+# =========================
+class MensajeAmigo(BaseModel):
+    remitente_id: str
+    destinatario_id: str
+    mensaje: str
+    fecha_envio: Optional[datetime] = None
+
+class HistorialAmigoRespuesta(BaseModel):
+    ok: bool
+    mensajes: List[MensajeAmigo]
+
+class MensajeEvento(BaseModel):
+    remitente_id: str
+    mensaje: str
+    fecha_envio: Optional[datetime] = None
+
+class HistorialEventoRespuesta(BaseModel):
+    ok: bool
+    mensajes: List[MensajeEvento]
+
+
+@chat_router.get("/historial/{otro_id}", response_model=HistorialAmigoRespuesta)
 def historial_mensajes(otro_id: str, access_token: str = Cookie(None)):
     usuario_id = verify_token(access_token)
 
+    conn = None
     try:
-        with get_connection() as conn:
-            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                cur.execute(
-                    """
-                    SELECT remitente_id, destinatario_id, mensaje, fecha_envio
-                    FROM mensajes_amigos
-                    WHERE LEAST(remitente_id, destinatario_id) = LEAST(%s, %s)
-                      AND GREATEST(remitente_id, destinatario_id) = GREATEST(%s, %s)
-                    ORDER BY fecha_envio ASC
-                    """,
-                    (usuario_id, otro_id, usuario_id, otro_id)
-                )
-                mensajes = cur.fetchall()
-                for m in mensajes:
-                    if isinstance(m["fecha_envio"], datetime):
-                        m["fecha_envio"] = m["fecha_envio"].isoformat()
-    except Exception as e:
-        print("Error obteniendo historial:", e)
+        conn = get_connection()
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT remitente_id, destinatario_id, mensaje, fecha_envio
+                FROM mensajes_amigos
+                WHERE LEAST(remitente_id, destinatario_id) = LEAST(%s, %s)
+                  AND GREATEST(remitente_id, destinatario_id) = GREATEST(%s, %s)
+                ORDER BY fecha_envio ASC
+                """,
+                (usuario_id, otro_id, usuario_id, otro_id)
+            )
+            mensajes = cur.fetchall()
+    except Exception:
+        log.exception("Error obteniendo historial")
         raise HTTPException(status_code=500, detail="Error interno obteniendo mensajes")
+    finally:
+        if conn is not None:
+            conn.close()
 
     return {"ok": True, "mensajes": mensajes}
 
@@ -113,7 +153,7 @@ async def websocket_chat(websocket: WebSocket, otro_id: str):
     remitente_id = verify_token(token)
 
     active_connections[remitente_id] = websocket
-    print(f"🟢 {remitente_id} conectado al chat")
+    log.info("Conectado al chat", extra={"usuario_id": remitente_id, "muestreo": LOG_MUESTREO_WEBSOCKETS})
 
     try:
         while True:
@@ -122,16 +162,7 @@ async def websocket_chat(websocket: WebSocket, otro_id: str):
             if not mensaje or not mensaje.strip():
                 continue
 
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        INSERT INTO mensajes_amigos (remitente_id, destinatario_id, mensaje)
-                        VALUES (%s, %s, %s)
-                        """,
-                        (remitente_id, otro_id, mensaje)
-                    )
-                    conn.commit()
+            await run_in_threadpool(guardar_mensaje_amigo, remitente_id, otro_id, mensaje)
 
             mensaje_payload = {
                 "remitente_id": remitente_id,
@@ -146,7 +177,7 @@ async def websocket_chat(websocket: WebSocket, otro_id: str):
             await websocket.send_json(mensaje_payload)
 
     except WebSocketDisconnect:
-        print(f"🔴 {remitente_id} desconectado")
+        log.info("Desconectado del chat", extra={"usuario_id": remitente_id, "muestreo": LOG_MUESTREO_WEBSOCKETS})
         active_connections.pop(remitente_id, None)
 
 
@@ -168,18 +199,9 @@ async def enviar_mensaje_evento(
         raise HTTPException(status_code=400, detail="El mensaje no puede estar vacío")
 
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO mensajes_eventos (evento_id, remitente_id, mensaje)
-                    VALUES (%s, %s, %s)
-                    """,
-                    (evento_id, usuario_id, mensaje)
-                )
-                conn.commit()
-    except Exception as e:
-        print("Error enviando mensaje de evento:", e)
+        await run_in_threadpool(guardar_mensaje_evento, evento_id, usuario_id, mensaje)
+    except Exception:
+        log.exception("Error enviando mensaje de evento")
         raise HTTPException(status_code=500, detail="Error interno enviando mensaje")
 
     mensaje_payload = {
@@ -202,12 +224,13 @@ async def enviar_mensaje_evento(
 
 
 
-@chat_router.get("/historial-evento/{evento_id}")
+@chat_router.get("/historial-evento/{evento_id}", response_model=HistorialEventoRespuesta)
 def historial_evento(evento_id: int, access_token: str = Cookie(None)):
     usuario_id = verify_token(access_token)
 
-    # Opcional: verificar que el usuario esté inscrito en el evento
-    with get_connection() as conn:
+    conn = get_connection()
+    try:
+        # Opcional: verificar que el usuario esté inscrito en el evento
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -219,8 +242,7 @@ def historial_evento(evento_id: int, access_token: str = Cookie(None)):
             if cur.fetchone() is None:
                 raise HTTPException(status_code=403, detail="No participas en este evento")
 
-    try:
-        with get_connection() as conn:
+        try:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -232,12 +254,11 @@ def historial_evento(evento_id: int, access_token: str = Cookie(None)):
                     (evento_id,)
                 )
                 mensajes = cur.fetchall()
-                for m in mensajes:
-                    if isinstance(m["fecha_envio"], datetime):
-                        m["fecha_envio"] = m["fecha_envio"].isoformat()
-    except Exception as e:
-        print("Error obteniendo historial de evento:", e)
-        raise HTTPException(status_code=500, detail="Error interno obteniendo mensajes")
+        except Exception:
+            log.exception("Error obteniendo historial de evento")
+            raise HTTPException(status_code=500, detail="Error interno obteniendo mensajes")
+    finally:
+        conn.close()
 
     return {"ok": True, "mensajes": mensajes}
 
@@ -251,7 +272,8 @@ async def websocket_evento(websocket: WebSocket, evento_id: int):
 
     # Guardar conexión activa
     active_event_connections[(evento_id, usuario_id)] = websocket
-    print(f"🟢 {usuario_id} conectado al chat del evento {evento_id}")
+    log.info("Conectado al chat del evento",
+             extra={"usuario_id": usuario_id, "evento_id": evento_id, "muestreo": LOG_MUESTREO_WEBSOCKETS})
 
     try:
         while True:
@@ -260,16 +282,7 @@ async def websocket_evento(websocket: WebSocket, evento_id: int):
             if not mensaje or not mensaje.strip():
                 continue
 
-            with get_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        INSERT INTO mensajes_eventos (evento_id, remitente_id, mensaje)
-                        VALUES (%s, %s, %s)
-                        """,
-                        (evento_id, usuario_id, mensaje)
-                    )
-                    conn.commit()
+            await run_in_threadpool(guardar_mensaje_evento, evento_id, usuario_id, mensaje)
 
             mensaje_payload = {
                 "evento_id": evento_id,
@@ -287,5 +300,6 @@ async def websocket_evento(websocket: WebSocket, evento_id: int):
                         pass
 
     except WebSocketDisconnect:
-        print(f"🔴 {usuario_id} desconectado del evento {evento_id}")
+        log.info("Desconectado del chat del evento",
+                 extra={"usuario_id": usuario_id, "evento_id": evento_id, "muestreo": LOG_MUESTREO_WEBSOCKETS})
         active_event_connections.pop((evento_id, usuario_id), None)
@@ -0,0 +1,206 @@
+# compresion.py
+# Compresión de respuestas HTTP (gzip, y brotli si está instalado).
+#
+# Se comprimen las respuestas de texto (JSON, iCalendar, métricas) de al
+# menos COMPRESION_MINIMO_BYTES cuando el cliente las acepta: brotli si el
+# módulo está disponible (pip install brotli), si no gzip. Los niveles por
+# defecto salen de bench/compresion.py: sobre los listados de eventos, subir
+# de ahí casi no achica la respuesta y cuesta bastante más CPU.
+# Los cuerpos grandes se comprimen en el threadpool para no frenar el event
+# loop; los streaming (feed .ics) se comprimen trozo a trozo.
+#
+# Los websockets de chat usan permessage-deflate, que negocia uvicorn
+# (--ws-per-message-deflate, activo por defecto) cuando el cliente lo ofrece;
+# acá solo se cuenta cuántas conexiones lo ofrecen.
+from typing import Optional
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from metricas import compresion_bytes_entrada, compresion_bytes_salida, compresion_cpu, compresion_razon, websockets_deflate
+import os
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESION_MINIMO_BYTES = int(os.getenv("COMPRESION_MINIMO_BYTES", "1024"))   # Menos que eso entra en un paquete igual
+COMPRESION_NIVEL_GZIP = int(os.getenv("COMPRESION_NIVEL_GZIP", "5"))
+COMPRESION_NIVEL_BROTLI = int(os.getenv("COMPRESION_NIVEL_BROTLI", "4"))
+COMPRESION_HILO_BYTES = 64 * 1024   # Desde este tamaño se comprime fuera del event loop
+
+TIPOS_COMPRIMIBLES = ("text/", "application/json", "application/javascript", "application/xml", "image/svg+xml")
+CODIFICACIONES = ("br", "gzip") if brotli is not None else ("gzip",)   # En orden de preferencia
+
+
+def elegir_codificacion(accept_encoding: Optional[str]) -> Optional[str]:
+    """La codificación soportada con mayor q en Accept-Encoding (a igual q, la preferida)"""
+    if not accept_encoding:
+        return None
+    aceptadas = {}
+    for parte in accept_encoding.lower().split(","):
+        nombre, _, parametros = parte.partition(";")
+        q = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith("q="):
+            try:
+                q = float(parametros[2:])
+            except ValueError:
+                q = 0.0
+        aceptadas[nombre.strip()] = q
+    comodin = aceptadas.get("*", 0.0)
+    mejor, mejor_q = None, 0.0
+    for codificacion in CODIFICACIONES:
+        q = aceptadas.get(codificacion, comodin)
+        if q > mejor_q:
+            mejor, mejor_q = codificacion, q
+    return mejor
+
+
+def _compresor(codificacion: str):
+    if codificacion == "br":
+        return brotli.Compressor(quality=COMPRESION_NIVEL_BROTLI)
+    return zlib.compressobj(COMPRESION_NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)   # 16+: formato gzip
+
+
+def _comprimir_trozo(compresor, codificacion: str, cuerpo: bytes, final: bool):
+    """Devuelve los bytes comprimidos y el tiempo de CPU que tomó"""
+    inicio = time.thread_time()
+    if codificacion == "br":
+        salida = compresor.process(cuerpo) + (compresor.finish() if final else b"")
+    else:
+        salida = compresor.compress(cuerpo) + (compresor.flush() if final else b"")
+    return salida, time.thread_time() - inicio
+
+
+def _comprimir_todo(codificacion: str, cuerpo: bytes):
+    return _comprimir_trozo(_compresor(codificacion), codificacion, cuerpo, True)
+
+
+def _registrar(codificacion: str, entrada: int, salida: int, cpu: float):
+    compresion_bytes_entrada.labels(codificacion).inc(entrada)
+    compresion_bytes_salida.labels(codificacion).inc(salida)
+    compresion_cpu.labels(codificacion).inc(cpu)
+    if entrada:
+        compresion_razon.labels(codificacion).observe(salida / entrada)
+
+
+def _comprimible(inicio: dict, headers: Headers) -> bool:
+    if inicio["status"] < 200 or inicio["status"] in (204, 304) or "content-encoding" in headers:
+        return False
+    return headers.get("content-type", "").startswith(TIPOS_COMPRIMIBLES)
+
+
+class _Respuesta:
+    """Intercepta los mensajes de una respuesta y decide si la comprime al ver el primer trozo"""
+
+    def __init__(self, send, codificacion: str, minimo_bytes: int):
+        self.send = send
+        self.codificacion = codificacion
+        self.minimo_bytes = minimo_bytes
+        self.inicio = None
+        self.modo = None   # "directo" o "flujo", decidido con el primer trozo
+        self.compresor = None
+        self.entrada = self.salida = 0
+        self.cpu = 0.0
+
+    async def enviar(self, mensaje):
+        tipo = mensaje["type"]
+        if tipo == "http.response.start":
+            self.inicio = mensaje
+            return
+        if tipo != "http.response.body":
+            await self._soltar_inicio()
+            await self.send(mensaje)
+            return
+
+        cuerpo = mensaje.get("body", b"")
+        hay_mas = mensaje.get("more_body", False)
+        if self.modo is None:
+            await self._primer_trozo(cuerpo, hay_mas)
+        elif self.modo == "flujo":
+            salida, cpu = _comprimir_trozo(self.compresor, self.codificacion, cuerpo, not hay_mas)
+            self._sumar(len(cuerpo), len(salida), cpu, final=not hay_mas)
+            await self.send({"type": "http.response.body", "body": salida, "more_body": hay_mas})
+        else:
+            await self.send(mensaje)
+
+    async def _soltar_inicio(self):
+        if self.inicio is not None:
+            inicio, self.inicio = self.inicio, None
+            await self.send(inicio)
+
+    async def _primer_trozo(self, cuerpo: bytes, hay_mas: bool):
+        headers = MutableHeaders(raw=list(self.inicio["headers"]))
+        if not _comprimible(self.inicio, headers):
+            self.modo = "directo"
+            await self._soltar_inicio()
+            await self.send({"type": "http.response.body", "body": cuerpo, "more_body": hay_mas})
+            return
+
+        headers.add_vary_header("Accept-Encoding")
+        if not hay_mas:
+            comprimido = None
+            if len(cuerpo) >= self.minimo_bytes:
+                if len(cuerpo) >= COMPRESION_HILO_BYTES:
+                    comprimido, cpu = await run_in_threadpool(_comprimir_todo, self.codificacion, cuerpo)
+                else:
+                    comprimido, cpu = _comprimir_todo(self.codificacion, cuerpo)
+                _registrar(self.codificacion, len(cuerpo), len(comprimido), cpu)
+            self.modo = "directo"
+            if comprimido is not None and len(comprimido) < len(cuerpo):
+                self._marcar_comprimida(headers)
+                headers["Content-Length"] = str(len(comprimido))
+                cuerpo = comprimido
+            await self.send({**self.inicio, "headers": headers.raw})
+            await self.send({"type": "http.response.body", "body": cuerpo, "more_body": False})
+            return
+
+        # Streaming: no se conoce el tamaño, se comprime trozo a trozo
+        self.modo = "flujo"
+        self.compresor = _compresor(self.codificacion)
+        self._marcar_comprimida(headers)
+        del headers["Content-Length"]
+        salida, cpu = _comprimir_trozo(self.compresor, self.codificacion, cuerpo, False)
+        self._sumar(len(cuerpo), len(salida), cpu, final=False)
+        await self.send({**self.inicio, "headers": headers.raw})
+        await self.send({"type": "http.response.body", "body": salida, "more_body": True})
+
+    def _marcar_comprimida(self, headers: MutableHeaders):
+        headers["Content-Encoding"] = self.codificacion
+        # Otra representación, otros bytes: un ETag fuerte pasa a débil
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            headers["ETag"] = f"W/{etag}"
+
+    def _sumar(self, entrada: int, salida: int, cpu: float, final: bool):
+        self.entrada += entrada
+        self.salida += salida
+        self.cpu += cpu
+        if final:
+            _registrar(self.codificacion, self.entrada, self.salida, self.cpu)
+
+
+class MiddlewareCompresion:
+    """Middleware ASGI: comprime las respuestas según Accept-Encoding"""
+
+    def __init__(self, app, minimo_bytes: int = COMPRESION_MINIMO_BYTES):
+        self.app = app
+        self.minimo_bytes = minimo_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            extensiones = Headers(scope=scope).get("sec-websocket-extensions", "")
+            websockets_deflate.labels("si" if "permessage-deflate" in extensiones else "no").inc()
+            await self.app(scope, receive, send)
+            return
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+
+        codificacion = elegir_codificacion(Headers(scope=scope).get("accept-encoding"))
+        if codificacion is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Respuesta(send, codificacion, self.minimo_bytes).enviar)
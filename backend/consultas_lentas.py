@@ -0,0 +1,152 @@
+# consultas_lentas.py
+# Log de consultas lentas.
+#
+# Observa todas las consultas que pasan por bd.py. Las que tardan más de
+# CONSULTA_LENTA_MS se registran con su nombre, archivo y línea, y los
+# parámetros redactados (de los textos solo se muestra el largo, también
+# en el plan).
+# Una fracción EXPLAIN_MUESTREO de ellas se vuelve a ejecutar con
+# EXPLAIN (ANALYZE, BUFFERS) en un hilo aparte, dentro de una transacción de
+# solo lectura que se descarta, para dejar el plan en el log sin demorar la
+# petición. Solo se explican SELECT: EXPLAIN ANALYZE ejecuta la consulta.
+from datetime import date, datetime
+from decimal import Decimal
+from bd import get_connection, registrar_observador_consultas, ubicacion_consulta
+import logging
+import os
+import queue
+import random
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+CONSULTA_LENTA_MS = float(os.getenv("CONSULTA_LENTA_MS", "200"))
+EXPLAIN_MUESTREO = float(os.getenv("EXPLAIN_MUESTREO", "0.1"))
+EXPLAIN_TIMEOUT_MS = int(os.getenv("EXPLAIN_TIMEOUT_MS", "10000"))
+EXPLAIN_COLA_MAX = 20       # Si se llena, las siguientes consultas lentas quedan sin plan
+SQL_MAX_CARACTERES = 2000   # Para el log; las consultas largas se cortan
+
+_ARREGLO_LITERAL = re.compile(r"'\{[^']*\}'")  # ej: '{u1,u2}' de un ANY(%s)
+_EXPLICABLE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+_NO_EXPLICABLE = re.compile(r"\b(INSERT|UPDATE|DELETE|ADVISORY)", re.IGNORECASE)
+
+_cola = queue.Queue(maxsize=EXPLAIN_COLA_MAX)
+_hilo = None
+_lock = threading.Lock()
+_registrado = False
+
+
+def redactar(valor):
+    """Deja números, fechas y nulos (sirven para reproducir el plan) y oculta los textos"""
+    if valor is None or isinstance(valor, (bool, int, float, Decimal, date, datetime)):
+        return valor
+    if isinstance(valor, dict):
+        return {clave: redactar(v) for clave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        if len(valor) > 10:
+            return f"<lista:{len(valor)}>"
+        return [redactar(v) for v in valor]
+    if isinstance(valor, str):
+        return f"<texto:{len(valor)}>"
+    return f"<{type(valor).__name__}>"
+
+
+def _textos(valor) -> set:
+    if isinstance(valor, str):
+        return {valor} if valor else set()
+    if isinstance(valor, dict):
+        valor = list(valor.values())
+    if isinstance(valor, (list, tuple)):
+        return set().union(*(_textos(v) for v in valor))
+    return set()
+
+
+def redactar_plan(plan: list, parametros) -> list:
+    """El plan trae los parámetros como literales: se ocultan los textos igual que en el log"""
+    textos = sorted(_textos(parametros), key=len, reverse=True)
+    patron = re.compile("|".join(re.escape("'" + t.replace("'", "''") + "'") for t in textos)) if textos else None
+    redactado = []
+    for linea in plan:
+        if patron is not None:
+            linea = patron.sub("'<texto>'", linea)
+        redactado.append(_ARREGLO_LITERAL.sub("'<lista>'", linea))
+    return redactado
+
+
+def _texto_sql(sql) -> str:
+    if isinstance(sql, bytes):
+        return sql.decode("utf-8", errors="replace")
+    return sql if isinstance(sql, str) else repr(sql)
+
+
+def observar(nombre: str, sql, parametros, segundos: float):
+    milisegundos = segundos * 1000
+    if milisegundos < CONSULTA_LENTA_MS or threading.current_thread() is _hilo:
+        return
+
+    ubicacion = ubicacion_consulta()
+    texto = _texto_sql(sql)
+    log.warning("Consulta lenta", extra={
+        "consulta": nombre,
+        "ubicacion": ubicacion,
+        "ms": round(milisegundos),
+        "parametros": redactar(parametros),
+        "sql": " ".join(texto.split())[:SQL_MAX_CARACTERES],
+    })
+
+    if (
+        isinstance(sql, (str, bytes))
+        and _EXPLICABLE.match(texto)
+        and not _NO_EXPLICABLE.search(texto)
+        and random.random() < EXPLAIN_MUESTREO
+    ):
+        _asegurar_hilo()
+        try:
+            _cola.put_nowait((nombre, ubicacion, texto, parametros))
+        except queue.Full:
+            pass
+
+
+def _asegurar_hilo():
+    global _hilo
+    with _lock:
+        if _hilo is None:
+            _hilo = threading.Thread(target=_explicar_pendientes, name="explain-consultas", daemon=True)
+            _hilo.start()
+
+
+def _explicar_pendientes():
+    while True:
+        nombre, ubicacion, texto, parametros = _cola.get()
+        try:
+            plan = redactar_plan(explicar(texto, parametros), parametros)
+            log.info("Plan de consulta lenta", extra={"consulta": nombre, "ubicacion": ubicacion, "plan": plan})
+        except Exception:
+            log.exception("No se pudo obtener el plan", extra={"consulta": nombre})
+
+
+def explicar(texto: str, parametros) -> list:
+    """Ejecuta EXPLAIN (ANALYZE, BUFFERS) en una transacción de solo lectura y la descarta"""
+    conn = get_connection()
+    try:
+        conn.set_session(readonly=True)
+        cur = conn.cursor()
+        cur.execute("SET LOCAL statement_timeout = %s", (EXPLAIN_TIMEOUT_MS,))
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + texto, parametros)
+        plan = [fila["QUERY PLAN"] for fila in cur.fetchall()]
+        cur.close()
+        conn.rollback()
+    finally:
+        conn.close()
+    return plan
+
+
+def registrar():
+    """Empieza a observar las consultas de bd.py (una sola vez por proceso)"""
+    global _registrado
+    with _lock:
+        if _registrado:
+            return
+        _registrado = True
+    registrar_observador_consultas(observar)
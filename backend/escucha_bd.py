@@ -0,0 +1,75 @@
+# escucha_bd.py
+# Escucha de notificaciones de PostgreSQL (LISTEN/NOTIFY).
+#
+# Cada worker abre una conexión dedicada en un hilo aparte. Los módulos
+# registran un canal con la función que aplica cada mensaje y, opcionalmente,
+# una función que recarga todo su estado al (re)conectar, porque mientras la
+# conexión estuvo caída se pudieron perder notificaciones.
+from bd import get_connection
+import json
+import logging
+import select
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+ESPERA_RECONEXION_SEGUNDOS = 5
+
+_canales = {}      # canal -> función(payload: dict)
+_al_conectar = []  # funciones sin argumentos
+_hilo = None
+
+
+def registrar_canal(canal: str, funcion, al_conectar=None):
+    _canales[canal] = funcion
+    if al_conectar is not None:
+        _al_conectar.append(al_conectar)
+
+
+def iniciar_escucha():
+    """Arranca el hilo de escucha (una sola vez por worker)"""
+    global _hilo
+    if _hilo is not None:
+        return
+    _hilo = threading.Thread(target=_escuchar, name="escucha-bd", daemon=True)
+    _hilo.start()
+
+
+def _escuchar():
+    while True:
+        conn = None
+        try:
+            conn = get_connection()
+            conn.autocommit = True
+            cur = conn.cursor()
+            for canal in _canales:
+                cur.execute(f"LISTEN {canal}")
+
+            # Las notificaciones que lleguen mientras se recarga quedan en
+            # conn.notifies y se aplican después, en orden
+            for recargar in _al_conectar:
+                recargar()
+
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notificacion = conn.notifies.pop(0)
+                    funcion = _canales.get(notificacion.channel)
+                    if funcion is None:
+                        continue
+                    try:
+                        funcion(json.loads(notificacion.payload))
+                    except Exception:
+                        log.exception("Error aplicando notificación", extra={"canal": notificacion.channel})
+        except Exception:
+            log.exception("Error escuchando notificaciones de la BD")
+            time.sleep(ESPERA_RECONEXION_SEGUNDOS)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
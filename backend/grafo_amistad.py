@@ -0,0 +1,118 @@
+# grafo_amistad.py
+# Grafo de amistades en memoria.
+#
+# Cada worker guarda las amistades y las solicitudes pendientes como
+# conjuntos de adyacencia, así el estado entre dos usuarios se responde sin
+# consultar la BD. Se carga al iniciar y se mantiene al día de dos formas:
+# - los endpoints de amistad lo actualizan apenas hacen commit
+# - los triggers de amigos y solicitudes_amistad envían NOTIFY, que
+#   escucha_bd aplica en todos los workers (incluye cambios hechos a mano)
+from typing import Dict, Set
+from bd import get_connection
+import escucha_bd
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+CANAL_AMISTAD = "sunity_amistad"
+
+
+class GrafoAmistad:
+
+    def __init__(self):
+        self.amigos: Dict[str, Set[str]] = {}
+        self.enviadas: Dict[str, Set[str]] = {}   # solicitante -> destinatarios pendientes
+        self.recibidas: Dict[str, Set[str]] = {}  # destinatario -> solicitantes pendientes
+        self.cargado = False
+        self._lock = threading.Lock()
+
+    # -------- Lectura --------
+    def estado(self, usuario_id: str, otro_id: str) -> str:
+        """'amigos', 'solicitud_enviada', 'solicitud_recibida' o 'ninguno'"""
+        if otro_id in self.amigos.get(usuario_id, ()):
+            return "amigos"
+        if otro_id in self.enviadas.get(usuario_id, ()):
+            return "solicitud_enviada"
+        if otro_id in self.recibidas.get(usuario_id, ()):
+            return "solicitud_recibida"
+        return "ninguno"
+
+    def amigos_de(self, usuario_id: str) -> Set[str]:
+        with self._lock:
+            return set(self.amigos.get(usuario_id, ()))
+
+    # -------- Escritura --------
+    @staticmethod
+    def _agregar(indice, a, b):
+        indice.setdefault(a, set()).add(b)
+
+    @staticmethod
+    def _quitar(indice, a, b):
+        vecinos = indice.get(a)
+        if vecinos is not None:
+            vecinos.discard(b)
+            if not vecinos:
+                del indice[a]
+
+    def agregar_amistad(self, a: str, b: str):
+        with self._lock:
+            self._agregar(self.amigos, a, b)
+            self._agregar(self.amigos, b, a)
+
+    def quitar_amistad(self, a: str, b: str):
+        with self._lock:
+            self._quitar(self.amigos, a, b)
+            self._quitar(self.amigos, b, a)
+
+    def agregar_solicitud(self, solicitante: str, destinatario: str):
+        with self._lock:
+            self._agregar(self.enviadas, solicitante, destinatario)
+            self._agregar(self.recibidas, destinatario, solicitante)
+
+    def quitar_solicitud(self, solicitante: str, destinatario: str):
+        with self._lock:
+            self._quitar(self.enviadas, solicitante, destinatario)
+            self._quitar(self.recibidas, destinatario, solicitante)
+
+    def aplicar(self, cambio: dict):
+        """Aplica un mensaje de NOTIFY enviado por los triggers"""
+        operaciones = {
+            "agregar_amistad": self.agregar_amistad,
+            "quitar_amistad": self.quitar_amistad,
+            "agregar_solicitud": self.agregar_solicitud,
+            "quitar_solicitud": self.quitar_solicitud,
+        }
+        operaciones[cambio["op"]](cambio["a"], cambio["b"])
+
+    def cargar(self):
+        """Reconstruye el grafo completo desde la BD"""
+        amigos, enviadas, recibidas = {}, {}, {}
+        conn = get_connection()
+        try:
+            cur = conn.cursor(name="grafo_amistad")
+            cur.itersize = 10000
+            cur.execute("SELECT usuario_id, amigo_id FROM amigos")
+            for fila in cur:
+                self._agregar(amigos, fila["usuario_id"], fila["amigo_id"])
+                self._agregar(amigos, fila["amigo_id"], fila["usuario_id"])
+            cur.close()
+
+            cur = conn.cursor(name="grafo_solicitudes")
+            cur.itersize = 10000
+            cur.execute("SELECT solicitante_id, destinatario_id FROM solicitudes_amistad WHERE estado = 'pendiente'")
+            for fila in cur:
+                self._agregar(enviadas, fila["solicitante_id"], fila["destinatario_id"])
+                self._agregar(recibidas, fila["destinatario_id"], fila["solicitante_id"])
+            cur.close()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self.amigos, self.enviadas, self.recibidas = amigos, enviadas, recibidas
+            self.cargado = True
+        log.info("Grafo de amistad cargado", extra={"usuarios_con_amigos": len(amigos)})
+
+
+grafo = GrafoAmistad()
+escucha_bd.registrar_canal(CANAL_AMISTAD, grafo.aplicar, al_conectar=grafo.cargar)
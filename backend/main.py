@@ -1,19 +1,42 @@
-from typing import Optional
-from fastapi import FastAPI, HTTPException, Response, Cookie, UploadFile, File, Path
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Response, Cookie, UploadFile, File, Path, Query, BackgroundTasks, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from google.oauth2 import id_token as google_id_token  # type: ignore
 from google.auth.transport import requests as google_requests  # type: ignore
 from jose import jwt
+from autenticacion import verify_token, decodificar_sesion, JWT_SECRET, JWT_ALG
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+import logging
 import os
 from bd import get_connection
 from fastapi.staticfiles import StaticFiles
 import psycopg2.extras  # Necesario para RealDictCursor
 import shutil
-from chat import chat_router
+import asyncio
+from chat import chat_router, active_connections as chat_connections, active_event_connections
 from calificaciones import router as calificaciones_router
+from calendario import calendario_router
+from cache import rosters as rosters_cache, respuestas as respuestas_cache, MiddlewareCacheRespuestas
+from notificaciones import notificaciones_router, active_notification_connections
+from cancelaciones import procesar_cancelacion, reanudar_cancelaciones
+from archivo import ciclo_archivo
+from reputacion import ciclo_reputacion, REPUTACION_INICIAL
+from penalizaciones import ciclo_penalizaciones
+from recordatorios import planificador
+from grafo_amistad import grafo as grafo_amistad
+from catalogo_grupos import catalogo as catalogo_grupos
+from sugerencias import sugerencias_router, refrescar_tras_cambio_amistad
+from serializacion import RespuestaJSON
+from metricas import metricas_router, MiddlewareMetricas, medir_websockets, subidas_bytes
+import consultas_lentas
+from perfilado import perfilado_router, MiddlewarePerfilado, verificar_permiso
+from compresion import MiddlewareCompresion
+import escucha_bd
+import registro
+
+log = logging.getLogger(__name__)
 
 
 
@@ -26,13 +49,19 @@ from calificaciones import router as calificaciones_router
 load_dotenv()
 
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
-JWT_SECRET = os.getenv("JWT_SECRET")
-JWT_ALG = "HS256"
 
 # =========================================
 # INICIALIZACIÓN DE LA APP FASTAPI
 # =========================================
-app = FastAPI()
+# Todas las rutas (también las de los routers) responden con orjson
+app = FastAPI(default_response_class=RespuestaJSON)
+
+# Logs en JSON, escritos desde un hilo aparte (ver registro.py)
+registro.configurar()
+
+# Caché de respuestas GET (las rutas se configuran más abajo, junto a los routers).
+# Va antes de CORS para que las respuestas desde caché también lleven sus headers.
+app.add_middleware(MiddlewareCacheRespuestas, cache=respuestas_cache)
 
 # Configuración de CORS para Ionic
 app.add_middleware(
@@ -43,6 +72,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli para respuestas de texto grandes (también las que salen de la caché)
+app.add_middleware(MiddlewareCompresion)
+
+# Perfilado a pedido (header X-Perfilar firmado) o por muestreo
+app.add_middleware(MiddlewarePerfilado)
+
+# Métricas Prometheus: va por fuera de todo para medir también los aciertos de caché
+app.add_middleware(MiddlewareMetricas)
+
+# Id de petición/conexión para los logs: el más externo, así todo lo que se loguee lo lleva
+app.add_middleware(registro.MiddlewareCorrelacion)
+
 # =========================================
 # MODELOS DE Pydantic
 # =========================================
@@ -62,6 +103,56 @@ class UpdateProfile(BaseModel):
 
 app.include_router(chat_router)
 app.include_router(calificaciones_router)
+app.include_router(calendario_router)
+app.include_router(notificaciones_router)
+app.include_router(sugerencias_router)
+app.include_router(metricas_router)
+app.include_router(perfilado_router)
+
+medir_websockets("chat_amigos", chat_connections)
+medir_websockets("chat_evento", active_event_connections)
+medir_websockets("notificaciones", active_notification_connections,
+                 contar=lambda conexiones: sum(len(sockets) for sockets in list(conexiones.values())))
+
+# Rutas de lectura con caché: TTL, si varía por usuario y etiquetas para invalidar
+respuestas_cache.configurar("/grupos/{grupo_id}/eventos", ttl_segundos=30, etiquetas=["group:{grupo_id}"])
+respuestas_cache.configurar("/usuarios/{user_id}", ttl_segundos=120, etiquetas=["user:{user_id}"])
+respuestas_cache.configurar("/calificaciones/{evaluado_id}", ttl_segundos=120, etiquetas=["user:{evaluado_id}"])
+respuestas_cache.configurar("/calificaciones/{evaluado_id}/detalles", ttl_segundos=60, etiquetas=["user:{evaluado_id}"])
+
+
+@app.get("/cache/estadisticas", include_in_schema=False)
+def estadisticas_cache(x_perfilar: Optional[str] = Header(None)):
+    """Aciertos, fallos y memoria usada por la caché de respuestas de este worker (con el permiso de perfilado)"""
+    verificar_permiso(x_perfilar)
+    return respuestas_cache.estadisticas()
+
+
+# Referencias a las tareas de fondo (asyncio solo guarda referencias débiles)
+tareas_de_fondo = set()
+
+
+@app.on_event("startup")
+async def iniciar_tareas_de_fondo():
+    # LISTEN/NOTIFY: carga el grafo de amistad y el catálogo de grupos y los mantiene al día
+    escucha_bd.iniciar_escucha()
+    # Log de consultas lentas (y sus planes) sobre todas las consultas de bd.py
+    consultas_lentas.registrar()
+    # Cancelaciones que quedaron a medias si el servidor se reinició
+    tareas_de_fondo.add(asyncio.create_task(reanudar_cancelaciones()))
+    # Mueve al histórico los eventos más viejos que ARCHIVO_HORIZONTE_DIAS
+    tareas_de_fondo.add(asyncio.create_task(ciclo_archivo()))
+    # Recordatorios antes de cada evento (recupera los pendientes desde la BD)
+    tareas_de_fondo.add(asyncio.create_task(planificador.ejecutar()))
+    # Reputación con decaimiento (la usan recomendados y el listado de eventos)
+    tareas_de_fondo.add(asyncio.create_task(ciclo_reputacion()))
+    # Penaliza los abandonos de último momento una vez terminado cada evento
+    tareas_de_fondo.add(asyncio.create_task(ciclo_penalizaciones()))
+
+
+@app.on_event("shutdown")
+def vaciar_logs():
+    registro.detener()
 
 
 # =========================================
@@ -113,8 +204,8 @@ def auth_google(payload: TokenIn, response: Response):
 
         cur.close()
         conn.close()
-    except Exception as e:
-        print("Error guardando usuario:", e)
+    except Exception:
+        log.exception("Error guardando usuario")
         raise HTTPException(status_code=500, detail="Error interno guardando usuario")
 
     # Crear JWT propio
@@ -140,12 +231,7 @@ def get_profile(access_token: str = Cookie(None)):
     """
     Obtiene los datos básicos del usuario (id, email, name) a partir del JWT en la cookie.
     """
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
-    try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido")
+    payload = decodificar_sesion(access_token)
     return {"user": {"id": payload["sub"], "email": payload["email"], "name": payload["name"]}}
 
 @app.post("/logout")
@@ -161,14 +247,7 @@ def logout(response: Response):
 # =========================================
 @app.post("/profile/update")
 def update_profile(data: UpdateProfile, access_token: str = Cookie(None)):
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
-
-    try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-        user_id = payload["sub"]
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido")
+    user_id = verify_token(access_token)
 
     # Construir dinámicamente los campos a actualizar
     campos = []
@@ -192,8 +271,9 @@ def update_profile(data: UpdateProfile, access_token: str = Cookie(None)):
         conn.commit()
         cur.close()
         conn.close()
-    except Exception as e:
-        print("Error actualizando usuario:", e)
+        respuestas_cache.invalidar(f"user:{user_id}")
+    except Exception:
+        log.exception("Error actualizando usuario")
         raise HTTPException(status_code=500, detail="Error interno actualizando usuario")
 
     return {"ok": True, "message": "Perfil actualizado"}
@@ -215,15 +295,9 @@ def upload_profile_photo(file: UploadFile = File(...), access_token: str = Cooki
     - Guarda la imagen en /uploads
     - Actualiza la URL en la base de datos
     """
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
-    
-    try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-        user_id = payload["sub"]
-        email = payload["email"]
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido")
+    payload = decodificar_sesion(access_token)
+    user_id = payload["sub"]
+    email = payload["email"]
     
     # Validar tipo de archivo
     if file.content_type not in ["image/jpeg", "image/png", "image/webp"]:
@@ -240,6 +314,7 @@ def upload_profile_photo(file: UploadFile = File(...), access_token: str = Cooki
     # Guardar archivo
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
+        subidas_bytes.inc(buffer.tell())
     
     # URL accesible
     file_url = f"/uploads/{filename}"
@@ -255,8 +330,9 @@ def upload_profile_photo(file: UploadFile = File(...), access_token: str = Cooki
         conn.commit()
         cur.close()
         conn.close()
-    except Exception as e:
-        print("Error actualizando foto de perfil:", e)
+        respuestas_cache.invalidar(f"user:{user_id}")
+    except Exception:
+        log.exception("Error actualizando foto de perfil")
         raise HTTPException(status_code=500, detail="Error interno guardando la foto")
     
     return {"ok": True, "message": "Foto subida exitosamente", "url": file_url}
@@ -281,21 +357,11 @@ def get_user_data(user_id: str):
         cur.close()
         conn.close()
         return result
-    except Exception as e:
-        print("Error obteniendo datos del usuario:", e)
+    except Exception:
+        log.exception("Error obteniendo datos del usuario")
         raise HTTPException(status_code=500, detail="Error interno obteniendo perfil")
 
 
-def verify_token(access_token: str):
-    """Decodifica el JWT y devuelve el google_id"""
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
-    try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-        return payload["sub"].strip()
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido")
-
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 @app.get("/profile/foto")
@@ -393,24 +459,36 @@ def get_carrera(access_token: str = Cookie(None)):
 # RUTA GRUPOS
 # =========================================
 
-@app.get("/grupos")
-def get_all_grupos():
+class Grupo(BaseModel):
+    id: int
+    nombre: str
+    descripcion: Optional[str] = None
+
+class GruposRespuesta(BaseModel):
+    ok: bool
+    version: str
+    grupos: List[Grupo]
+
+@app.get("/grupos", response_model=GruposRespuesta)
+def get_all_grupos(response: Response, if_none_match: Optional[str] = Header(None)):
+    """
+    Catálogo de grupos desde memoria. El ETag es la versión del catálogo:
+    si el cliente ya la tiene, responde 304 sin cuerpo.
+    """
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id, nombre, descripcion FROM grupos_deportivos ORDER BY nombre ASC")
-        grupos = cur.fetchall()  # Esto devuelve RealDictRow si usas RealDictCursor
-        print("DEBUG grupos:", grupos)
-        cur.close()
-        conn.close()
+        instantanea = catalogo_grupos.instantanea()
     except Exception as e:
-        print("Error obteniendo grupos:", e)
+        log.exception("Error obteniendo grupos")
         raise HTTPException(status_code=500, detail=f"Error interno obteniendo grupos: {e}")
 
-    grupos_list = [
-        {"id": g["id"], "nombre": g["nombre"], "descripcion": g["descripcion"]} for g in grupos
-    ]
-    return {"ok": True, "grupos": grupos_list}
+    etag = f'"{instantanea.version}"'
+    # Si la respuesta se envió comprimida el cliente lo devuelve como ETag débil
+    if if_none_match in (etag, f"W/{etag}"):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return {"ok": True, "version": instantanea.version, "grupos": [dict(g) for g in instantanea.grupos]}
 
 # Modelo Pydantic para crear un evento
 class EventoCrear(BaseModel):
@@ -438,17 +516,22 @@ def crear_evento(evento: EventoCrear, access_token: str = Cookie(None)):
     if evento.max_participantes <= 0:
         raise HTTPException(status_code=400, detail="max_participantes debe ser mayor a 0")
 
+    #  Verificar que el grupo existe (catálogo en memoria)
+    if catalogo_grupos.grupo(evento.grupo_id) is None:
+        raise HTTPException(status_code=400, detail="El grupo_id no existe")
+
+    # fecha_hora se guarda sin zona horaria, en la hora local del servidor (la
+    # que usan los recordatorios con datetime.now()): si llega con otra zona,
+    # se convierte antes de quitarla
+    fecha_hora = evento.fecha_hora
+    if fecha_hora.tzinfo is not None:
+        fecha_hora = fecha_hora.astimezone().replace(tzinfo=None)
+
     try:
         conn = get_connection()
         # Cursor como diccionario para acceder a columnas por nombre
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-        #  Verificar que el grupo existe
-        cur.execute("SELECT id FROM grupos_deportivos WHERE id = %s", (evento.grupo_id,))
-        grupo = cur.fetchone()
-        if not grupo:
-            raise HTTPException(status_code=400, detail="El grupo_id no existe")
-
         #  Insertar evento incluyendo anfitrion_id y devolver su id
         cur.execute(
             """
@@ -461,7 +544,7 @@ def crear_evento(evento: EventoCrear, access_token: str = Cookie(None)):
                 evento.grupo_id,
                 evento.nombre,
                 evento.descripcion,
-                evento.fecha_hora,
+                fecha_hora,
                 evento.lugar,
                 evento.latitud,
                 evento.longitud,
@@ -491,11 +574,14 @@ def crear_evento(evento: EventoCrear, access_token: str = Cookie(None)):
         conn.commit()
         cur.close()
         conn.close()
+        rosters_cache.invalidar(evento_id)
+        respuestas_cache.invalidar(f"group:{evento.grupo_id}")
+        planificador.programar(evento_id, fecha_hora)
 
     except HTTPException:
         raise
     except Exception as e:
-        print("Error creando evento:", e)
+        log.exception("Error creando evento")
         raise HTTPException(status_code=500, detail=f"Error interno creando evento: {e}")
 
     return {
@@ -506,19 +592,38 @@ def crear_evento(evento: EventoCrear, access_token: str = Cookie(None)):
 
 
 
-@app.get("/grupos/{grupo_id}/eventos")
+class EventoDeGrupo(BaseModel):
+    evento_id: int
+    nombre: str
+    descripcion: Optional[str] = None
+    lugar: Optional[str] = None
+    fecha_hora: datetime
+    precio: int
+    participantes: str  # "inscritos / máximo"
+    latitud: Optional[float] = None
+    longitud: Optional[float] = None
+    anfitrion_id: Optional[str] = None
+    anfitrion_reputacion: float
+
+class EventosDeGrupoRespuesta(BaseModel):
+    ok: bool
+    grupo_id: int
+    grupo_nombre: str
+    eventos: List[EventoDeGrupo]
+
+@app.get("/grupos/{grupo_id}/eventos", response_model=EventosDeGrupoRespuesta)
 def get_eventos_por_grupo(grupo_id: int):
+    # Verificar que el grupo existe (catálogo en memoria)
+    grupo = catalogo_grupos.grupo(grupo_id)
+    if not grupo:
+        raise HTTPException(status_code=404, detail="Grupo no encontrado")
+
     try:
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-        # Verificar que el grupo existe
-        cur.execute("SELECT id, nombre FROM grupos_deportivos WHERE id = %s", (grupo_id,))
-        grupo = cur.fetchone()
-        if not grupo:
-            raise HTTPException(status_code=404, detail="Grupo no encontrado")
-
-        # Obtener todos los eventos del grupo con la cantidad de participantes y ubicación
+        # Eventos del grupo ya con la forma de la respuesta (participantes y
+        # reputación se arman en SQL, así las filas se serializan directo)
         cur.execute(
             """
             SELECT 
@@ -528,47 +633,34 @@ def get_eventos_por_grupo(grupo_id: int):
                 e.lugar,
                 e.fecha_hora,
                 e.precio,
-                e.max_participantes,
-                e.latitud,
-                e.longitud,
-                COUNT(ue.usuario_id) AS inscritos
+                COUNT(ue.usuario_id) || ' / ' || e.max_participantes AS participantes,
+                e.latitud::FLOAT AS latitud,
+                e.longitud::FLOAT AS longitud,
+                e.anfitrion_id,
+                ROUND(COALESCE(r.puntaje, %s)::NUMERIC, 2)::FLOAT AS anfitrion_reputacion
             FROM eventos_deportivos e
             LEFT JOIN usuarios_eventos ue ON e.id = ue.evento_id
-            WHERE e.grupo_id = %s
-            GROUP BY e.id
+            LEFT JOIN reputacion_usuarios r ON r.usuario_id = e.anfitrion_id
+            WHERE e.grupo_id = %s AND e.estado = 'activo'
+            GROUP BY e.id, r.puntaje
             ORDER BY e.fecha_hora ASC;
             """,
-            (grupo_id,)
+            (REPUTACION_INICIAL, grupo_id)
         )
 
         eventos = cur.fetchall()
         cur.close()
         conn.close()
 
-        # Formatear participantes y agregar lat/lng
-        eventos_list = []
-        for e in eventos:
-            eventos_list.append({
-                "evento_id": e["evento_id"],
-                "nombre": e["nombre"],
-                "descripcion": e["descripcion"],
-                "lugar": e["lugar"],
-                "fecha_hora": e["fecha_hora"],
-                "precio": e["precio"],
-                "participantes": f"{e['inscritos']} / {e['max_participantes']}",
-                "latitud": e["latitud"],
-                "longitud": e["longitud"]
-            })
-
         return {
             "ok": True,
             "grupo_id": grupo["id"],
             "grupo_nombre": grupo["nombre"],
-            "eventos": eventos_list
+            "eventos": eventos
         }
 
-    except Exception as e:
-        print("Error obteniendo eventos por grupo:", e)
+    except Exception:
+        log.exception("Error obteniendo eventos por grupo")
         raise HTTPException(status_code=500, detail="Error interno obteniendo eventos")
 
 
@@ -580,13 +672,20 @@ def unirse_evento(evento_id: int, access_token: str = Cookie(None)):
     # 1️⃣ Obtener usuario desde JWT
     user_id = verify_token(access_token)
 
+    conn = None
     try:
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-        # Verificar que el evento existe
+        # Verificar que el evento existe. FOR UPDATE serializa las uniones al
+        # mismo evento hasta el commit: el conteo de cupos de abajo ya incluye
+        # a quien entró justo antes y no se sobrepasa max_participantes
         cur.execute(
-            "SELECT id, anfitrion_id, max_participantes FROM eventos_deportivos WHERE id = %s",
+            """
+            SELECT id, grupo_id, anfitrion_id, max_participantes FROM eventos_deportivos
+            WHERE id = %s AND estado = 'activo'
+            FOR UPDATE
+            """,
             (evento_id,)
         )
         evento = cur.fetchone()
@@ -620,6 +719,8 @@ def unirse_evento(evento_id: int, access_token: str = Cookie(None)):
             (user_id, evento_id)
         )
         conn.commit()
+        rosters_cache.invalidar(evento_id)
+        respuestas_cache.invalidar(f"group:{evento['grupo_id']}")
 
         # Obtener número actualizado de participantes
         cur.execute(
@@ -629,13 +730,16 @@ def unirse_evento(evento_id: int, access_token: str = Cookie(None)):
         actual_inscritos = cur.fetchone()["inscritos"]
 
         cur.close()
-        conn.close()
 
     except HTTPException:
         raise
-    except Exception as e:
-        print("Error uniendo usuario al evento:", e)
+    except Exception:
+        log.exception("Error uniendo usuario al evento")
         raise HTTPException(status_code=500, detail="Error interno uniendo al usuario al evento")
+    finally:
+        # También en los rechazos: cierra la transacción y suelta el bloqueo del evento
+        if conn is not None:
+            conn.close()
 
     return {
         "ok": True,
@@ -645,7 +749,25 @@ def unirse_evento(evento_id: int, access_token: str = Cookie(None)):
     }
 
 
-@app.get("/mis-eventos")
+class MiEvento(BaseModel):
+    evento_id: int
+    nombre: str
+    descripcion: Optional[str] = None
+    lugar: Optional[str] = None
+    fecha_hora: datetime
+    precio: int
+    max_participantes: int
+    latitud: Optional[float] = None
+    longitud: Optional[float] = None
+    grupo_id: Optional[int] = None
+    tipo: str  # 'anfitrion' o 'participante'
+    inscritos: int
+
+class MisEventosRespuesta(BaseModel):
+    ok: bool
+    eventos: List[MiEvento]
+
+@app.get("/mis-eventos", response_model=MisEventosRespuesta)
 def get_mis_eventos(access_token: str = Cookie(None)):
     """
     Obtiene todos los eventos de un usuario:
@@ -680,7 +802,7 @@ def get_mis_eventos(access_token: str = Cookie(None)):
             FROM eventos_deportivos e
             LEFT JOIN usuarios_eventos ue2 ON e.id = ue2.evento_id
             LEFT JOIN usuarios_eventos ue1 ON e.id = ue1.evento_id AND ue1.usuario_id = %s
-            WHERE e.anfitrion_id = %s OR ue1.usuario_id = %s
+            WHERE (e.anfitrion_id = %s OR ue1.usuario_id = %s) AND e.estado = 'activo'
             GROUP BY e.id
             ORDER BY e.fecha_hora ASC;
             """,
@@ -691,88 +813,280 @@ def get_mis_eventos(access_token: str = Cookie(None)):
         cur.close()
         conn.close()
 
-    except Exception as e:
-        print("Error obteniendo eventos del usuario:", e)
+    except Exception:
+        log.exception("Error obteniendo eventos del usuario")
         raise HTTPException(status_code=500, detail="Error interno obteniendo eventos del usuario")
 
     return {"ok": True, "eventos": eventos}
 
 
 
-@app.get("/eventos/{evento_id}/participantes")
-def get_participantes_evento(evento_id: int):
+# Máximo de eventos por consulta en /eventos/participantes
+MAX_EVENTOS_POR_LOTE = 50
+
+
+class PersonaRoster(BaseModel):
+    id: str
+    nombre: str
+    foto_perfil: Optional[str] = None
+    email: Optional[str] = None     # Solo visible para el anfitrión y los participantes
+    telefono: Optional[str] = None
+
+class EventoRoster(BaseModel):
+    id: int
+    nombre: str
+    anfitrion: PersonaRoster
+
+class Roster(BaseModel):
+    evento: EventoRoster
+    participantes: List[PersonaRoster]
+
+class RosterRespuesta(Roster):
+    ok: bool
+
+class RostersRespuesta(BaseModel):
+    ok: bool
+    eventos: List[Roster]
+
+
+# exclude_unset: a quien no participa no se le envían las claves de contacto
+@app.get("/eventos/{evento_id}/participantes", response_model=RosterRespuesta, response_model_exclude_unset=True)
+def get_participantes_evento(evento_id: int, access_token: str = Cookie(None)):
     """
     Obtiene todos los participantes de un evento.
-    Devuelve al anfitrión con su correo y teléfono y luego el resto de participantes.
+    Devuelve al anfitrión y luego el resto de participantes. El correo y el
+    teléfono solo se muestran a quienes participan del evento.
     """
+    user_id = verify_token(access_token)
+
+    rosters = obtener_rosters([evento_id])
+    if evento_id not in rosters:
+        raise HTTPException(status_code=404, detail="Evento no encontrado")
+
+    return {"ok": True, **roster_visible_para(rosters[evento_id], user_id)}
+
+
+@app.get("/eventos/participantes", response_model=RostersRespuesta, response_model_exclude_unset=True)
+def get_participantes_eventos(
+    ids: List[int] = Query(..., description="IDs de los eventos"),
+    access_token: str = Cookie(None)
+):
+    """
+    Versión por lotes de /eventos/{evento_id}/participantes para las pantallas
+    que listan varios eventos. Los eventos inexistentes o cancelados se omiten.
+    """
+    user_id = verify_token(access_token)
+
+    evento_ids = list(dict.fromkeys(ids))
+    if len(evento_ids) > MAX_EVENTOS_POR_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_EVENTOS_POR_LOTE} eventos por consulta")
+
+    rosters = obtener_rosters(evento_ids)
+    return {
+        "ok": True,
+        "eventos": [roster_visible_para(rosters[e_id], user_id) for e_id in evento_ids if e_id in rosters]
+    }
+
+
+def obtener_rosters(evento_ids: List[int]) -> dict:
+    """
+    Devuelve {evento_id: roster} usando la caché y resolviendo los faltantes
+    con una sola consulta (anfitrión + participantes de todos los eventos).
+    """
+    resultado = rosters_cache.obtener_varios(evento_ids)
+    faltantes = [e_id for e_id in evento_ids if e_id not in resultado]
+    if not faltantes:
+        return resultado
+
     try:
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-        # Obtener información del evento y anfitrión
         cur.execute(
             """
-            SELECT 
+            SELECT
                 e.id AS evento_id,
                 e.nombre AS evento_nombre,
                 e.anfitrion_id,
-                u.nombre AS anfitrion_nombre,
-                u.email AS anfitrion_email,
-                u.telefono AS anfitrion_telefono,
-                u.foto_perfil AS anfitrion_foto
-            FROM eventos_deportivos e
-            JOIN usuarios u ON e.anfitrion_id = u.google_id
-            WHERE e.id = %s
-            """,
-            (evento_id,)
-        )
-        evento = cur.fetchone()
-        if not evento:
-            raise HTTPException(status_code=404, detail="Evento no encontrado")
-
-        # Obtener lista de participantes excluyendo al anfitrión
-        cur.execute(
-            """
-            SELECT 
                 u.google_id AS id,
                 u.nombre,
                 u.email,
                 u.telefono,
                 u.foto_perfil
-            FROM usuarios_eventos ue
-            JOIN usuarios u ON ue.usuario_id = u.google_id
-            WHERE ue.evento_id = %s AND ue.usuario_id != %s
+            FROM eventos_deportivos e
+            CROSS JOIN LATERAL (
+                SELECT e.anfitrion_id AS usuario_id
+                UNION
+                SELECT ue.usuario_id FROM usuarios_eventos ue WHERE ue.evento_id = e.id
+            ) miembros
+            JOIN usuarios u ON u.google_id = miembros.usuario_id
+            WHERE e.id = ANY(%s) AND e.estado = 'activo'
+            ORDER BY e.id, u.nombre
             """,
-            (evento_id, evento["anfitrion_id"])
+            (faltantes,)
         )
-        participantes = cur.fetchall()
-
+        filas = cur.fetchall()
         cur.close()
         conn.close()
+    except Exception:
+        log.exception("Error obteniendo participantes del evento")
+        raise HTTPException(status_code=500, detail="Error interno obteniendo participantes del evento")
 
-        return {
-            "ok": True,
-            "evento": {
-                "id": evento["evento_id"],
-                "nombre": evento["evento_nombre"],
-                "anfitrion": {
-                    "id": evento["anfitrion_id"],
-                    "nombre": evento["anfitrion_nombre"],
-                    "email": evento["anfitrion_email"],
-                    "telefono": evento["anfitrion_telefono"],
-                    "foto_perfil": evento["anfitrion_foto"]
-                }
-            },
-            "participantes": participantes
+    nuevos = {}
+    for fila in filas:
+        roster = nuevos.setdefault(fila["evento_id"], {
+            "evento": {"id": fila["evento_id"], "nombre": fila["evento_nombre"], "anfitrion": None},
+            "participantes": []
+        })
+        persona = {
+            "id": fila["id"],
+            "nombre": fila["nombre"],
+            "email": fila["email"],
+            "telefono": fila["telefono"],
+            "foto_perfil": fila["foto_perfil"]
         }
+        if fila["id"] == fila["anfitrion_id"]:
+            roster["evento"]["anfitrion"] = persona
+        else:
+            roster["participantes"].append(persona)
 
-    except Exception as e:
-        print("Error obteniendo participantes del evento:", e)
-        raise HTTPException(status_code=500, detail="Error interno obteniendo participantes del evento")
+    for evento_id, roster in nuevos.items():
+        rosters_cache.guardar(evento_id, roster)
+
+    resultado.update(nuevos)
+    return resultado
+
+
+def roster_visible_para(roster: dict, user_id: str) -> dict:
+    """Oculta correo y teléfono si el usuario no es anfitrión ni participante"""
+    anfitrion = roster["evento"]["anfitrion"]
+    miembros = {p["id"] for p in roster["participantes"]}
+    miembros.add(anfitrion["id"])
+    if user_id in miembros:
+        return roster
+
+    def sin_contacto(persona):
+        return {"id": persona["id"], "nombre": persona["nombre"], "foto_perfil": persona["foto_perfil"]}
+
+    return {
+        "evento": {**roster["evento"], "anfitrion": sin_contacto(anfitrion)},
+        "participantes": [sin_contacto(p) for p in roster["participantes"]]
+    }
+
+
+
+MAX_RESULTADOS_BUSQUEDA = 50
+MAX_DESPLAZAMIENTO_BUSQUEDA = 200  # Autocompletado: nadie pasa de las primeras páginas
+
+
+def escapar_like(texto: str) -> str:
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class UsuarioEncontrado(BaseModel):
+    google_id: str
+    nombre: str
+    foto_perfil: Optional[str] = None
+    universidad_o_instituto: Optional[str] = None
+    carrera: Optional[str] = None
+    comuna: Optional[str] = None
+    deporte_favorito: Optional[str] = None
+    relevancia: float
+
+class BusquedaUsuariosRespuesta(BaseModel):
+    ok: bool
+    usuarios: List[UsuarioEncontrado]
+    siguiente: Optional[int] = None  # desplazamiento de la página siguiente
+
+
+# Debe ir antes de /usuarios/{user_id} para que "buscar" no se tome como un id
+@app.get("/usuarios/buscar", response_model=BusquedaUsuariosRespuesta)
+def buscar_usuarios(
+    q: str = Query(..., min_length=1, max_length=100),
+    universidad: Optional[str] = None,
+    comuna: Optional[str] = None,
+    limite: int = Query(10, ge=1, le=MAX_RESULTADOS_BUSQUEDA),
+    desplazamiento: int = Query(0, ge=0, le=MAX_DESPLAZAMIENTO_BUSQUEDA),
+    access_token: str = Cookie(None)
+):
+    """
+    Autocompletado de usuarios por nombre, correo, universidad o carrera.
+    Con 3 o más letras usa el índice de trigramas (coincide en cualquier parte
+    y tolera errores de tipeo); con menos, solo prefijos del nombre.
+    Primero van los nombres que empiezan con lo buscado.
+    """
+    usuario_id = verify_token(access_token)
+    texto = " ".join(q.lower().split())
+    if not texto:
+        raise HTTPException(status_code=400, detail="Búsqueda vacía")
+
+    parametros = {
+        "yo": usuario_id,
+        "q": texto,
+        "prefijo": escapar_like(texto) + "%",
+        "contiene": "%" + escapar_like(texto) + "%",
+        "universidad": universidad,
+        "comuna": comuna,
+        "limite": limite + 1,
+        "desplazamiento": desplazamiento,
+    }
+    if len(texto) >= 3:
+        coincide = "(texto_busqueda LIKE %(contiene)s OR %(q)s <%% texto_busqueda)"
+        relevancia = "(LOWER(nombre) LIKE %(prefijo)s)::INT + word_similarity(%(q)s, texto_busqueda)"
+    else:
+        coincide = "LOWER(nombre) LIKE %(prefijo)s"
+        relevancia = "1.0"
+
+    try:
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(
+            f"""
+            SELECT google_id, nombre, foto_perfil, universidad_o_instituto, carrera,
+                   comuna, deporte_favorito, ({relevancia})::FLOAT AS relevancia
+            FROM usuarios
+            WHERE {coincide}
+              AND google_id <> %(yo)s
+              AND (%(universidad)s::VARCHAR IS NULL OR universidad_o_instituto = %(universidad)s)
+              AND (%(comuna)s::VARCHAR IS NULL OR comuna = %(comuna)s)
+            ORDER BY relevancia DESC, nombre, google_id
+            LIMIT %(limite)s OFFSET %(desplazamiento)s
+            """,
+            parametros
+        )
+        usuarios = cur.fetchall()
+        cur.close()
+        conn.close()
+    except Exception:
+        log.exception("Error buscando usuarios")
+        raise HTTPException(status_code=500, detail="Error interno buscando usuarios")
+
+    siguiente = None
+    if len(usuarios) > limite:
+        usuarios = usuarios[:limite]
+        siguiente = desplazamiento + limite
 
+    return {"ok": True, "usuarios": usuarios, "siguiente": siguiente}
 
 
-@app.get("/usuarios/{user_id}")
+class UsuarioPublico(BaseModel):
+    """Perfil visible para otros usuarios (sin teléfono)"""
+    nombre: str
+    email: str
+    foto_perfil: Optional[str] = None
+    region: Optional[str] = None
+    comuna: Optional[str] = None
+    edad: Optional[int] = None
+    deporte_favorito: Optional[str] = None
+    descripcion: Optional[str] = None
+    fecha_registro: Optional[datetime] = None
+    universidad_o_instituto: Optional[str] = None
+    carrera: Optional[str] = None
+
+class UsuarioRespuesta(BaseModel):
+    ok: bool
+    user: UsuarioPublico
+
+@app.get("/usuarios/{user_id}", response_model=UsuarioRespuesta)
 def get_usuario_por_id(user_id: str = Path(..., description="Google ID del usuario")):
     """
     Obtiene los datos completos de un usuario dado su user_id (google_id),
@@ -796,29 +1110,14 @@ def get_usuario_por_id(user_id: str = Path(..., description="Google ID del usuar
 
         if not data:
             raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
-        # Formateamos la respuesta sin el teléfono
-        respuesta = {
-            "nombre": data.get("nombre"),
-            "email": data.get("email"),
-            "foto_perfil": data.get("foto_perfil"),
-            "region": data.get("region"),
-            "comuna": data.get("comuna"),
-            "edad": data.get("edad"),
-            "deporte_favorito": data.get("deporte_favorito"),
-            "descripcion": data.get("descripcion"),
-            "fecha_registro": data.get("fecha_registro"),
-            "universidad_o_instituto": data.get("universidad_o_instituto"),
-            "carrera": data.get("carrera")
 
-        }
-
-        return {"ok": True, "user": respuesta}
+        # El SELECT ya deja fuera el teléfono
+        return {"ok": True, "user": data}
     
     except HTTPException:
         raise
-    except Exception as e:
-        print("Error obteniendo usuario por ID:", e)
+    except Exception:
+        log.exception("Error obteniendo usuario por ID")
         raise HTTPException(status_code=500, detail="Error interno obteniendo usuario")
 
 
@@ -830,6 +1129,40 @@ class SolicitudAmistadCrear(BaseModel):
 class SolicitudAmistadResponder(BaseModel):
     estado: str  # "aceptada" o "rechazada"
 
+class EstadosAmistadConsulta(BaseModel):
+    ids: List[str]  # google_id de los usuarios a consultar
+
+class SolicitudRecibida(BaseModel):
+    id: int
+    solicitante_id: str
+    estado: str
+    fecha_solicitud: Optional[datetime] = None
+    nombre_solicitante: str
+    foto_solicitante: Optional[str] = None
+
+class SolicitudesRecibidasRespuesta(BaseModel):
+    ok: bool
+    solicitudes: List[SolicitudRecibida]
+
+class SolicitudEnviada(BaseModel):
+    id: int
+    destinatario_id: str
+    estado: str
+    fecha_solicitud: Optional[datetime] = None
+    nombre_destinatario: str
+    foto_destinatario: Optional[str] = None
+
+class SolicitudesEnviadasRespuesta(BaseModel):
+    ok: bool
+    solicitudes: List[SolicitudEnviada]
+
+class EstadoAmistadRespuesta(BaseModel):
+    estado: str  # 'amigos', 'solicitud_enviada', 'solicitud_recibida' o 'ninguno'
+
+class EstadosAmistadRespuesta(BaseModel):
+    ok: bool
+    estados: Dict[str, str]  # otro_id -> estado ('propio' para el usuario actual)
+
 
 
 # =========================================
@@ -848,29 +1181,37 @@ def enviar_solicitud(solicitud: SolicitudAmistadCrear, access_token: str = Cooki
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-        # Verificar si ya existe la amistad
-        cur.execute(
-            """
-            SELECT 1 FROM amigos
-            WHERE (usuario_id = %s AND amigo_id = %s)
-               OR (usuario_id = %s AND amigo_id = %s)
-            """,
-            (solicitante_id, destinatario_id, destinatario_id, solicitante_id)
-        )
-        if cur.fetchone():
-            raise HTTPException(status_code=400, detail="Ya son amigos")
+        # Con el grafo en memoria cargado, los chequeos no consultan la BD
+        if grafo_amistad.cargado:
+            estado = grafo_amistad.estado(solicitante_id, destinatario_id)
+            if estado == "amigos":
+                raise HTTPException(status_code=400, detail="Ya son amigos")
+            if estado != "ninguno":
+                raise HTTPException(status_code=400, detail="Ya existe una solicitud pendiente")
+        else:
+            # Verificar si ya existe la amistad
+            cur.execute(
+                """
+                SELECT 1 FROM amigos
+                WHERE (usuario_id = %s AND amigo_id = %s)
+                   OR (usuario_id = %s AND amigo_id = %s)
+                """,
+                (solicitante_id, destinatario_id, destinatario_id, solicitante_id)
+            )
+            if cur.fetchone():
+                raise HTTPException(status_code=400, detail="Ya son amigos")
 
-        # Verificar si ya existe una solicitud pendiente
-        cur.execute(
-            """
-            SELECT 1 FROM solicitudes_amistad
-            WHERE (solicitante_id = %s AND destinatario_id = %s AND estado = 'pendiente')
-               OR (solicitante_id = %s AND destinatario_id = %s AND estado = 'pendiente')
-            """,
-            (solicitante_id, destinatario_id, destinatario_id, solicitante_id)
-        )
-        if cur.fetchone():
-            raise HTTPException(status_code=400, detail="Ya existe una solicitud pendiente")
+            # Verificar si ya existe una solicitud pendiente
+            cur.execute(
+                """
+                SELECT 1 FROM solicitudes_amistad
+                WHERE (solicitante_id = %s AND destinatario_id = %s AND estado = 'pendiente')
+                   OR (solicitante_id = %s AND destinatario_id = %s AND estado = 'pendiente')
+                """,
+                (solicitante_id, destinatario_id, destinatario_id, solicitante_id)
+            )
+            if cur.fetchone():
+                raise HTTPException(status_code=400, detail="Ya existe una solicitud pendiente")
 
         # Insertar la solicitud
         cur.execute(
@@ -883,18 +1224,24 @@ def enviar_solicitud(solicitud: SolicitudAmistadCrear, access_token: str = Cooki
         conn.commit()
         cur.close()
         conn.close()
+        grafo_amistad.agregar_solicitud(solicitante_id, destinatario_id)
 
     except HTTPException:
         raise
-    except Exception as e:
-        print("Error enviando solicitud:", e)
+    except Exception:
+        log.exception("Error enviando solicitud")
         raise HTTPException(status_code=500, detail="Error interno enviando solicitud")
 
     return {"ok": True, "message": "Solicitud enviada"}
 
 
 @app.post("/amistad/responder/{solicitud_id}")
-def responder_solicitud(solicitud_id: int, respuesta: SolicitudAmistadResponder, access_token: str = Cookie(None)):
+def responder_solicitud(
+    solicitud_id: int,
+    respuesta: SolicitudAmistadResponder,
+    background_tasks: BackgroundTasks,
+    access_token: str = Cookie(None)
+):
     usuario_id = verify_token(access_token)
     estado = respuesta.estado.lower()
     if estado not in ["aceptada", "rechazada"]:
@@ -945,16 +1292,21 @@ def responder_solicitud(solicitud_id: int, respuesta: SolicitudAmistadResponder,
         cur.close()
         conn.close()
 
+        grafo_amistad.quitar_solicitud(solicitud["solicitante_id"], usuario_id)
+        if estado == "aceptada":
+            grafo_amistad.agregar_amistad(usuario_id, solicitud["solicitante_id"])
+            background_tasks.add_task(refrescar_tras_cambio_amistad, usuario_id, solicitud["solicitante_id"])
+
     except HTTPException:
         raise
-    except Exception as e:
-        print("Error respondiendo solicitud:", e)
+    except Exception:
+        log.exception("Error respondiendo solicitud")
         raise HTTPException(status_code=500, detail="Error interno respondiendo solicitud")
 
     return {"ok": True, "message": f"Solicitud {estado}"}
 
 
-@app.get("/amistad/solicitudes")
+@app.get("/amistad/solicitudes", response_model=SolicitudesRecibidasRespuesta)
 def listar_solicitudes(access_token: str = Cookie(None)):
     usuario_id = verify_token(access_token)
     try:
@@ -980,16 +1332,44 @@ def listar_solicitudes(access_token: str = Cookie(None)):
         cur.close()
         conn.close()
 
-    except Exception as e:
-        print("Error listando solicitudes:", e)
+    except Exception:
+        log.exception("Error listando solicitudes")
         raise HTTPException(status_code=500, detail="Error interno listando solicitudes")
 
     return {"ok": True, "solicitudes": solicitudes}
 
 
 
-@app.get("/amistad/lista")
-def listar_amigos(access_token: str = Cookie(None)):
+MAX_AMIGOS_POR_PAGINA = 200
+
+
+class Amigo(BaseModel):
+    google_id: str
+    nombre: str
+    email: str
+    foto_perfil: Optional[str] = None
+    universidad_o_instituto: Optional[str] = None
+    carrera: Optional[str] = None
+    deporte_favorito: Optional[str] = None
+    fecha_amistad: Optional[datetime] = None
+    en_linea: bool
+
+class AmigosRespuesta(BaseModel):
+    ok: bool
+    amigos: List[Amigo]
+    siguiente: Optional[str] = None  # google_id para pedir la página siguiente
+
+
+@app.get("/amistad/lista", response_model=AmigosRespuesta)
+def listar_amigos(
+    limite: int = Query(50, ge=1, le=MAX_AMIGOS_POR_PAGINA),
+    despues: Optional[str] = Query(None, description="google_id del último amigo de la página anterior"),
+    access_token: str = Cookie(None)
+):
+    """
+    Lista los amigos ordenados por nombre, paginados por keyset: la página
+    siguiente se pide con despues=<siguiente> de la respuesta anterior.
+    """
     usuario_id = verify_token(access_token)
     try:
         conn = get_connection()
@@ -997,41 +1377,51 @@ def listar_amigos(access_token: str = Cookie(None)):
 
         cur.execute(
             """
-            SELECT u.google_id, u.nombre, u.email, u.foto_perfil
-            FROM amigos a
-            JOIN usuarios u ON (u.google_id = a.amigo_id AND a.usuario_id = %s)
-                            OR (u.google_id = a.usuario_id AND a.amigo_id = %s)
+            SELECT u.google_id, u.nombre, u.email, u.foto_perfil,
+                   u.universidad_o_instituto, u.carrera, u.deporte_favorito,
+                   a.fecha_amistad
+            FROM amistades a
+            JOIN usuarios u ON u.google_id = a.amigo_id
+            WHERE a.usuario_id = %(yo)s
+              AND (%(despues)s::VARCHAR IS NULL
+                   OR (u.nombre, u.google_id) > (SELECT nombre, google_id FROM usuarios WHERE google_id = %(despues)s))
+            ORDER BY u.nombre, u.google_id
+            LIMIT %(limite)s
             """,
-            (usuario_id, usuario_id)
+            {"yo": usuario_id, "despues": despues, "limite": limite + 1}
         )
         amigos = cur.fetchall()
         cur.close()
         conn.close()
 
-    except Exception as e:
-        print("Error listando amigos:", e)
+    except Exception:
+        log.exception("Error listando amigos")
         raise HTTPException(status_code=500, detail="Error interno listando amigos")
 
-    return {"ok": True, "amigos": amigos}
+    siguiente = None
+    if len(amigos) > limite:
+        amigos = amigos[:limite]
+        siguiente = amigos[-1]["google_id"]
+
+    # Presencia según los sockets abiertos en este worker
+    for amigo in amigos:
+        amigo["en_linea"] = (
+            amigo["google_id"] in chat_connections
+            or amigo["google_id"] in active_notification_connections
+        )
+
+    return {"ok": True, "amigos": amigos, "siguiente": siguiente}
 
 
 
 from fastapi import APIRouter, Cookie, HTTPException
 
 @app.delete("/amistad/eliminar/{amigo_id}")
-def eliminar_amigo(amigo_id: str, access_token: str = Cookie(None)):
+def eliminar_amigo(amigo_id: str, background_tasks: BackgroundTasks, access_token: str = Cookie(None)):
     """
     Elimina la relación de amistad y cualquier solicitud existente entre los usuarios.
     """
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
-
-    try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-        user_id = payload["sub"].strip()
-    except Exception as e:
-        print("Error decodificando token:", e)
-        raise HTTPException(status_code=401, detail="Token inválido")
+    user_id = verify_token(access_token)
 
     try:
         conn = get_connection()
@@ -1058,10 +1448,14 @@ def eliminar_amigo(amigo_id: str, access_token: str = Cookie(None)):
         )
 
         conn.commit()
-        print("Amistad y solicitudes eliminadas entre", user_id, "y", amigo_id)
+        grafo_amistad.quitar_amistad(user_id, amigo_id)
+        grafo_amistad.quitar_solicitud(user_id, amigo_id)
+        grafo_amistad.quitar_solicitud(amigo_id, user_id)
+        background_tasks.add_task(refrescar_tras_cambio_amistad, user_id, amigo_id)
+        log.info("Amistad y solicitudes eliminadas", extra={"usuario_id": user_id, "amigo_id": amigo_id})
 
     except Exception as e:
-        print("❌ Error eliminando amistad o solicitudes:", e)
+        log.exception("Error eliminando amistad o solicitudes")
         raise HTTPException(status_code=500, detail=f"Error interno: {e}")
     finally:
         if cur:
@@ -1077,7 +1471,7 @@ def eliminar_amigo(amigo_id: str, access_token: str = Cookie(None)):
 # ENDPOINTS ADICIONALES AMISTAD
 # =========================================
 
-@app.get("/amistad/estado/{otro_id}")
+@app.get("/amistad/estado/{otro_id}", response_model=EstadoAmistadRespuesta)
 def obtener_estado_amistad(otro_id: str, access_token: str = Cookie(None)):
     """
     Devuelve el estado de la relación entre el usuario actual y otro usuario:
@@ -1085,9 +1479,13 @@ def obtener_estado_amistad(otro_id: str, access_token: str = Cookie(None)):
     - 'solicitud_enviada'
     - 'solicitud_recibida'
     - 'ninguno'
+    Se responde desde el grafo en memoria; la BD solo se consulta si aún no carga.
     """
     usuario_id = verify_token(access_token)
 
+    if grafo_amistad.cargado:
+        return {"estado": grafo_amistad.estado(usuario_id, otro_id)}
+
     try:
         conn = get_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
@@ -1128,14 +1526,86 @@ def obtener_estado_amistad(otro_id: str, access_token: str = Cookie(None)):
 
         return {"estado": "ninguno"}
 
-    except Exception as e:
-        print("Error obteniendo estado de amistad:", e)
+    except Exception:
+        log.exception("Error obteniendo estado de amistad")
         raise HTTPException(status_code=500, detail="Error interno")
     finally:
         cur.close()
         conn.close()
 
 
+# Máximo de usuarios por consulta en /amistad/estados
+MAX_USUARIOS_POR_LOTE = 200
+
+
+def estados_amistad_bd(usuario_id: str, otros_ids: List[str]) -> dict:
+    """
+    Estado de amistad con varios usuarios en una sola consulta: cruza la lista
+    de ids con amigos (usando el índice LEAST/GREATEST) y con las solicitudes
+    pendientes en ambas direcciones.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute(
+            """
+            SELECT DISTINCT ON (o.otro_id)
+                o.otro_id,
+                CASE
+                    WHEN a.id IS NOT NULL THEN 'amigos'
+                    WHEN s.solicitante_id = %(yo)s THEN 'solicitud_enviada'
+                    WHEN s.solicitante_id IS NOT NULL THEN 'solicitud_recibida'
+                    ELSE 'ninguno'
+                END AS estado
+            FROM UNNEST(%(otros)s::VARCHAR[]) AS o(otro_id)
+            LEFT JOIN amigos a
+                   ON LEAST(a.usuario_id, a.amigo_id) = LEAST(%(yo)s, o.otro_id)
+                  AND GREATEST(a.usuario_id, a.amigo_id) = GREATEST(%(yo)s, o.otro_id)
+            LEFT JOIN solicitudes_amistad s
+                   ON s.estado = 'pendiente'
+                  AND ((s.solicitante_id = %(yo)s AND s.destinatario_id = o.otro_id)
+                    OR (s.solicitante_id = o.otro_id AND s.destinatario_id = %(yo)s))
+            ORDER BY o.otro_id, (s.solicitante_id = %(yo)s) DESC
+            """,
+            {"yo": usuario_id, "otros": otros_ids}
+        )
+        estados = {fila["otro_id"]: fila["estado"] for fila in cur.fetchall()}
+        cur.close()
+    finally:
+        conn.close()
+    return estados
+
+
+@app.post("/amistad/estados", response_model=EstadosAmistadRespuesta)
+def obtener_estados_amistad(consulta: EstadosAmistadConsulta, access_token: str = Cookie(None)):
+    """
+    Versión por lotes de /amistad/estado/{otro_id} para listas de usuarios
+    (participantes, resultados de búsqueda). Devuelve {otro_id: estado};
+    el propio usuario aparece como 'propio'.
+    """
+    usuario_id = verify_token(access_token)
+
+    otros_ids = [i for i in dict.fromkeys(consulta.ids) if i != usuario_id]
+    if len(otros_ids) > MAX_USUARIOS_POR_LOTE:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_USUARIOS_POR_LOTE} usuarios por consulta")
+
+    if grafo_amistad.cargado:
+        estados = {otro_id: grafo_amistad.estado(usuario_id, otro_id) for otro_id in otros_ids}
+    elif otros_ids:
+        try:
+            estados = estados_amistad_bd(usuario_id, otros_ids)
+        except Exception:
+            log.exception("Error obteniendo estados de amistad")
+            raise HTTPException(status_code=500, detail="Error interno")
+    else:
+        estados = {}
+
+    if usuario_id in consulta.ids:
+        estados[usuario_id] = "propio"
+
+    return {"ok": True, "estados": estados}
+
+
 @app.delete("/amistad/cancelar/{otro_id}")
 def cancelar_solicitud_enviada(otro_id: str, access_token: str = Cookie(None)):
     """
@@ -1155,10 +1625,11 @@ def cancelar_solicitud_enviada(otro_id: str, access_token: str = Cookie(None)):
             (usuario_id, otro_id)
         )
         conn.commit()
+        grafo_amistad.quitar_solicitud(usuario_id, otro_id)
         return {"ok": True, "message": "Solicitud cancelada"}
 
-    except Exception as e:
-        print("Error cancelando solicitud:", e)
+    except Exception:
+        log.exception("Error cancelando solicitud")
         raise HTTPException(status_code=500, detail="Error interno")
     finally:
         cur.close()
@@ -1167,18 +1638,11 @@ def cancelar_solicitud_enviada(otro_id: str, access_token: str = Cookie(None)):
 
 
 @app.post("/amistad/aceptar/{usuario_id}")
-def aceptar_solicitud(usuario_id: str, access_token: str = Cookie(None)):
+def aceptar_solicitud(usuario_id: str, background_tasks: BackgroundTasks, access_token: str = Cookie(None)):
     """
     Acepta la solicitud de amistad enviada por el usuario especificado.
     """
-    if not access_token:
-        raise HTTPException(status_code=401, detail="No autorizado")
-
-    try:
-        payload = jwt.decode(access_token, JWT_SECRET, algorithms=[JWT_ALG])
-        user_id = payload["sub"].strip()
-    except Exception:
-        raise HTTPException(status_code=401, detail="Token inválido")
+    user_id = verify_token(access_token)
 
     try:
         conn = get_connection()
@@ -1219,18 +1683,21 @@ def aceptar_solicitud(usuario_id: str, access_token: str = Cookie(None)):
         conn.commit()
         cur.close()
         conn.close()
+        grafo_amistad.quitar_solicitud(usuario_id, user_id)
+        grafo_amistad.agregar_amistad(user_id, usuario_id)
+        background_tasks.add_task(refrescar_tras_cambio_amistad, user_id, usuario_id)
 
     except HTTPException:
         raise
-    except Exception as e:
-        print("Error aceptando solicitud:", e)
+    except Exception:
+        log.exception("Error aceptando solicitud")
         raise HTTPException(status_code=500, detail="Error interno aceptando solicitud")
 
     return {"ok": True, "message": "Solicitud aceptada"}
 
 
 
-@app.get("/amistad/enviadas")
+@app.get("/amistad/enviadas", response_model=SolicitudesEnviadasRespuesta)
 def listar_solicitudes_enviadas(access_token: str = Cookie(None)):
     usuario_id = verify_token(access_token)
     try:
@@ -1256,8 +1723,8 @@ def listar_solicitudes_enviadas(access_token: str = Cookie(None)):
         cur.close()
         conn.close()
 
-    except Exception as e:
-        print("Error listando solicitudes enviadas:", e)
+    except Exception:
+        log.exception("Error listando solicitudes enviadas")
         raise HTTPException(status_code=500, detail="Error interno listando solicitudes enviadas")
 
     return {"ok": True, "solicitudes": solicitudes}
@@ -1265,11 +1732,26 @@ def listar_solicitudes_enviadas(access_token: str = Cookie(None)):
 
 
 
+def registrar_abandono(cur, usuario_id: str, evento_id: int, motivo: str):
+    """Anota la salida para penalizaciones.py (solo si el evento aún no empieza)"""
+    cur.execute(
+        """
+        INSERT INTO abandonos_eventos (usuario_id, evento_id, motivo, fecha_evento)
+        SELECT %s, id, %s, fecha_hora
+        FROM eventos_deportivos
+        WHERE id = %s AND fecha_hora > NOW()
+        """,
+        (usuario_id, motivo, evento_id)
+    )
+
+
 @app.post("/eventos/{evento_id}/salir")
-def salir_o_cancelar_evento(evento_id: int, access_token: str = Cookie(None)):
+def salir_o_cancelar_evento(evento_id: int, background_tasks: BackgroundTasks, access_token: str = Cookie(None)):
     """
     Permite a un usuario abandonar un evento si no es anfitrión,
     o cancelarlo si es el anfitrión.
+    La cancelación solo marca el evento; avisar a los participantes y
+    limpiar chat e inscripciones queda en una tarea de fondo.
     """
     user_id = verify_token(access_token)
 
@@ -1279,28 +1761,29 @@ def salir_o_cancelar_evento(evento_id: int, access_token: str = Cookie(None)):
 
         # Verificar si el evento existe
         cur.execute(
-            "SELECT anfitrion_id FROM eventos_deportivos WHERE id = %s",
+            "SELECT grupo_id, anfitrion_id, estado FROM eventos_deportivos WHERE id = %s",
             (evento_id,)
         )
         evento = cur.fetchone()
 
         if not evento:
             raise HTTPException(status_code=404, detail="Evento no encontrado")
+        if evento["estado"] == "cancelado":
+            raise HTTPException(status_code=400, detail="El evento ya fue cancelado")
 
         anfitrion_id = evento["anfitrion_id"]
 
         if anfitrion_id == user_id:
             #  Si el usuario es el anfitrión: cancelar el evento
-            # Eliminar primero relaciones con participantes
-            cur.execute("DELETE FROM usuarios_eventos WHERE evento_id = %s", (evento_id,))
-
-            # Si tienes mensajes de chat asociados al evento, puedes limpiarlos también:
-            # cur.execute("DELETE FROM mensajes_evento WHERE evento_id = %s", (evento_id,))
-
-            # Finalmente eliminar el evento
-            cur.execute("DELETE FROM eventos_deportivos WHERE id = %s", (evento_id,))
-
+            # Se marca como cancelado; el resto lo hace procesar_cancelacion
+            cur.execute(
+                "UPDATE eventos_deportivos SET estado = 'cancelado' WHERE id = %s",
+                (evento_id,)
+            )
+            registrar_abandono(cur, user_id, evento_id, "cancelacion_evento")
             conn.commit()
+            planificador.cancelar(evento_id)
+            background_tasks.add_task(procesar_cancelacion, evento_id)
             mensaje = "Has cancelado el evento correctamente."
             accion = "evento_cancelado"
 
@@ -1314,23 +1797,52 @@ def salir_o_cancelar_evento(evento_id: int, access_token: str = Cookie(None)):
             if cur.rowcount == 0:
                 raise HTTPException(status_code=400, detail="No estás inscrito en este evento")
 
+            registrar_abandono(cur, user_id, evento_id, "abandono_evento")
             conn.commit()
             mensaje = "Has abandonado el evento correctamente."
             accion = "usuario_salio"
 
         cur.close()
         conn.close()
+        rosters_cache.invalidar(evento_id)
+        respuestas_cache.invalidar(f"group:{evento['grupo_id']}")
 
         return {"ok": True, "message": mensaje, "accion": accion}
 
     except HTTPException:
         raise
-    except Exception as e:
-        print("Error al salir/cancelar evento:", e)
+    except Exception:
+        log.exception("Error al salir/cancelar evento")
         raise HTTPException(status_code=500, detail="Error interno al procesar la solicitud")
 
 
-@app.get("/eventos/recomendados")
+class EventoRecomendado(BaseModel):
+    evento_id: int
+    nombre: str
+    descripcion: Optional[str] = None
+    lugar: Optional[str] = None
+    fecha_hora: datetime
+    precio: int
+    latitud: Optional[float] = None
+    longitud: Optional[float] = None
+    grupo_id: Optional[int] = None
+    anfitrion_id: Optional[str] = None
+    anfitrion_reputacion: float
+    max_participantes: int
+
+class EventosRecomendadosRespuesta(BaseModel):
+    ok: bool
+    eventos: List[EventoRecomendado]
+
+# Columnas de /eventos/recomendados, ya con los nombres de la respuesta
+COLUMNAS_EVENTO_RECOMENDADO = """
+    e.id AS evento_id, e.nombre, e.descripcion, e.lugar, e.fecha_hora, e.precio,
+    e.latitud::FLOAT AS latitud, e.longitud::FLOAT AS longitud, e.grupo_id,
+    e.anfitrion_id, e.max_participantes,
+    ROUND(COALESCE(r.puntaje, %s)::NUMERIC, 2)::FLOAT AS anfitrion_reputacion
+"""
+
+@app.get("/eventos/recomendados", response_model=EventosRecomendadosRespuesta)
 def get_eventos_amigos_y_favoritos(access_token: str = Cookie(None)):
     """
     Obtiene todos los eventos en los que participan mis amigos (independientemente del deporte)
@@ -1347,18 +1859,10 @@ def get_eventos_amigos_y_favoritos(access_token: str = Cookie(None)):
         row = cur.fetchone()
         deporte_favorito = row["deporte_favorito"] if row else None
 
-        # 2 Obtener IDs de amigos desde la tabla 'amigos'
+        # 2 Obtener IDs de amigos (la vista cubre ambos sentidos de la tabla 'amigos')
         cur.execute(
-            """
-            SELECT 
-                CASE 
-                    WHEN usuario_id = %s THEN amigo_id
-                    ELSE usuario_id
-                END AS amigo_id
-            FROM amigos
-            WHERE usuario_id = %s OR amigo_id = %s
-            """,
-            (user_id, user_id, user_id)
+            "SELECT amigo_id FROM amistades WHERE usuario_id = %s",
+            (user_id,)
         )
         amigos = [a["amigo_id"] for a in cur.fetchall()]
 
@@ -1367,13 +1871,15 @@ def get_eventos_amigos_y_favoritos(access_token: str = Cookie(None)):
         # 3 Si tiene amigos, traer los eventos donde ellos participan
         if amigos:
             cur.execute(
-                """
-                SELECT DISTINCT e.*
+                f"""
+                SELECT DISTINCT {COLUMNAS_EVENTO_RECOMENDADO}
                 FROM eventos_deportivos e
                 LEFT JOIN usuarios_eventos ue ON e.id = ue.evento_id
-                WHERE ue.usuario_id = ANY(%s) OR e.anfitrion_id = ANY(%s)
+                LEFT JOIN reputacion_usuarios r ON r.usuario_id = e.anfitrion_id
+                WHERE (ue.usuario_id = ANY(%s) OR e.anfitrion_id = ANY(%s))
+                  AND e.estado = 'activo'
                 """,
-                (amigos, amigos)
+                (REPUTACION_INICIAL, amigos, amigos)
             )
             eventos_amigos = cur.fetchall()
             eventos_finales.extend(eventos_amigos)
@@ -1381,44 +1887,30 @@ def get_eventos_amigos_y_favoritos(access_token: str = Cookie(None)):
         # 4 Si tiene deporte favorito, traer eventos de ese deporte
         if deporte_favorito:
             cur.execute(
-                """
-                SELECT DISTINCT e.*
+                f"""
+                SELECT DISTINCT {COLUMNAS_EVENTO_RECOMENDADO}
                 FROM eventos_deportivos e
                 JOIN grupos_deportivos g ON e.grupo_id = g.id
-                WHERE LOWER(g.nombre) LIKE LOWER(%s)
+                LEFT JOIN reputacion_usuarios r ON r.usuario_id = e.anfitrion_id
+                WHERE LOWER(g.nombre) LIKE LOWER(%s) AND e.estado = 'activo'
                 """,
-                (f"%{deporte_favorito}%",)
+                (REPUTACION_INICIAL, f"%{deporte_favorito}%")
             )
             eventos_favoritos = cur.fetchall()
             eventos_finales.extend(eventos_favoritos)
 
-        # 5 Eliminar duplicados por ID
-        eventos_unicos = {e["id"]: e for e in eventos_finales}.values()
-
         cur.close()
         conn.close()
 
-        # 6 Formatear salida
-        eventos_list = [
-            {
-                "evento_id": e["id"],
-                "nombre": e["nombre"],
-                "descripcion": e["descripcion"],
-                "lugar": e["lugar"],
-                "fecha_hora": e["fecha_hora"],
-                "precio": e["precio"],
-                "latitud": e["latitud"],
-                "longitud": e["longitud"],
-                "grupo_id": e["grupo_id"],
-                "anfitrion_id": e["anfitrion_id"],
-                "max_participantes": e["max_participantes"]
-            }
-            for e in eventos_unicos
-        ]
-
-        return {"ok": True, "eventos": eventos_list}
+        # 5 Eliminar duplicados por ID
+        eventos_unicos = list({e["evento_id"]: e for e in eventos_finales}.values())
 
-    except Exception as e:
-        print("Error obteniendo eventos recomendados:", e)
+        # 6 Primero los eventos de anfitriones con mejor reputación
+        eventos_unicos.sort(key=lambda e: (-e["anfitrion_reputacion"], e["fecha_hora"]))
+
+        return {"ok": True, "eventos": eventos_unicos}
+
+    except Exception:
+        log.exception("Error obteniendo eventos recomendados")
         raise HTTPException(status_code=500, detail="Error interno obteniendo eventos recomendados")
 
@@ -0,0 +1,129 @@
+# metricas.py
+# Métricas en formato Prometheus (GET /metrics).
+#
+# - Latencia y códigos de respuesta por ruta (la plantilla, no la URL)
+# - Tiempo de BD por consulta y espera para obtener conexión (vía bd.py)
+# - Websockets abiertos por tipo, mensajes de chat y bytes subidos
+# - Logs descartados por cola llena (ver registro.py)
+# - Compresión de respuestas: bytes antes y después, razón y CPU (ver compresion.py)
+#
+# Registrar una medición es un contador en memoria, así que se deja siempre
+# activo. Cada worker expone sus propios valores; Prometheus los suma.
+from fastapi import APIRouter, Response
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from starlette.routing import Match
+import bd
+import time
+
+BUCKETS_BD = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+http_duracion = Histogram(
+    "sunity_http_duracion_segundos", "Duración de las peticiones HTTP", ["metodo", "ruta"]
+)
+http_respuestas = Counter(
+    "sunity_http_respuestas_total", "Respuestas HTTP por código", ["metodo", "ruta", "estado"]
+)
+bd_consulta = Histogram(
+    "sunity_bd_consulta_segundos", "Duración de cada consulta a la BD", ["consulta"], buckets=BUCKETS_BD
+)
+bd_espera_conexion = Histogram(
+    "sunity_bd_espera_conexion_segundos", "Tiempo para obtener una conexión a la BD", buckets=BUCKETS_BD
+)
+websockets_activos = Gauge(
+    "sunity_websockets_activos", "Websockets abiertos en este worker", ["tipo"]
+)
+mensajes_chat = Counter(
+    "sunity_chat_mensajes_total", "Mensajes de chat enviados", ["tipo"]
+)
+subidas_bytes = Counter(
+    "sunity_subidas_bytes_total", "Bytes recibidos en subidas de archivos"
+)
+logs_descartados = Counter(
+    "sunity_logs_descartados_total", "Registros de log descartados porque la cola estaba llena"
+)
+compresion_bytes_entrada = Counter(
+    "sunity_compresion_entrada_bytes_total", "Bytes de respuestas antes de comprimir", ["codificacion"]
+)
+compresion_bytes_salida = Counter(
+    "sunity_compresion_salida_bytes_total", "Bytes de respuestas después de comprimir", ["codificacion"]
+)
+compresion_razon = Histogram(
+    "sunity_compresion_razon", "Tamaño comprimido / original por respuesta", ["codificacion"],
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1),
+)
+compresion_cpu = Counter(
+    "sunity_compresion_cpu_segundos_total", "Tiempo de CPU comprimiendo respuestas", ["codificacion"]
+)
+websockets_deflate = Counter(
+    "sunity_websockets_deflate_total", "Conexiones websocket según si el cliente ofreció permessage-deflate", ["ofrecido"]
+)
+
+bd.registrar_observador_consultas(lambda nombre, sql, parametros, segundos: bd_consulta.labels(nombre).observe(segundos))
+bd.registrar_observador_conexion(bd_espera_conexion.observe)
+
+
+def medir_websockets(tipo: str, conexiones, contar=len):
+    """El gauge lee el tamaño del diccionario de conexiones al momento del scrape"""
+    websockets_activos.labels(tipo).set_function(lambda: contar(conexiones))
+
+
+# =========================
+# Middleware HTTP
+# =========================
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que mide cada petición hasta el último byte enviado.
+    La ruta se toma del endpoint que la atendió; las respuestas que no llegan
+    al router (caché, 404) se resuelven recorriendo las rutas.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._rutas_por_endpoint = None
+
+    def _ruta(self, scope) -> str:
+        aplicacion = scope["app"]
+        if self._rutas_por_endpoint is None:
+            self._rutas_por_endpoint = {
+                getattr(ruta, "endpoint", getattr(ruta, "app", None)): ruta.path
+                for ruta in aplicacion.router.routes
+            }
+        ruta = self._rutas_por_endpoint.get(scope.get("endpoint"))
+        if ruta is not None:
+            return ruta
+        for ruta in aplicacion.router.routes:
+            if ruta.matches(scope)[0] == Match.FULL:
+                return ruta.path
+        return "sin_ruta"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = 500
+
+        async def enviar(mensaje):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = self._ruta(scope)
+            http_duracion.labels(scope["method"], ruta).observe(time.perf_counter() - inicio)
+            http_respuestas.labels(scope["method"], ruta, str(estado)).inc()
+
+
+# =========================
+# Endpoint
+# =========================
+metricas_router = APIRouter(tags=["Métricas"])
+
+
+@metricas_router.get("/metrics", include_in_schema=False)
+def exponer_metricas():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,59 @@
+from typing import Dict, Iterable, Set
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from autenticacion import verify_token
+from registro import LOG_MUESTREO_WEBSOCKETS
+import logging
+
+log = logging.getLogger(__name__)
+
+# =========================
+# Router para notificaciones
+# =========================
+notificaciones_router = APIRouter(prefix="/notificaciones", tags=["Notificaciones"])
+
+# =========================
+# Conexiones activas
+# =========================
+# usuario_id -> sockets abiertos (un usuario puede tener varias pestañas o dispositivos)
+active_notification_connections: Dict[str, Set[WebSocket]] = {}
+
+
+
+
+async def notificar_usuarios(usuario_ids: Iterable[str], payload: dict) -> int:
+    """
+    Envía el payload a todos los sockets abiertos de los usuarios indicados.
+    Devuelve cuántos mensajes se entregaron; los usuarios sin conexión se omiten.
+    """
+    entregados = 0
+    for usuario_id in usuario_ids:
+        for ws in list(active_notification_connections.get(usuario_id, ())):
+            try:
+                await ws.send_json(payload)
+                entregados += 1
+            except Exception:
+                active_notification_connections.get(usuario_id, set()).discard(ws)
+    return entregados
+
+
+@notificaciones_router.websocket("/ws")
+async def websocket_notificaciones(websocket: WebSocket):
+    await websocket.accept()
+    token = websocket.cookies.get("access_token")
+    usuario_id = verify_token(token)
+
+    active_notification_connections.setdefault(usuario_id, set()).add(websocket)
+    log.info("Conectado a notificaciones", extra={"usuario_id": usuario_id, "muestreo": LOG_MUESTREO_WEBSOCKETS})
+
+    try:
+        # El canal es solo de servidor a cliente: se ignora lo que envíe el cliente
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        log.info("Desconectado de notificaciones", extra={"usuario_id": usuario_id, "muestreo": LOG_MUESTREO_WEBSOCKETS})
+    finally:
+        sockets = active_notification_connections.get(usuario_id)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                active_notification_connections.pop(usuario_id, None)
@@ -0,0 +1,128 @@
+# penalizaciones.py
+# Penalizaciones automáticas por abandonos de último momento.
+#
+# Al salir de un evento (o cancelarlo, si es el anfitrión) main.py registra
+# el abandono en abandonos_eventos. Una vez terminado el evento, este job
+# revisa los abandonos pendientes por lotes y, si ocurrieron a menos de
+# PENALIZACION_VENTANA_HORAS del inicio, el usuario no volvió a inscribirse
+# y el evento no se canceló, crea la calificación de 1 estrella del sistema. El índice único
+# (evaluado_id, evento_id, motivo) hace que reprocesar un lote no duplique nada.
+#
+# Se ejecuta cada PENALIZACIONES_INTERVALO_MIN desde main.py, o a mano:
+#     python penalizaciones.py
+from typing import List, Tuple
+from fastapi.concurrency import run_in_threadpool
+from bd import get_connection
+from calificaciones import sumar_a_resumenes
+from cache import respuestas as respuestas_cache
+import asyncio
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+PENALIZACION_VENTANA_HORAS = float(os.getenv("PENALIZACION_VENTANA_HORAS", "24"))
+PENALIZACIONES_INTERVALO_MIN = float(os.getenv("PENALIZACIONES_INTERVALO_MIN", "15"))
+DURACION_EVENTO_HORAS = 2  # Los eventos no tienen hora de término (igual que en calendario.py)
+PENALIZACIONES_POR_LOTE = 1000
+ESTRELLAS_PENALIZACION = 1
+
+
+def procesar_lote(cur) -> Tuple[int, List[str]]:
+    """
+    Toma un lote de abandonos de eventos ya terminados, crea las
+    penalizaciones que correspondan y los marca como procesados.
+    Devuelve cuántos abandonos revisó y a quiénes penalizó.
+    """
+    cur.execute(
+        """
+        WITH lote AS (
+            SELECT id, usuario_id, evento_id, motivo, fecha_evento, fecha_abandono
+            FROM abandonos_eventos
+            WHERE NOT procesado
+              AND fecha_evento < NOW() - %(duracion)s * INTERVAL '1 hour'
+            ORDER BY fecha_evento
+            LIMIT %(lote)s
+            FOR UPDATE SKIP LOCKED
+        ),
+        marcados AS (
+            UPDATE abandonos_eventos a
+            SET procesado = TRUE
+            FROM lote
+            WHERE a.id = lote.id
+        ),
+        penalizables AS (
+            SELECT DISTINCT usuario_id, evento_id, motivo
+            FROM lote
+            WHERE fecha_abandono > fecha_evento - %(ventana)s * INTERVAL '1 hour'
+              -- Si se volvió a inscribir después de salir, al final sí fue
+              AND (motivo = 'cancelacion_evento' OR NOT EXISTS (
+                  SELECT 1 FROM usuarios_eventos ue
+                  WHERE ue.usuario_id = lote.usuario_id AND ue.evento_id = lote.evento_id
+              ))
+              -- Si después el anfitrión lo canceló, salir no dejó a nadie colgado. Un evento
+              -- cancelado queda 'cancelado' hasta que procesar_cancelacion lo borra, y al
+              -- histórico solo pasan los activos: se realizó si está activo en alguno de los dos
+              AND (motivo = 'cancelacion_evento' OR EXISTS (
+                  SELECT 1 FROM eventos_deportivos e
+                  WHERE e.id = lote.evento_id AND e.estado = 'activo'
+                  UNION ALL
+                  SELECT 1 FROM eventos_deportivos_historico h
+                  WHERE h.id = lote.evento_id
+              ))
+        ),
+        insertadas AS (
+            INSERT INTO calificaciones_usuarios (evaluador_id, evaluado_id, estrellas, motivo, tipo, evento_id)
+            SELECT NULL, usuario_id, %(estrellas)s, motivo, 'sistema', evento_id
+            FROM penalizables
+            ON CONFLICT (evaluado_id, evento_id, motivo) WHERE tipo = 'sistema' DO NOTHING
+            RETURNING evaluado_id, estrellas
+        )
+        SELECT
+            (SELECT COUNT(*) FROM lote) AS revisados,
+            (SELECT ARRAY_AGG(evaluado_id) FROM insertadas) AS penalizados
+        """,
+        {
+            "duracion": DURACION_EVENTO_HORAS,
+            "ventana": PENALIZACION_VENTANA_HORAS,
+            "lote": PENALIZACIONES_POR_LOTE,
+            "estrellas": ESTRELLAS_PENALIZACION,
+        }
+    )
+    fila = cur.fetchone()
+    if fila["penalizados"]:
+        sumar_a_resumenes(cur, [(evaluado_id, ESTRELLAS_PENALIZACION) for evaluado_id in fila["penalizados"]])
+    return fila["revisados"], fila["penalizados"] or []
+
+
+def aplicar_penalizaciones() -> int:
+    """Procesa todos los abandonos pendientes (un commit por lote)"""
+    total = 0
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        while True:
+            revisados, penalizados = procesar_lote(cur)
+            conn.commit()
+            respuestas_cache.invalidar(*(f"user:{usuario_id}" for usuario_id in penalizados))
+            total += revisados
+            if revisados < PENALIZACIONES_POR_LOTE:
+                break
+        cur.close()
+    finally:
+        conn.close()
+    return total
+
+
+async def ciclo_penalizaciones():
+    """Tarea de fondo: revisa abandonos cada PENALIZACIONES_INTERVALO_MIN"""
+    while True:
+        try:
+            await run_in_threadpool(aplicar_penalizaciones)
+        except Exception:
+            log.exception("Error aplicando penalizaciones")
+        await asyncio.sleep(PENALIZACIONES_INTERVALO_MIN * 60)
+
+
+if __name__ == "__main__":
+    print(f"Abandonos revisados: {aplicar_penalizaciones()}")
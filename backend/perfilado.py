@@ -0,0 +1,239 @@
+# perfilado.py
+# Perfilado de peticiones a pedido.
+#
+# Una petición se perfila si trae el header X-Perfilar firmado (ver
+# firmar_permiso) o si cae en la muestra PERFILADO_MUESTREO. Mientras dura,
+# un hilo toma muestras de la pila cada PERFILADO_INTERVALO_MS:
+# - del hilo del threadpool que corre el endpoint síncrono y valida la
+#   respuesta (BD, JWT, lógica), marcado por los envoltorios de las rutas
+# - del hilo del event loop, solo cuando está corriendo la tarea de esta
+#   petición (middlewares, serialización, endpoints async)
+# El resultado se guarda en PERFILES_DIR como pilas colapsadas
+# ("a;b;c cantidad"), listas para flamegraph.pl o speedscope, y se descarga
+# desde /perfiles con el mismo header firmado.
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import FileResponse
+import asyncio
+import functools
+import hashlib
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+PERFILADO_CLAVE = os.getenv("PERFILADO_CLAVE", "")         # Sin clave no se aceptan pedidos por header
+PERFILADO_MUESTREO = float(os.getenv("PERFILADO_MUESTREO", "0"))
+PERFILADO_INTERVALO_MS = float(os.getenv("PERFILADO_INTERVALO_MS", "1"))
+PERFILES_DIR = os.getenv("PERFILES_DIR", "perfiles")
+PERFILES_MAX = 200            # Se borran los más viejos
+PROFUNDIDAD_MAX_PILA = 128
+
+_perfil_actual: ContextVar[Optional["Perfil"]] = ContextVar("perfil_actual", default=None)
+_NOMBRE_VALIDO = re.compile(r"^[\w.-]+\.folded$")
+
+
+# =========================
+# Permiso firmado
+# =========================
+def firmar_permiso(segundos: int) -> str:
+    """Valor para el header X-Perfilar, válido por los segundos indicados"""
+    expira = str(int(time.time()) + segundos)
+    firma = hmac.new(PERFILADO_CLAVE.encode(), expira.encode(), hashlib.sha256).hexdigest()
+    return f"{expira}.{firma}"
+
+
+def permiso_valido(valor: Optional[str]) -> bool:
+    if not PERFILADO_CLAVE or not valor or "." not in valor:
+        return False
+    expira, firma = valor.split(".", 1)
+    if not expira.isdigit() or int(expira) < time.time():
+        return False
+    esperada = hmac.new(PERFILADO_CLAVE.encode(), expira.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(firma, esperada)
+
+
+def _header(scope, nombre: bytes) -> Optional[str]:
+    for clave, valor in scope["headers"]:
+        if clave == nombre:
+            return valor.decode("latin-1")
+    return None
+
+
+# =========================
+# Muestreo
+# =========================
+def _pila(frame) -> str:
+    marcos = []
+    while frame is not None and len(marcos) < PROFUNDIDAD_MAX_PILA:
+        marcos.append(f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(marcos))
+
+
+class Perfil:
+
+    def __init__(self):
+        self.muestras = Counter()
+        self.hilos = set()   # hilos del threadpool trabajando para esta petición
+        self._loop = asyncio.get_running_loop()
+        self._tarea = asyncio.current_task()
+        self._hilo_loop = threading.get_ident()
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, name="perfilado", daemon=True)
+
+    def iniciar(self):
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._hilo.join()
+
+    def _muestrear(self):
+        intervalo = PERFILADO_INTERVALO_MS / 1000
+        while not self._detener.wait(intervalo):
+            frames = sys._current_frames()
+            hilos = set(self.hilos)
+            if asyncio.current_task(self._loop) is self._tarea:
+                hilos.add(self._hilo_loop)
+            for ident in hilos:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.muestras[_pila(frame)] += 1
+
+    def guardar(self, metodo: str, ruta: str) -> str:
+        os.makedirs(PERFILES_DIR, exist_ok=True)
+        ruta_segura = re.sub(r"[^\w-]+", "_", ruta).strip("_") or "raiz"
+        nombre = f"{time.strftime('%Y%m%d%H%M%S')}_{int(time.time() * 1000) % 1000:03d}_{metodo}_{ruta_segura}.folded"
+        with open(os.path.join(PERFILES_DIR, nombre), "w") as archivo:
+            for pila, cantidad in self.muestras.most_common():
+                archivo.write(f"{pila} {cantidad}\n")
+        _limpiar_perfiles_viejos()
+        return nombre
+
+
+def _limpiar_perfiles_viejos():
+    archivos = sorted(a for a in os.listdir(PERFILES_DIR) if _NOMBRE_VALIDO.match(a))
+    for archivo in archivos[:-PERFILES_MAX]:
+        os.remove(os.path.join(PERFILES_DIR, archivo))
+
+
+def _marcar_hilo(funcion):
+    """Envuelve una función síncrona para que el muestreo siga al hilo que la corre"""
+    @functools.wraps(funcion)
+    def envuelta(*args, **kwargs):
+        perfil = _perfil_actual.get()
+        if perfil is None:
+            return funcion(*args, **kwargs)
+        ident = threading.get_ident()
+        perfil.hilos.add(ident)
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            perfil.hilos.discard(ident)
+    return envuelta
+
+
+def instrumentar_rutas(app):
+    """
+    FastAPI corre los endpoints síncronos y la validación de su respuesta en
+    el threadpool; se envuelven para saber qué hilo muestrear. Los async
+    corren en el loop y ya quedan cubiertos.
+    """
+    for ruta in app.router.routes:
+        dependant = getattr(ruta, "dependant", None)
+        if dependant is None or getattr(ruta, "_perfilado", False):
+            continue
+        if not asyncio.iscoroutinefunction(dependant.call):
+            dependant.call = _marcar_hilo(dependant.call)
+        campo = getattr(ruta, "response_field", None)
+        if campo is not None:
+            campo.validate = _marcar_hilo(campo.validate)
+        ruta._perfilado = True
+
+
+# =========================
+# Middleware
+# =========================
+class MiddlewarePerfilado:
+    """Middleware ASGI: perfila la petición y devuelve el nombre del archivo en X-Perfil"""
+
+    def __init__(self, app):
+        self.app = app
+        self._instrumentado = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/perfiles"):
+            await self.app(scope, receive, send)
+            return
+
+        if not self._instrumentado:
+            instrumentar_rutas(scope["app"])
+            self._instrumentado = True
+
+        pedido = permiso_valido(_header(scope, b"x-perfilar"))
+        if not pedido and not (PERFILADO_MUESTREO and random.random() < PERFILADO_MUESTREO):
+            await self.app(scope, receive, send)
+            return
+
+        perfil = Perfil()
+        # El nombre del archivo se decide antes de que salgan los headers
+        nombre = None
+
+        async def enviar(mensaje):
+            nonlocal nombre
+            if mensaje["type"] == "http.response.start" and pedido:
+                perfil.detener()
+                nombre = perfil.guardar(scope["method"], scope["path"])
+                mensaje = {**mensaje, "headers": list(mensaje.get("headers", [])) + [(b"x-perfil", nombre.encode())]}
+            await send(mensaje)
+
+        token = _perfil_actual.set(perfil)
+        perfil.iniciar()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            _perfil_actual.reset(token)
+            if nombre is None:
+                perfil.detener()
+                perfil.guardar(scope["method"], scope["path"])
+
+
+# =========================
+# Descarga
+# =========================
+perfilado_router = APIRouter(prefix="/perfiles", tags=["Perfilado"])
+
+
+def verificar_permiso(x_perfilar: Optional[str]):
+    """El header X-Perfilar firmado también protege otras rutas de diagnóstico (ej. /cache/estadisticas)"""
+    if not permiso_valido(x_perfilar):
+        raise HTTPException(status_code=403, detail="Permiso de perfilado inválido o vencido")
+
+
+@perfilado_router.get("", include_in_schema=False)
+def listar_perfiles(x_perfilar: Optional[str] = Header(None)):
+    verificar_permiso(x_perfilar)
+    if not os.path.isdir(PERFILES_DIR):
+        return {"ok": True, "perfiles": []}
+    archivos = sorted((a for a in os.listdir(PERFILES_DIR) if _NOMBRE_VALIDO.match(a)), reverse=True)
+    return {"ok": True, "perfiles": archivos}
+
+
+@perfilado_router.get("/{nombre}", include_in_schema=False)
+def descargar_perfil(nombre: str, x_perfilar: Optional[str] = Header(None)):
+    verificar_permiso(x_perfilar)
+    ruta = os.path.join(PERFILES_DIR, nombre)
+    if not _NOMBRE_VALIDO.match(nombre) or not os.path.isfile(ruta):
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return FileResponse(ruta, media_type="text/plain", filename=nombre)
+
+
+if __name__ == "__main__":
+    # python perfilado.py [segundos] -> valor del header X-Perfilar
+    print(firmar_permiso(int(sys.argv[1]) if len(sys.argv) > 1 else 600))
@@ -0,0 +1,198 @@
+# recordatorios.py
+# Recordatorios de eventos.
+#
+# Un heap en memoria guarda (momento, evento_id, minutos_antes) para cada
+# evento próximo y cada offset de RECORDATORIOS_OFFSETS_MIN. Una tarea asyncio
+# duerme hasta el siguiente vencimiento y avisa a los participantes por
+# /notificaciones/ws. Los participantes se consultan al momento de avisar,
+# así unirse o salir de un evento no obliga a tocar los timers.
+from datetime import datetime, timedelta
+from fastapi.concurrency import run_in_threadpool
+from bd import get_connection
+from notificaciones import notificar_usuarios
+import asyncio
+import heapq
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+RECORDATORIOS_OFFSETS_MIN = [
+    int(minutos) for minutos in os.getenv("RECORDATORIOS_OFFSETS_MIN", "1440,60").split(",") if minutos.strip()
+]
+# Cada cuánto se recarga el heap desde la BD (toma eventos creados en otros workers)
+RECORDATORIOS_RESINCRONIZAR_MIN = int(os.getenv("RECORDATORIOS_RESINCRONIZAR_MIN", "10"))
+MAX_ESPERA_SEGUNDOS = 60
+
+
+class PlanificadorRecordatorios:
+    """
+    Heap de recordatorios con borrado perezoso: reprogramar o cancelar un
+    evento solo sube su versión, y las entradas viejas se descartan al salir
+    del heap. Es seguro llamarlo desde los endpoints síncronos (threadpool).
+    """
+
+    def __init__(self, offsets_min):
+        self.offsets_min = sorted(set(offsets_min), reverse=True)
+        self._heap = []        # (momento, evento_id, minutos_antes, version)
+        self._versiones = {}   # evento_id -> versión vigente
+        self._lock = threading.Lock()
+        self._despachado_hasta = None   # Hasta dónde ya se sacaron vencidos del heap
+        self._loop = None
+        self._despertar = None
+
+    def _push(self, evento_id: int, fecha_hora: datetime, ahora: datetime):
+        version = self._versiones.get(evento_id, 0) + 1
+        self._versiones[evento_id] = version
+        for minutos in self.offsets_min:
+            momento = fecha_hora - timedelta(minutes=minutos)
+            if momento > ahora:
+                heapq.heappush(self._heap, (momento, evento_id, minutos, version))
+
+    def programar(self, evento_id: int, fecha_hora: datetime):
+        """Programa (o reprograma) los recordatorios de un evento"""
+        with self._lock:
+            self._push(evento_id, fecha_hora, datetime.now())
+            self._compactar_si_conviene()
+        self._avisar_cambio()
+
+    def cancelar(self, evento_id: int):
+        with self._lock:
+            if self._versiones.pop(evento_id, None) is not None:
+                self._compactar_si_conviene()
+        self._avisar_cambio()
+
+    def cargar(self, eventos):
+        """
+        Reemplaza todo el heap con [(evento_id, fecha_hora), ...] leídos de la BD.
+        Conserva los recordatorios posteriores al último despacho (no a "ahora"):
+        los que vencieron entremedio se envían en la siguiente vuelta.
+        """
+        with self._lock:
+            desde = self._despachado_hasta or datetime.now()
+            anteriores = self._versiones
+            self._heap = []
+            self._versiones = {}
+            for evento_id, fecha_hora in eventos:
+                # Mantener la numeración de versiones para invalidar lo ya leído
+                self._versiones[evento_id] = anteriores.get(evento_id, 0)
+                self._push(evento_id, fecha_hora, desde)
+        self._avisar_cambio()
+
+    def pendientes(self) -> int:
+        return len(self._heap)
+
+    def _compactar_si_conviene(self):
+        # Con muchas cancelaciones el heap acumula basura: se reconstruye si supera la mitad
+        if len(self._heap) > 1000 and len(self._heap) > 2 * len(self._versiones) * len(self.offsets_min):
+            self._heap = [e for e in self._heap if self._versiones.get(e[1]) == e[3]]
+            heapq.heapify(self._heap)
+
+    def _avisar_cambio(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._despertar.set)
+
+    def _extraer_vencidos(self, ahora: datetime):
+        """Saca del heap los recordatorios vigentes cuyo momento ya llegó"""
+        vencidos = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= ahora:
+                momento, evento_id, minutos, version = heapq.heappop(self._heap)
+                if self._versiones.get(evento_id) == version:
+                    vencidos.append((evento_id, minutos))
+            self._despachado_hasta = ahora
+            siguiente = self._heap[0][0] if self._heap else None
+        return vencidos, siguiente
+
+    async def ejecutar(self):
+        """Tarea de fondo: carga el estado desde la BD y despacha los recordatorios"""
+        self._loop = asyncio.get_running_loop()
+        self._despertar = asyncio.Event()
+        proxima_sincronizacion = datetime.now()
+
+        while True:
+            try:
+                ahora = datetime.now()
+                # Primero se despacha lo vencido, después se recarga desde la BD
+                vencidos, siguiente = self._extraer_vencidos(ahora)
+                if vencidos:
+                    await enviar_recordatorios(vencidos)
+                    continue
+
+                if ahora >= proxima_sincronizacion:
+                    eventos = await run_in_threadpool(cargar_eventos_proximos)
+                    self.cargar(eventos)
+                    proxima_sincronizacion = ahora + timedelta(minutes=RECORDATORIOS_RESINCRONIZAR_MIN)
+                    continue
+
+                espera = MAX_ESPERA_SEGUNDOS
+                if siguiente is not None:
+                    espera = min(espera, max((siguiente - datetime.now()).total_seconds(), 0))
+                self._despertar.clear()
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), timeout=espera)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception:
+                log.exception("Error en el planificador de recordatorios")
+                await asyncio.sleep(MAX_ESPERA_SEGUNDOS)
+
+
+def cargar_eventos_proximos():
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT id, fecha_hora FROM eventos_deportivos
+            WHERE estado = 'activo' AND fecha_hora > NOW()
+            """
+        )
+        eventos = [(fila["id"], fila["fecha_hora"]) for fila in cur.fetchall()]
+        cur.close()
+    finally:
+        conn.close()
+    return eventos
+
+
+def obtener_destinatarios(evento_ids):
+    """Una sola consulta para todos los eventos que vencen juntos"""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            SELECT e.id, e.nombre, e.fecha_hora, e.lugar,
+                   ARRAY_AGG(ue.usuario_id) AS participantes
+            FROM eventos_deportivos e
+            JOIN usuarios_eventos ue ON ue.evento_id = e.id
+            WHERE e.id = ANY(%s) AND e.estado = 'activo'
+            GROUP BY e.id
+            """,
+            (list(evento_ids),)
+        )
+        eventos = {fila["id"]: fila for fila in cur.fetchall()}
+        cur.close()
+    finally:
+        conn.close()
+    return eventos
+
+
+async def enviar_recordatorios(vencidos):
+    eventos = await run_in_threadpool(obtener_destinatarios, {evento_id for evento_id, _ in vencidos})
+    for evento_id, minutos in vencidos:
+        evento = eventos.get(evento_id)
+        if not evento:
+            continue
+        await notificar_usuarios(evento["participantes"], {
+            "tipo": "recordatorio_evento",
+            "evento_id": evento_id,
+            "nombre": evento["nombre"],
+            "fecha_hora": evento["fecha_hora"].isoformat(),
+            "lugar": evento["lugar"],
+            "minutos_antes": minutos
+        })
+
+
+planificador = PlanificadorRecordatorios(RECORDATORIOS_OFFSETS_MIN)
@@ -0,0 +1,175 @@
+# registro.py
+# Logs estructurados en JSON.
+#
+# Los módulos usan logging.getLogger(__name__) como siempre; configurar() deja
+# en el logger raíz un QueueHandler: quien loguea solo encola el registro
+# (sin formatear ni escribir) y un hilo aparte lo convierte a una línea JSON
+# y la escribe en stdout. Si la cola se llena, los registros se descartan y
+# se cuentan en sunity_logs_descartados_total en vez de frenar la petición.
+#
+# Cada línea lleva el id de la petición (X-Request-ID, o uno nuevo que se
+# devuelve en la respuesta) o el de la conexión websocket, y los campos que
+# se pasen en extra=. Los eventos frecuentes se muestrean con
+# extra={"muestreo": fraccion}; las advertencias y errores nunca.
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Optional
+from serializacion import OPCIONES_ORJSON
+from metricas import logs_descartados
+import logging
+import logging.handlers
+import orjson
+import os
+import queue
+import random
+import re
+import sys
+import traceback
+import uuid
+
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+LOG_COLA_MAX = int(os.getenv("LOG_COLA_MAX", "10000"))
+LOG_MUESTREO_WEBSOCKETS = float(os.getenv("LOG_MUESTREO_WEBSOCKETS", "0.1"))  # conexiones y desconexiones
+
+id_peticion: ContextVar[Optional[str]] = ContextVar("id_peticion", default=None)
+id_conexion: ContextVar[Optional[str]] = ContextVar("id_conexion", default=None)
+
+_ID_VALIDO = re.compile(r"^[\w.-]{1,64}$")
+# Atributos propios de LogRecord: el resto vino en extra= y va al JSON
+_ATRIBUTOS_BASE = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "muestreo", "peticion", "conexion"}
+
+_listener = None
+
+
+# =========================
+# Formato
+# =========================
+def _por_defecto(valor):
+    """Lo que orjson no conoce (Decimal, excepciones, objetos) va como texto"""
+    return float(valor) if isinstance(valor, Decimal) else str(valor)
+
+
+class FormatoJSON(logging.Formatter):
+
+    def format(self, record) -> str:
+        datos = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        for clave in ("peticion", "conexion"):
+            valor = getattr(record, clave, None)
+            if valor is not None:
+                datos[clave] = valor
+        muestreo = getattr(record, "muestreo", None)
+        if muestreo is not None:
+            datos["muestreo"] = muestreo
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_BASE and clave not in datos:
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+        return orjson.dumps(datos, default=_por_defecto, option=OPCIONES_ORJSON).decode()
+
+
+# =========================
+# Handler con cola
+# =========================
+class HandlerCola(logging.handlers.QueueHandler):
+    """
+    Encola el registro tal cual, con los ids de correlación del contexto
+    actual. El formateo (incluida la traza de la excepción) se hace en el
+    hilo que escribe.
+    """
+
+    def filter(self, record) -> bool:
+        muestreo = getattr(record, "muestreo", None)
+        if muestreo is not None and record.levelno < logging.WARNING and random.random() >= muestreo:
+            return False
+        return super().filter(record)
+
+    def prepare(self, record):
+        record.peticion = id_peticion.get()
+        record.conexion = id_conexion.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            logs_descartados.inc()
+
+
+def configurar():
+    """Deja el logger raíz escribiendo JSON por la cola (una sola vez por proceso)"""
+    global _listener
+    if _listener is not None:
+        return
+    cola = queue.Queue(maxsize=LOG_COLA_MAX)
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoJSON())
+    _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+    _listener.start()
+
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(HandlerCola(cola))
+    raiz.setLevel(LOG_NIVEL)
+
+
+def detener():
+    """Escribe lo que quede en la cola (al apagar la app)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# =========================
+# Middleware
+# =========================
+class MiddlewareCorrelacion:
+    """
+    Middleware ASGI: fija el id de la petición (o de la conexión websocket)
+    para todo lo que se loguee mientras se atiende, también desde el
+    threadpool, y lo devuelve en X-Request-ID.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            token = id_conexion.set(uuid.uuid4().hex[:16])
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                id_conexion.reset(token)
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        recibido = None
+        for clave, valor in scope["headers"]:
+            if clave == b"x-request-id":
+                recibido = valor.decode("latin-1")
+                break
+        identificador = recibido if recibido and _ID_VALIDO.match(recibido) else uuid.uuid4().hex[:16]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje = {
+                    **mensaje,
+                    "headers": list(mensaje.get("headers", [])) + [(b"x-request-id", identificador.encode())],
+                }
+            await send(mensaje)
+
+        token = id_peticion.set(identificador)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            id_peticion.reset(token)
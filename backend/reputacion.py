@@ -0,0 +1,119 @@
+# reputacion.py
+# Reputación de usuarios con decaimiento en el tiempo.
+#
+# Cada calificación pesa 0.5 ** (edad / vida media), así una opinión de la
+# semana pasada cuenta más que una de hace dos años. Las calificaciones entre
+# usuarios dan un promedio ponderado (suavizado hacia REPUTACION_INICIAL para
+# quien tiene pocas) y las del sistema (abandonos, etc.) se restan aparte
+# como penalización, con su propia vida media.
+#
+# Se recalcula para todos en una sola sentencia SQL cada
+# REPUTACION_INTERVALO_HORAS desde main.py, o a mano:
+#     python reputacion.py
+from fastapi.concurrency import run_in_threadpool
+from bd import get_connection
+import asyncio
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+REPUTACION_INTERVALO_HORAS = float(os.getenv("REPUTACION_INTERVALO_HORAS", "6"))
+VIDA_MEDIA_PARES_DIAS = 180     # Calificaciones entre usuarios
+VIDA_MEDIA_SISTEMA_DIAS = 90    # Penalizaciones del sistema: se perdonan antes
+REPUTACION_INICIAL = 3.5        # Puntaje de quien aún no tiene calificaciones
+PESO_INICIAL = 2.0              # Equivale a 2 calificaciones recientes de REPUTACION_INICIAL
+ESTRELLAS_POR_PENALIZACION = 0.5  # Lo que resta una penalización reciente de 1 estrella
+
+# Clave del advisory lock: con varios workers, solo uno recalcula a la vez
+LOCK_REPUTACION = 7_302_002
+
+
+def calcular_reputaciones() -> int:
+    """Recalcula reputacion_usuarios completa y devuelve cuántos usuarios tiene"""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s) AS tomado", (LOCK_REPUTACION,))
+        if not cur.fetchone()["tomado"]:
+            return 0
+
+        cur.execute(
+            """
+            WITH pesos AS (
+                SELECT
+                    evaluado_id,
+                    tipo,
+                    estrellas,
+                    -- El tope del exponente evita el underflow de EXP con calificaciones muy viejas
+                    EXP(GREATEST(
+                        LN(0.5) * EXTRACT(EPOCH FROM (NOW() - fecha_calificacion)) / 86400
+                        / CASE WHEN tipo = 'sistema' THEN %(vida_sistema)s ELSE %(vida_pares)s END,
+                        -50
+                    )) AS peso
+                FROM calificaciones_usuarios
+            ),
+            por_usuario AS (
+                SELECT
+                    evaluado_id,
+                    COALESCE(SUM(peso * estrellas) FILTER (WHERE tipo <> 'sistema'), 0) AS suma_pares,
+                    COALESCE(SUM(peso) FILTER (WHERE tipo <> 'sistema'), 0) AS peso_pares,
+                    COALESCE(SUM(peso * (5 - estrellas) / 4.0) FILTER (WHERE tipo = 'sistema'), 0) AS penalizacion
+                FROM pesos
+                GROUP BY evaluado_id
+            ),
+            promedios AS (
+                SELECT
+                    evaluado_id,
+                    (suma_pares + %(inicial)s * %(peso_inicial)s) / (peso_pares + %(peso_inicial)s) AS promedio_pares,
+                    peso_pares,
+                    penalizacion
+                FROM por_usuario
+            )
+            INSERT INTO reputacion_usuarios AS r
+                (usuario_id, puntaje, promedio_pares, peso_pares, penalizacion, calculado_en)
+            SELECT
+                evaluado_id,
+                GREATEST(1, LEAST(5, promedio_pares - %(por_penalizacion)s * penalizacion)),
+                promedio_pares,
+                peso_pares,
+                penalizacion,
+                NOW()
+            FROM promedios
+            ON CONFLICT (usuario_id) DO UPDATE SET
+                puntaje = EXCLUDED.puntaje,
+                promedio_pares = EXCLUDED.promedio_pares,
+                peso_pares = EXCLUDED.peso_pares,
+                penalizacion = EXCLUDED.penalizacion,
+                calculado_en = EXCLUDED.calculado_en
+            """,
+            {
+                "vida_pares": VIDA_MEDIA_PARES_DIAS,
+                "vida_sistema": VIDA_MEDIA_SISTEMA_DIAS,
+                "inicial": REPUTACION_INICIAL,
+                "peso_inicial": PESO_INICIAL,
+                "por_penalizacion": ESTRELLAS_POR_PENALIZACION,
+            }
+        )
+        total = cur.rowcount
+        # Usuarios que ya no tienen calificaciones (NOW() es el mismo en toda la transacción)
+        cur.execute("DELETE FROM reputacion_usuarios WHERE calculado_en <> NOW()")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return total
+
+
+async def ciclo_reputacion():
+    """Tarea de fondo: recalcula cada REPUTACION_INTERVALO_HORAS"""
+    while True:
+        try:
+            await run_in_threadpool(calcular_reputaciones)
+        except Exception:
+            log.exception("Error calculando reputaciones")
+        await asyncio.sleep(REPUTACION_INTERVALO_HORAS * 3600)
+
+
+if __name__ == "__main__":
+    print(f"Reputaciones calculadas: {calcular_reputaciones()}")
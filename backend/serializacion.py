@@ -0,0 +1,32 @@
+# serializacion.py
+# Serialización JSON de las respuestas.
+#
+# RespuestaJSON es la clase de respuesta por defecto de la app: usa orjson,
+# que escribe datetime, date y UUID de forma nativa (mismo formato ISO que
+# isoformat()) y es varias veces más rápido que json de la librería estándar.
+# Las filas de la BD se pueden devolver tal cual, sin recorrerlas para
+# convertir fechas. Lo que orjson no conoce (Decimal de NUMERIC, las vistas
+# de solo lectura del catálogo) se convierte en _por_defecto.
+from decimal import Decimal
+from types import MappingProxyType
+from fastapi.responses import ORJSONResponse
+import orjson
+
+OPCIONES_ORJSON = orjson.OPT_NON_STR_KEYS  # ej: la distribución de estrellas usa claves int
+
+
+def _por_defecto(valor):
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, MappingProxyType):
+        return dict(valor)
+    raise TypeError(f"Tipo no serializable a JSON: {type(valor).__name__}")
+
+
+def a_json(contenido) -> bytes:
+    return orjson.dumps(contenido, default=_por_defecto, option=OPCIONES_ORJSON)
+
+
+class RespuestaJSON(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return a_json(content)
@@ -0,0 +1,260 @@
+# sugerencias.py
+# Sugerencias de amistad.
+#
+# Para cada usuario se materializan en sugerencias_amistad los mejores
+# candidatos que aún no son amigos, con un puntaje que combina amigos en
+# común, eventos compartidos, misma universidad/carrera y mismo deporte.
+# Se recalculan al leerlas si están vencidas o marcadas como desactualizadas;
+# un cambio de amistad recalcula a los dos involucrados y marca a sus amigos.
+from typing import Iterable, List, Optional
+from fastapi import APIRouter, HTTPException, Cookie, Query
+from pydantic import BaseModel
+from autenticacion import verify_token
+from bd import get_connection
+from grafo_amistad import grafo as grafo_amistad
+import logging
+import psycopg2.extras
+
+log = logging.getLogger(__name__)
+
+# =========================
+# Configuración de sugerencias
+# =========================
+SUGERENCIAS_POR_USUARIO = 50    # Candidatos materializados por usuario
+CANDIDATOS_POR_PERFIL = 100     # Máximo de candidatos que entran solo por universidad
+SUGERENCIAS_VIGENCIA_HORAS = 24
+
+PESO_AMIGO_EN_COMUN = 3.0
+PESO_EVENTO_EN_COMUN = 2.0
+PESO_MISMA_UNIVERSIDAD = 1.5
+PESO_MISMA_CARRERA = 1.0
+PESO_MISMO_DEPORTE = 0.5
+
+# Clave del advisory lock (junto al usuario): dos recálculos del mismo
+# usuario a la vez borrarían e insertarían las mismas filas
+LOCK_SUGERENCIAS = 7_302_004
+
+# =========================
+# Router para sugerencias
+# =========================
+sugerencias_router = APIRouter(prefix="/amistad", tags=["Amistad"])
+
+
+def refrescar_sugerencias(cur, usuario_id: str):
+    """
+    Recalcula las sugerencias de un usuario. Los candidatos salen de:
+    amigos de amigos, compañeros de eventos y (acotado) misma universidad.
+    Hasta el commit, otro recálculo del mismo usuario espera su turno.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (LOCK_SUGERENCIAS, usuario_id))
+    cur.execute("DELETE FROM sugerencias_amistad WHERE usuario_id = %s", (usuario_id,))
+    cur.execute(
+        """
+        WITH mis_amigos AS (
+            SELECT amigo_id AS id FROM amistades WHERE usuario_id = %(u)s
+        ),
+        excluidos AS (
+            SELECT id FROM mis_amigos
+            UNION SELECT %(u)s
+            UNION SELECT destinatario_id FROM solicitudes_amistad
+                  WHERE solicitante_id = %(u)s AND estado = 'pendiente'
+            UNION SELECT solicitante_id FROM solicitudes_amistad
+                  WHERE destinatario_id = %(u)s AND estado = 'pendiente'
+        ),
+        por_amigos AS (
+            SELECT a.amigo_id AS candidato, COUNT(*) AS amigos_en_comun
+            FROM mis_amigos m
+            JOIN amistades a ON a.usuario_id = m.id
+            GROUP BY a.amigo_id
+        ),
+        por_eventos AS (
+            SELECT otro.usuario_id AS candidato, COUNT(DISTINCT otro.evento_id) AS eventos_en_comun
+            FROM usuarios_eventos mio
+            JOIN usuarios_eventos otro ON otro.evento_id = mio.evento_id
+            WHERE mio.usuario_id = %(u)s
+            GROUP BY otro.usuario_id
+        ),
+        yo AS (
+            SELECT universidad_o_instituto, carrera, deporte_favorito
+            FROM usuarios WHERE google_id = %(u)s
+        ),
+        por_perfil AS (
+            SELECT u.google_id AS candidato
+            FROM usuarios u, yo
+            WHERE yo.universidad_o_instituto IS NOT NULL
+              AND u.universidad_o_instituto = yo.universidad_o_instituto
+            ORDER BY (u.carrera = yo.carrera) DESC NULLS LAST, u.fecha_registro DESC
+            LIMIT %(max_perfil)s
+        ),
+        candidatos AS (
+            SELECT candidato FROM por_amigos
+            UNION SELECT candidato FROM por_eventos
+            UNION SELECT candidato FROM por_perfil
+        )
+        INSERT INTO sugerencias_amistad
+            (usuario_id, sugerido_id, puntaje, amigos_en_comun, eventos_en_comun,
+             misma_universidad, misma_carrera, mismo_deporte)
+        SELECT
+            %(u)s,
+            c.candidato,
+            COALESCE(pa.amigos_en_comun, 0) * %(p_amigo)s
+              + COALESCE(pe.eventos_en_comun, 0) * %(p_evento)s
+              + CASE WHEN u.universidad_o_instituto = yo.universidad_o_instituto THEN %(p_universidad)s ELSE 0 END
+              + CASE WHEN u.carrera = yo.carrera THEN %(p_carrera)s ELSE 0 END
+              + CASE WHEN u.deporte_favorito = yo.deporte_favorito THEN %(p_deporte)s ELSE 0 END AS puntaje,
+            COALESCE(pa.amigos_en_comun, 0),
+            COALESCE(pe.eventos_en_comun, 0),
+            (u.universidad_o_instituto = yo.universidad_o_instituto) IS TRUE,
+            (u.carrera = yo.carrera) IS TRUE,
+            (u.deporte_favorito = yo.deporte_favorito) IS TRUE
+        FROM candidatos c
+        JOIN usuarios u ON u.google_id = c.candidato
+        CROSS JOIN yo
+        LEFT JOIN por_amigos pa ON pa.candidato = c.candidato
+        LEFT JOIN por_eventos pe ON pe.candidato = c.candidato
+        WHERE c.candidato NOT IN (SELECT id FROM excluidos)
+        ORDER BY puntaje DESC
+        LIMIT %(max)s
+        """,
+        {
+            "u": usuario_id,
+            "max": SUGERENCIAS_POR_USUARIO,
+            "max_perfil": CANDIDATOS_POR_PERFIL,
+            "p_amigo": PESO_AMIGO_EN_COMUN,
+            "p_evento": PESO_EVENTO_EN_COMUN,
+            "p_universidad": PESO_MISMA_UNIVERSIDAD,
+            "p_carrera": PESO_MISMA_CARRERA,
+            "p_deporte": PESO_MISMO_DEPORTE,
+        }
+    )
+    cur.execute(
+        """
+        INSERT INTO sugerencias_estado (usuario_id, actualizado_en, desactualizado)
+        VALUES (%s, CURRENT_TIMESTAMP, FALSE)
+        ON CONFLICT (usuario_id)
+        DO UPDATE SET actualizado_en = EXCLUDED.actualizado_en, desactualizado = FALSE
+        """,
+        (usuario_id,)
+    )
+
+
+def refrescar_tras_cambio_amistad(usuario_a: str, usuario_b: str):
+    """
+    Tarea de fondo tras crear o borrar una amistad: recalcula a los dos
+    usuarios y marca como desactualizados a sus amigos, cuyos conteos de
+    amigos en común cambiaron. Esos se recalculan cuando los vuelvan a pedir.
+    """
+    afectados = (grafo_amistad.amigos_de(usuario_a) | grafo_amistad.amigos_de(usuario_b)) - {usuario_a, usuario_b}
+    try:
+        conn = get_connection()
+        try:
+            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            # Siempre en el mismo orden: los locks de ambos se toman en esta transacción
+            for usuario_id in sorted((usuario_a, usuario_b)):
+                refrescar_sugerencias(cur, usuario_id)
+            marcar_desactualizados(cur, afectados)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+    except Exception:
+        log.exception("Error refrescando sugerencias de amistad")
+
+
+def marcar_desactualizados(cur, usuario_ids: Iterable[str]):
+    """Fuerza que las sugerencias de estos usuarios se recalculen en su próxima lectura"""
+    usuario_ids = list(usuario_ids)
+    if not usuario_ids:
+        return
+    cur.execute(
+        "UPDATE sugerencias_estado SET desactualizado = TRUE WHERE usuario_id = ANY(%s)",
+        (usuario_ids,)
+    )
+
+
+class Sugerencia(BaseModel):
+    google_id: str
+    nombre: str
+    foto_perfil: Optional[str] = None
+    universidad_o_instituto: Optional[str] = None
+    carrera: Optional[str] = None
+    deporte_favorito: Optional[str] = None
+    amigos_en_comun: int
+    eventos_en_comun: int
+    misma_universidad: bool
+    misma_carrera: bool
+    mismo_deporte: bool
+    puntaje: float
+
+
+class SugerenciasRespuesta(BaseModel):
+    ok: bool
+    sugerencias: List[Sugerencia]
+
+
+@sugerencias_router.get("/sugerencias", response_model=SugerenciasRespuesta)
+def obtener_sugerencias(
+    limite: int = Query(20, ge=1, le=SUGERENCIAS_POR_USUARIO),
+    access_token: str = Cookie(None)
+):
+    """
+    Devuelve personas sugeridas para agregar, ordenadas por puntaje,
+    con la cantidad de amigos y eventos en común.
+    """
+    usuario_id = verify_token(access_token)
+
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+        cur.execute(
+            """
+            SELECT 1 FROM sugerencias_estado
+            WHERE usuario_id = %s
+              AND NOT desactualizado
+              AND actualizado_en > CURRENT_TIMESTAMP - make_interval(hours => %s)
+            """,
+            (usuario_id, SUGERENCIAS_VIGENCIA_HORAS)
+        )
+        if cur.fetchone() is None:
+            refrescar_sugerencias(cur, usuario_id)
+            conn.commit()
+
+        cur.execute(
+            """
+            SELECT
+                s.sugerido_id AS google_id,
+                u.nombre,
+                u.foto_perfil,
+                u.universidad_o_instituto,
+                u.carrera,
+                u.deporte_favorito,
+                s.amigos_en_comun,
+                s.eventos_en_comun,
+                s.misma_universidad,
+                s.misma_carrera,
+                s.mismo_deporte,
+                s.puntaje
+            FROM sugerencias_amistad s
+            JOIN usuarios u ON u.google_id = s.sugerido_id
+            WHERE s.usuario_id = %s
+            ORDER BY s.puntaje DESC
+            LIMIT %s
+            """,
+            # Se piden de más por si algunas ya no aplican (solicitud enviada desde entonces)
+            (usuario_id, limite * 2)
+        )
+        sugerencias = cur.fetchall()
+        cur.close()
+    except Exception:
+        log.exception("Error obteniendo sugerencias de amistad")
+        raise HTTPException(status_code=500, detail="Error interno obteniendo sugerencias")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    if grafo_amistad.cargado:
+        sugerencias = [s for s in sugerencias if grafo_amistad.estado(usuario_id, s["google_id"]) == "ninguno"]
+
+    return {"ok": True, "sugerencias": sugerencias[:limite]}
@@ -11,9 +11,24 @@ CREATE TABLE usuarios (
     descripcion TEXT,    
     universidad_o_instituto VARCHAR(150),  -- Universidad o Instituto profesional
     carrera VARCHAR(100),                   -- Carrera que estudia o estudió
-    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    ics_version INT NOT NULL DEFAULT 0,   -- Versión del feed .ics: subirla invalida las URLs ya entregadas
+    -- Texto donde busca /usuarios/buscar (nombre, correo, universidad y carrera en minúsculas)
+    texto_busqueda TEXT GENERATED ALWAYS AS (
+        LOWER(nombre || ' ' || email || ' ' || COALESCE(universidad_o_instituto, '') || ' ' || COALESCE(carrera, ''))
+    ) STORED
 );
 
+-- Búsqueda de usuarios: trigramas para coincidencias en cualquier parte del texto
+-- y un índice de prefijo para el autocompletado con 1 o 2 letras
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX idx_usuarios_texto_busqueda_trgm
+ON usuarios USING GIN (texto_busqueda gin_trgm_ops);
+
+CREATE INDEX idx_usuarios_nombre_prefijo
+ON usuarios (LOWER(nombre) text_pattern_ops);
+
 
 
 CREATE TABLE grupos_deportivos (
@@ -22,6 +37,18 @@ CREATE TABLE grupos_deportivos (
     descripcion TEXT                      -- Opcional, para detallar el grupo
 );
 
+-- Avisa a los workers (catalogo_grupos.py) que recarguen el catálogo
+CREATE FUNCTION notificar_cambio_grupos() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('sunity_grupos', '{}');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER grupos_notificar_cambio
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON grupos_deportivos
+FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambio_grupos();
+
 
 CREATE TABLE eventos_deportivos (
     id SERIAL PRIMARY KEY,
@@ -34,7 +61,8 @@ CREATE TABLE eventos_deportivos (
     latitud DECIMAL(9,6),              -- Latitud para Google Maps
     longitud DECIMAL(9,6),             -- Longitud para Google Maps
     max_participantes INT NOT NULL,    -- Cantidad máxima de participantes
-    precio INT NOT NULL                -- Precio del evento (entero, en pesos por ejemplo)
+    precio INT NOT NULL,               -- Precio del evento (entero, en pesos por ejemplo)
+    estado VARCHAR(20) NOT NULL DEFAULT 'activo'  -- 'activo' o 'cancelado' (se borra en segundo plano)
 );
 
 CREATE TABLE usuarios_eventos (
@@ -44,6 +72,20 @@ CREATE TABLE usuarios_eventos (
     fecha_union TIMESTAMP DEFAULT CURRENT_TIMESTAMP                           -- Fecha de inscripción al evento
 );
 
+-- Índices para el calendario: eventos de un usuario y conteo de inscritos por evento
+CREATE INDEX idx_usuarios_eventos_usuario
+ON usuarios_eventos (usuario_id, evento_id);
+
+CREATE INDEX idx_usuarios_eventos_evento
+ON usuarios_eventos (evento_id);
+
+-- Índices para filtrar eventos por fecha y por anfitrión
+CREATE INDEX idx_eventos_fecha_hora
+ON eventos_deportivos (fecha_hora);
+
+CREATE INDEX idx_eventos_anfitrion
+ON eventos_deportivos (anfitrion_id, fecha_hora);
+
 
 
 -- Tabla de amistades confirmadas
@@ -59,6 +101,22 @@ CREATE TABLE amigos (
 CREATE UNIQUE INDEX amigos_unico_idx 
 ON amigos (LEAST(usuario_id, amigo_id), GREATEST(usuario_id, amigo_id));
 
+-- Índices para recorrer amistades en ambos sentidos (amigos de amigos).
+-- Incluyen fecha_amistad para que la lista de amigos (vista amistades) se
+-- resuelva con index-only scans, sin ir a la tabla
+CREATE INDEX idx_amigos_usuario
+ON amigos (usuario_id, amigo_id) INCLUDE (fecha_amistad);
+
+CREATE INDEX idx_amigos_amigo
+ON amigos (amigo_id, usuario_id) INCLUDE (fecha_amistad);
+
+-- Cada amistad vista desde ambos lados: "amigos de X" es WHERE usuario_id = X,
+-- y cada rama del UNION ALL usa su propio índice
+CREATE VIEW amistades AS
+    SELECT usuario_id, amigo_id, fecha_amistad FROM amigos
+    UNION ALL
+    SELECT amigo_id, usuario_id, fecha_amistad FROM amigos;
+
 -- Tabla de solicitudes de amistad
 CREATE TABLE solicitudes_amistad (
     id SERIAL PRIMARY KEY,
@@ -71,6 +129,66 @@ CREATE TABLE solicitudes_amistad (
     CONSTRAINT no_solicitud_propia CHECK (solicitante_id <> destinatario_id)
 );
 
+-- Avisa a los workers (grafo_amistad.py) cada cambio de amistades y solicitudes pendientes
+CREATE FUNCTION notificar_cambio_amistad() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'amigos' THEN
+        IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('sunity_amistad', json_build_object(
+                'op', 'quitar_amistad', 'a', OLD.usuario_id, 'b', OLD.amigo_id)::text);
+        ELSE
+            PERFORM pg_notify('sunity_amistad', json_build_object(
+                'op', 'agregar_amistad', 'a', NEW.usuario_id, 'b', NEW.amigo_id)::text);
+        END IF;
+    ELSE
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.estado = 'pendiente' THEN
+            PERFORM pg_notify('sunity_amistad', json_build_object(
+                'op', 'quitar_solicitud', 'a', OLD.solicitante_id, 'b', OLD.destinatario_id)::text);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.estado = 'pendiente' THEN
+            PERFORM pg_notify('sunity_amistad', json_build_object(
+                'op', 'agregar_solicitud', 'a', NEW.solicitante_id, 'b', NEW.destinatario_id)::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER amigos_notificar_cambio
+AFTER INSERT OR DELETE ON amigos
+FOR EACH ROW EXECUTE FUNCTION notificar_cambio_amistad();
+
+CREATE TRIGGER solicitudes_notificar_cambio
+AFTER INSERT OR UPDATE OR DELETE ON solicitudes_amistad
+FOR EACH ROW EXECUTE FUNCTION notificar_cambio_amistad();
+
+-- Sugerencias de amistad materializadas por usuario (sugerencias.py)
+CREATE TABLE sugerencias_amistad (
+    usuario_id VARCHAR(255) NOT NULL REFERENCES usuarios(google_id) ON DELETE CASCADE,
+    sugerido_id VARCHAR(255) NOT NULL REFERENCES usuarios(google_id) ON DELETE CASCADE,
+    puntaje REAL NOT NULL,
+    amigos_en_comun INT NOT NULL DEFAULT 0,
+    eventos_en_comun INT NOT NULL DEFAULT 0,
+    misma_universidad BOOLEAN NOT NULL DEFAULT FALSE,
+    misma_carrera BOOLEAN NOT NULL DEFAULT FALSE,
+    mismo_deporte BOOLEAN NOT NULL DEFAULT FALSE,
+    PRIMARY KEY (usuario_id, sugerido_id)
+);
+
+CREATE INDEX idx_sugerencias_amistad_puntaje
+ON sugerencias_amistad (usuario_id, puntaje DESC);
+
+-- Cuándo se calcularon las sugerencias de cada usuario y si un cambio de amistad las dejó viejas
+CREATE TABLE sugerencias_estado (
+    usuario_id VARCHAR(255) PRIMARY KEY REFERENCES usuarios(google_id) ON DELETE CASCADE,
+    actualizado_en TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    desactualizado BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+-- Candidatos de la misma universidad, los más recientes primero
+CREATE INDEX idx_usuarios_universidad
+ON usuarios (universidad_o_instituto, fecha_registro DESC);
+
 
 
 CREATE TABLE mensajes_amigos (
@@ -104,23 +222,124 @@ CREATE TABLE calificaciones_usuarios (
     estrellas INTEGER NOT NULL CHECK (estrellas BETWEEN 1 AND 5),  -- de 1 a 5 estrellas
     tipo VARCHAR(20) NOT NULL DEFAULT 'usuario',  -- 'usuario' o 'sistema'
     motivo VARCHAR(100),  -- ejemplo: 'abandono_evento', 'cancelacion_evento'
-    fecha_calificacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    evento_id INT,        -- evento que originó la calificación (sin FK: el evento puede borrarse o archivarse)
+    fecha_calificacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT no_auto_calificacion CHECK (
         evaluador_id IS NULL OR evaluador_id <> evaluado_id
     )
 );
 
+-- Detalle de calificaciones recibidas, paginado de la más nueva a la más antigua
+CREATE INDEX idx_calificaciones_evaluado_fecha
+ON calificaciones_usuarios (evaluado_id, fecha_calificacion DESC, id DESC);
 
+-- Cada participante califica a cada compañero una sola vez por evento
+CREATE UNIQUE INDEX calificaciones_evento_unica_idx
+ON calificaciones_usuarios (evaluador_id, evaluado_id, evento_id)
+WHERE tipo = 'usuario' AND evento_id IS NOT NULL;
 
+-- Una sola penalización del sistema por usuario, evento y motivo
+CREATE UNIQUE INDEX calificaciones_sistema_unica_idx
+ON calificaciones_usuarios (evaluado_id, evento_id, motivo)
+WHERE tipo = 'sistema';
 
+-- Salidas de eventos y cancelaciones de anfitriones. penalizaciones.py las revisa
+-- cuando el evento termina y penaliza las que fueron a última hora.
+-- Sin FK a eventos_deportivos: un evento cancelado se borra en segundo plano.
+CREATE TABLE abandonos_eventos (
+    id SERIAL PRIMARY KEY,
+    usuario_id VARCHAR(255) NOT NULL REFERENCES usuarios(google_id) ON DELETE CASCADE,
+    evento_id INT NOT NULL,
+    motivo VARCHAR(100) NOT NULL,          -- 'abandono_evento' o 'cancelacion_evento'
+    fecha_evento TIMESTAMP NOT NULL,
+    fecha_abandono TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    procesado BOOLEAN NOT NULL DEFAULT FALSE
+);
 
+CREATE INDEX idx_abandonos_pendientes
+ON abandonos_eventos (fecha_evento)
+WHERE NOT procesado;
+
+-- Resumen por usuario calificado: se actualiza en la misma transacción que cada
+-- calificación nueva, así el promedio de un perfil es una lectura por PK.
+-- Se reconstruye desde cero con: python calificaciones.py --reconstruir
+CREATE TABLE calificaciones_resumen (
+    evaluado_id VARCHAR(255) PRIMARY KEY REFERENCES usuarios(google_id) ON DELETE CASCADE,
+    cantidad INT NOT NULL DEFAULT 0,
+    suma INT NOT NULL DEFAULT 0,      -- suma de estrellas (promedio = suma / cantidad)
+    estrellas_1 INT NOT NULL DEFAULT 0,
+    estrellas_2 INT NOT NULL DEFAULT 0,
+    estrellas_3 INT NOT NULL DEFAULT 0,
+    estrellas_4 INT NOT NULL DEFAULT 0,
+    estrellas_5 INT NOT NULL DEFAULT 0
+);
 
+-- Reputación con decaimiento temporal, recalculada en lote por reputacion.py.
+-- Quien no tiene fila aún no recibe calificaciones (vale REPUTACION_INICIAL).
+CREATE TABLE reputacion_usuarios (
+    usuario_id VARCHAR(255) PRIMARY KEY REFERENCES usuarios(google_id) ON DELETE CASCADE,
+    puntaje REAL NOT NULL,           -- 1 a 5, lo que se muestra y se usa para ordenar
+    promedio_pares REAL NOT NULL,    -- promedio ponderado de calificaciones entre usuarios
+    peso_pares REAL NOT NULL,        -- suma de pesos (cuántas calificaciones "recientes" equivale)
+    penalizacion REAL NOT NULL,      -- penalizaciones del sistema ponderadas
+    calculado_en TIMESTAMP NOT NULL
+);
 
 
 
+-- =========================================
+-- HISTÓRICO DE EVENTOS PASADOS
+-- =========================================
+-- archivo.py mueve aquí los eventos más antiguos que ARCHIVO_HORIZONTE_DIAS,
+-- junto con sus inscripciones y mensajes. Las tablas están particionadas por
+-- mes según la fecha del evento; archivo.py crea las particiones antes de
+-- mover filas. Un mes viejo se puede exportar o desprender con
+-- ALTER TABLE ... DETACH PARTITION sin tocar las tablas en uso.
+
+CREATE TABLE eventos_deportivos_historico (
+    id INT NOT NULL,
+    grupo_id INT,
+    anfitrion_id VARCHAR(255),
+    nombre VARCHAR(100) NOT NULL,
+    descripcion TEXT,
+    fecha_hora TIMESTAMP NOT NULL,
+    lugar VARCHAR(200),
+    latitud DECIMAL(9,6),
+    longitud DECIMAL(9,6),
+    max_participantes INT NOT NULL,
+    precio INT NOT NULL,
+    estado VARCHAR(20) NOT NULL,
+    archivado_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, fecha_hora)
+) PARTITION BY RANGE (fecha_hora);
+
+CREATE INDEX idx_eventos_historico_anfitrion
+ON eventos_deportivos_historico (anfitrion_id, fecha_hora);
+
+CREATE TABLE usuarios_eventos_historico (
+    id INT NOT NULL,
+    usuario_id VARCHAR(255),
+    evento_id INT NOT NULL,
+    fecha_union TIMESTAMP,
+    fecha_evento TIMESTAMP NOT NULL,  -- fecha_hora del evento, define la partición
+    PRIMARY KEY (id, fecha_evento)
+) PARTITION BY RANGE (fecha_evento);
+
+CREATE INDEX idx_usuarios_eventos_historico_usuario
+ON usuarios_eventos_historico (usuario_id, fecha_evento);
+
+CREATE INDEX idx_usuarios_eventos_historico_evento
+ON usuarios_eventos_historico (evento_id);
+
+CREATE TABLE mensajes_eventos_historico (
+    id INT NOT NULL,
+    evento_id INT NOT NULL,
+    remitente_id VARCHAR(255),
+    mensaje TEXT NOT NULL,
+    fecha_envio TIMESTAMP,
+    fecha_evento TIMESTAMP NOT NULL,  -- fecha_hora del evento, define la partición
+    PRIMARY KEY (id, fecha_evento)
+) PARTITION BY RANGE (fecha_evento);
 
-
-
-
-
-
+CREATE INDEX idx_mensajes_eventos_historico_evento
+ON mensajes_eventos_historico (evento_id, fecha_envio);